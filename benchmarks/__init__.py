@@ -0,0 +1,8 @@
+"""
+Benchmarks of the calculation engine, the signals and the views, over synthetic data (see
+generator.py) written to a throwaway SQLite database. Run them from the project root:
+
+python -m benchmarks --offices 5 --users 40 --years 2 --output results.json
+
+The wall times and the query counts are reported as JSON, so that runs may be compared over time.
+"""
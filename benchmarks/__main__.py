@@ -0,0 +1,99 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description='Times the calculation engine, the signals and the views over synthetic '
+                    'data, written to a throwaway SQLite database, and reports the wall times '
+                    'and the query counts as JSON.')
+    parser.add_argument('--offices', type=int, default=2, help='Number of offices (default: 2)')
+    parser.add_argument('--users', type=int, default=20,
+                        help='Number of workers of each office (default: 20)')
+    parser.add_argument('--years', type=float, default=1,
+                        help='Years of tickets, absences and restdays (default: 1)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random data')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs of each benchmark (default: 3)')
+    parser.add_argument('--output', help='File to write the results to (default: stdout)')
+    parser.add_argument('--keep-db', action='store_true',
+                        help='Keeps the database, to be inspected after the run')
+    return parser.parse_args()
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    args = parse_args()
+    handle, path = tempfile.mkstemp(prefix='gerencex-benchmarks-', suffix='.sqlite3')
+    os.close(handle)
+
+    # The settings read the database from the environment, so it must be set before Django is
+    os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    # The metrics of the runs must not be added to those of the host's processes
+    metrics_dir = tempfile.mkdtemp(prefix='gerencex-benchmarks-metrics-')
+    os.environ['METRICS_DIR'] = metrics_dir
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gerencex.settings')
+
+    import django
+    django.setup()
+
+    from django.core.management import call_command
+    from django.test.utils import setup_test_environment
+    from benchmarks.cases import run_benchmarks
+    from benchmarks.generator import generate
+    from gerencex.core.metrics import registry
+
+    try:
+        # The test client needs 'testserver' in ALLOWED_HOSTS
+        setup_test_environment()
+        call_command('migrate', verbosity=0, interactive=False)
+        start = time.perf_counter()
+        dataset = generate(args.offices, args.users, int(365 * args.years), args.seed)
+        generated = time.perf_counter() - start
+        results = run_benchmarks(dataset, args.repeat)
+    finally:
+        registry.clear()
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        if args.keep_db:
+            print('Database kept at {}'.format(path), file=sys.stderr)
+        else:
+            os.remove(path)
+
+    report = {
+        'revision': git_revision(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'scale': {'offices': args.offices,
+                  'users': args.users,
+                  'years': args.years,
+                  'seed': args.seed,
+                  'days': (dataset.end - dataset.begin).days + 1},
+        'generation_seconds': generated,
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
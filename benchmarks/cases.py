@@ -0,0 +1,167 @@
+"""
+The benchmarks: each one is run a number of times, recording the wall time and the number of
+queries of each run.
+"""
+import statistics
+import time
+from datetime import timedelta
+
+from django.db import connection
+from django.shortcuts import resolve_url as r
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from gerencex.core.functions import updates_hours_balance, dates
+from gerencex.core.jobs import process_jobs
+from gerencex.core.models import Timing, Absences, Restday, HoursBalance
+from gerencex.core.time_calculations import DateData, local_midnight
+
+# Days calculated by the DateData benchmark
+DATEDATA_DAYS = 30
+
+
+def measure(name, function, repeat=3, setup=None, teardown=None):
+    """
+    Runs the function 'repeat' times. Only the function itself is timed.
+    :param setup: called before each run. Its return value is passed to the function.
+    :param teardown: called after each run, with the value returned by the function
+    :return: A dict with the wall times, in seconds, and the largest number of queries of a run
+    """
+    seconds, queries = [], []
+    for _ in range(repeat):
+        arguments = [setup()] if setup else []
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            result = function(*arguments)
+            seconds.append(time.perf_counter() - start)
+        queries.append(len(captured))
+        if teardown:
+            teardown(result)
+    return {'name': name,
+            'runs': repeat,
+            'seconds': {'min': min(seconds),
+                        'median': statistics.median(seconds),
+                        'max': max(seconds)},
+            'queries': max(queries)}
+
+
+def run_benchmarks(dataset, repeat=3):
+    """
+    Runs all the benchmarks over a dataset created by generator.generate. The order matters: the
+    hours balances are filled before the signals and the views are measured.
+    :return: The list of results, as returned by measure
+    """
+    return (calculation_benchmarks(dataset, repeat) +
+            signal_benchmarks(dataset, repeat) +
+            view_benchmarks(dataset, repeat))
+
+
+def calculation_benchmarks(dataset, repeat):
+    user = dataset.users[0]
+    month = list(dates(dataset.end - timedelta(days=DATEDATA_DAYS - 1),
+                       dataset.end + timedelta(days=1)))
+
+    def date_data():
+        for date_ in month:
+            data = DateData(user, date_)
+            data.credit()
+            data.debit()
+
+    offices = iter(dataset.offices)
+    office = dataset.offices[0]
+    return [
+        measure('DateData ({} days)'.format(len(month)), date_data, repeat),
+        # Each run fills the balances of one office, since the control start date
+        measure('updates_hours_balance (fill)',
+                lambda: updates_hours_balance(next(offices), None),
+                len(dataset.offices)),
+        measure('updates_hours_balance (recalculate)',
+                lambda: updates_hours_balance(office, dataset.begin),
+                repeat),
+    ]
+
+
+def signal_benchmarks(dataset, repeat):
+    """
+    A past registry is saved on a Saturday, which marks the balances as dirty, and the
+    recalculation job is processed, as the process_recalculations worker would. The registry is
+    then deleted, untimed.
+    """
+    user = dataset.users[0]
+    middle = dataset.begin + timedelta(days=(dataset.end - dataset.begin).days // 2)
+    restdays = set(Restday.objects.values_list('date', flat=True))
+    saturday = middle + timedelta(days=5 - middle.weekday())
+    while saturday in restdays:
+        saturday += timedelta(days=7)
+
+    def processed(save):
+        def run():
+            registry = save()
+            process_jobs()
+            return registry
+        return run
+
+    def delete(registry):
+        registry.delete()
+        process_jobs()
+
+    def save_line(line):
+        line.credit += 3600
+        line.save()
+        return line
+
+    def restore_line(line):
+        line.credit -= 3600
+        line.save()
+
+    return [
+        measure('signals: ticket',
+                processed(lambda: Timing.objects.create(
+                    user=user, date_time=local_midnight(saturday) + timedelta(hours=10))),
+                repeat,
+                teardown=delete),
+        measure('signals: absence',
+                processed(lambda: Absences.objects.create(user=user, date=saturday)),
+                repeat,
+                teardown=delete),
+        measure('signals: restday',
+                processed(lambda: Restday.objects.create(date=saturday, note='Benchmark')),
+                repeat,
+                teardown=delete),
+        measure('signals: balance line',
+                save_line,
+                repeat,
+                setup=lambda: HoursBalance.objects.get(user=user, date=middle),
+                teardown=restore_line),
+    ]
+
+
+def view_benchmarks(dataset, repeat):
+    """
+    The pages are requested in process, by the test client, as a worker of the first office
+    """
+    user = dataset.users[0]
+    client = Client()
+    client.force_login(user)
+    month = dataset.end.replace(day=1)
+    urls = (
+        ('home', r('home')),
+        ('hours_bank', r('hours_bank')),
+        ('my_hours_bank', r('my_hours_bank', user.username, month.year, month.month)),
+        ('my_tickets', r('my_tickets', user.username, month.year, month.month)),
+        ('calculations', r('calculations', user.username, dataset.end.year, dataset.end.month,
+                           dataset.end.day)),
+        ('forgotten_checkouts', r('forgotten_checkouts')),
+        ('office_tickets', r('office_tickets')),
+        ('absences_office', r('absences_office')),
+        ('absences', r('absences', user.username, dataset.end.year)),
+        ('restdays', r('restdays', dataset.end.year)),
+        ('rules', r('rules')),
+    )
+
+    def get(url):
+        def run():
+            response = client.get(url)
+            assert response.status_code == 200, (url, response.status_code)
+        return run
+
+    return [measure('view: {}'.format(name), get(url), repeat) for name, url in urls]
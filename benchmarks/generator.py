@@ -0,0 +1,122 @@
+"""
+Generates realistic data for the benchmarks: offices, their workers, and years of tickets,
+absences and restdays. The rows are inserted in bulk, without signals, so the hours balances are
+left to be calculated by the benchmarks themselves.
+"""
+import random
+from collections import namedtuple
+from datetime import date, timedelta
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+from gerencex.core.functions import dates, refresh_ticket_summary
+from gerencex.core.models import Office, Timing, Absences, Restday, UserDetail
+from gerencex.core.restday_calendar import invalidate_restday_calendar
+from gerencex.core.time_calculations import local_midnight
+
+Dataset = namedtuple('Dataset', ['offices', 'users', 'begin', 'end'])
+
+# Rows inserted by each INSERT statement
+BATCH_SIZE = 500
+
+# National holidays, as (month, day)
+HOLIDAYS = ((1, 1), (4, 21), (5, 1), (9, 7), (10, 12), (11, 2), (11, 15), (12, 25))
+
+# Share of the working days in which a worker checks out for lunch, and in which they forget to
+# check out
+LUNCH_RATE = 0.6
+FORGOTTEN_RATE = 0.02
+
+# Working days of vacation and of sick leave, per worker and per year
+VACATION_DAYS = 20
+SICK_DAYS = 3
+
+
+def generate(offices=2, users=20, days=365, seed=0):
+    """
+    :param offices: the number of offices
+    :param users: the number of workers of each office
+    :param days: the length of the period, which ends yesterday
+    :param seed: the seed of the random generator, so that runs with the same scale are comparable
+    :return: A Dataset
+    """
+    rand = random.Random(seed)
+    end = timezone.localtime(timezone.now()).date() - timedelta(days=1)
+    begin = end - timedelta(days=days - 1)
+
+    office_list, user_list = [], []
+    for n in range(offices):
+        office = Office.objects.create(name='Lotação {}'.format(n),
+                                       initials='BENCH{}'.format(n),
+                                       hours_control_start_date=begin)
+        office_list.append(office)
+        for m in range(users):
+            user = User.objects.create_user('bench_{}_{}'.format(n, m),
+                                            first_name='Servidor {}'.format(m),
+                                            last_name=office.initials)
+            user_list.append(user)
+        UserDetail.objects.filter(user__in=user_list[-users:]).update(office=office)
+
+    restdays = generate_restdays(begin, end)
+    workdays = [d for d in dates(begin, end + timedelta(days=1))
+                if d.weekday() < 5 and d not in restdays]
+    for user in user_list:
+        absent = generate_absences(rand, user, workdays)
+        Timing.objects.bulk_create(generate_tickets(rand, user, workdays, absent),
+                                   batch_size=BATCH_SIZE)
+        refresh_ticket_summary(user.pk)
+
+    return Dataset(office_list, user_list, begin, end)
+
+
+def generate_restdays(begin, end):
+    """
+    :return: The dates of the holidays created between begin and end
+    """
+    holidays = [date(year, month, day)
+                for year in range(begin.year, end.year + 1)
+                for month, day in HOLIDAYS]
+    restdays = [Restday(date=d, note='Feriado') for d in holidays if begin <= d <= end]
+    Restday.objects.bulk_create(restdays, batch_size=BATCH_SIZE)
+    invalidate_restday_calendar()
+    return {r.date for r in restdays}
+
+
+def generate_absences(rand, user, workdays):
+    """
+    Each year, a block of vacation and a few days of sick leave
+    :return: The dates of the absences created
+    """
+    absent = set()
+    years = max(1, round(len(workdays) / 250))
+    for _ in range(years):
+        first = rand.randrange(max(1, len(workdays) - VACATION_DAYS))
+        absent.update(workdays[first:first + VACATION_DAYS])
+        absent.update(rand.sample(workdays, min(SICK_DAYS, len(workdays))))
+    Absences.objects.bulk_create(
+        [Absences(user=user, date=d, cause=Absences.FERIAS) for d in sorted(absent)],
+        batch_size=BATCH_SIZE)
+    return absent
+
+
+def generate_tickets(rand, user, workdays, absent):
+    """
+    The worker checks in between 7:30 and 9:30 and works 7 to 9 hours, often checking out and in
+    again for lunch. Now and then they forget to check out.
+    :return: The unsaved Timing registries
+    """
+    for date_ in workdays:
+        if date_ in absent:
+            continue
+        midnight = local_midnight(date_)
+        checkin = timedelta(minutes=rand.randint(450, 570))
+        checkout = checkin + timedelta(minutes=rand.randint(420, 540))
+        times = [(checkin, True)]
+        if rand.random() < LUNCH_RATE:
+            lunch = timedelta(minutes=rand.randint(690, 780))
+            times += [(lunch, False), (lunch + timedelta(minutes=rand.randint(30, 90)), True)]
+            checkout += timedelta(hours=1)
+        if rand.random() >= FORGOTTEN_RATE:
+            times.append((checkout, False))
+        for time_, checkin_ in times:
+            yield Timing(user=user, date_time=midnight + time_, checkin=checkin_)
@@ -3,7 +3,8 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
 
-from gerencex.core.models import UserDetail, Timing, Restday, HoursBalance, Absences, Office
+from gerencex.core.models import UserDetail, Timing, Restday, HoursBalance, Absences, Office, \
+    RecalculationJob, PunchClock
 
 
 # Define an inline admin descriptor for Employee model
@@ -12,6 +13,9 @@ class UserDetailInLine(admin.TabularInline):
     model = UserDetail
     can_delete = False
     verbose_name_plural = 'detalhes'
+    # Maintained by the tickets and balances updates (see 'signals.py'): they are shown, but
+    # neither edited nor written back by the form
+    readonly_fields = UserDetail.derived_fields
 
 
 # Define a new User admin
@@ -48,6 +52,15 @@ class OfficeAdmin(admin.ModelAdmin):
     list_filter = ('linked_to', )
 
 
+class RecalculationJobAdmin(admin.ModelAdmin):
+    list_display = ('office', 'begin_date', 'status', 'done', 'total', 'created', 'finished')
+    list_filter = ('status', 'office')
+
+
+class PunchClockAdmin(admin.ModelAdmin):
+    list_display = ('serial', 'last_nsr', 'last_import')
+
+
 # Re-register UserAdmin
 admin.site.unregister(User)
 admin.site.register(User, UserAdmin)
@@ -59,4 +72,6 @@ admin.site.register(Timing, TimingAdmin)
 admin.site.register(Restday, RestdayAdmin)
 admin.site.register(HoursBalance, HoursBalanceAdmin)
 admin.site.register(Absences, AbsencesAdmin)
-admin.site.register(Office, OfficeAdmin)
\ No newline at end of file
+admin.site.register(Office, OfficeAdmin)
+admin.site.register(RecalculationJob, RecalculationJobAdmin)
+admin.site.register(PunchClock, PunchClockAdmin)
\ No newline at end of file
@@ -0,0 +1,230 @@
+"""
+Import of the AFD files (Arquivo Fonte de Dados) exported by the electronic punch clocks (REP),
+as described by the Portaria MTE 1510/2009. AFD files are fixed width text files, whose records
+begin with their NSR (9 digits) and type (1 digit). Only two types matter here:
+
+    1: the header, with the clock serial number at columns 188-204
+    3: a punch, with the date (ddmmyyyy) at columns 11-18, the time (hhmm) at 19-22 and the
+       worker's PIS at 23-34
+
+The file ends with a trailer, whose NSR is 999999999.
+
+Punches don't tell check ins from checkouts: the first punch of the user in a day is a check in,
+the next one a checkout, and so on.
+"""
+import datetime
+from bisect import bisect_left
+
+from django.db import transaction
+from django.utils import timezone
+from gerencex.core.ingestion import dirty_ranges, mark_ingested
+from gerencex.core.ledger import CHUNK_SIZE
+from gerencex.core.metrics import TICKETS_INGESTED
+from gerencex.core.models import PunchClock, Timing, UserDetail
+from gerencex.core.time_calculations import current_tz, local_midnight
+
+HEADER = '1'
+PUNCH = '3'
+TRAILER_NSR = '999999999'
+
+# Punches inserted at a time. Each batch is committed with the clock's watermark.
+BATCH_SIZE = 5000
+
+
+class AfdError(Exception):
+    pass
+
+
+def parse_punch(line):
+    """
+    :param line: a type 3 record
+    :return: The PIS, as an integer, and the naive local datetime of the punch
+    """
+    return int(line[22:34]), datetime.datetime(int(line[14:18]), int(line[12:14]),
+                                               int(line[10:12]), int(line[18:20]),
+                                               int(line[20:22]))
+
+
+def users_by_pis():
+    """
+    :return: The pks of the users, by PIS (as an integer, since the PIS is written with and
+    without punctuation)
+    """
+    users = {}
+    for user_id, pis in UserDetail.objects.exclude(pis='').values_list('user_id', 'pis'):
+        digits = ''.join(c for c in pis if c.isdigit())
+        if digits:
+            users[int(digits)] = user_id
+    return users
+
+
+class AfdImport:
+    """
+    Streams an AFD file, with bounded memory: the punches are inserted in batches, each one
+    committed with the clock's NSR watermark, so that an interrupted import is resumed by running
+    it again. Only the last punch of each user is kept between batches, to alternate check ins and
+    checkouts. The open sessions are refreshed, and the imported dates marked as dirty, once per
+    user, at the end (see ingestion.py).
+    """
+    def __init__(self, created_by=None, batch_size=BATCH_SIZE, reimport=False):
+        """
+        :param reimport: whether the records up until the clock's watermark are imported again.
+        Punches already recorded are skipped anyway.
+        """
+        self.created_by = created_by
+        self.batch_size = batch_size
+        self.reimport = reimport
+        self.users = users_by_pis()
+        self.clock = None
+        self.watermark = 0
+        self.last_nsr = 0
+        # (date_time, checkin) of the last punch of each user, in UTC
+        self.last_punches = {}
+        self.offsets = {}
+        self.midnights = {}
+        self.ranges = {}
+        self.created = 0
+        self.duplicates = 0
+        self.skipped = 0
+        self.unknown = set()
+
+    def run(self, lines):
+        """
+        :param lines: the lines of the file
+        :return: The import, with its counters
+        """
+        punches = []
+        try:
+            for number, line in enumerate(lines, 1):
+                if len(line) < 10 or not line[:9].isdigit() or line[:9] == TRAILER_NSR:
+                    continue
+                kind = line[9]
+                if kind == HEADER:
+                    self.open_clock(line[187:204].strip())
+                    continue
+                if self.clock is None:
+                    raise AfdError('Registro anterior ao cabeçalho na linha {}'.format(number))
+
+                nsr = int(line[:9])
+                if nsr <= self.watermark:
+                    if kind == PUNCH:
+                        self.skipped += 1
+                    continue
+                self.last_nsr = max(self.last_nsr, nsr)
+                if kind != PUNCH:
+                    continue
+
+                try:
+                    pis, date_time = parse_punch(line)
+                except ValueError:
+                    raise AfdError('Marcação inválida na linha {}'.format(number))
+                user_id = self.users.get(pis)
+                if user_id is None:
+                    self.unknown.add(pis)
+                    continue
+                punches.append((user_id, date_time))
+                if len(punches) >= self.batch_size:
+                    self.save(punches)
+                    punches = []
+            if self.clock is not None:
+                self.save(punches)
+        finally:
+            with transaction.atomic():
+                mark_ingested(self.ranges)
+        return self
+
+    def open_clock(self, serial):
+        if not serial:
+            raise AfdError('Cabeçalho sem o número de fabricação do relógio')
+        self.clock, _ = PunchClock.objects.get_or_create(serial=serial)
+        self.watermark = 0 if self.reimport else self.clock.last_nsr
+        self.last_nsr = self.clock.last_nsr
+
+    def save(self, punches):
+        """
+        Inserts a batch of punches and advances the clock's watermark, in one transaction
+        :param punches: (user_id, naive local datetime) tuples, in chronological order
+        """
+        tickets = self.tickets(punches)
+        with transaction.atomic():
+            Timing.objects.bulk_create(tickets, batch_size=CHUNK_SIZE)
+            self.clock.last_nsr = self.last_nsr
+            self.clock.last_import = timezone.now()
+            self.clock.save()
+        self.created += len(tickets)
+        TICKETS_INGESTED.inc(len(tickets), source='afd')
+        dirty_ranges(tickets, self.ranges)
+        self.offsets.clear()
+        self.midnights.clear()
+
+    def tickets(self, punches):
+        """
+        :return: The new tickets. A punch is a check in if it is the first ticket of the user in
+        the day, already recorded or not, or if the previous one is a checkout.
+        """
+        if not punches:
+            return []
+        recorded = self.recorded_tickets(punches)
+        tickets = []
+        for user_id, naive in punches:
+            date_time = self.utc(naive)
+            midnight = self.midnight(naive.date())
+            user_tickets = recorded.get(user_id, [])
+            idx = bisect_left(user_tickets, (date_time,))
+            if idx < len(user_tickets) and user_tickets[idx][0] == date_time:
+                self.duplicates += 1
+                self.last_punches[user_id] = user_tickets[idx]
+                continue
+
+            last = self.last_punches.get(user_id)
+            if last and last[0] == date_time:
+                self.duplicates += 1
+                continue
+
+            previous = user_tickets[idx - 1] if idx else None
+            if last and (previous is None or last[0] > previous[0]):
+                previous = last
+            checkin = previous is None or previous[0] < midnight or not previous[1]
+
+            tickets.append(Timing(user_id=user_id,
+                                  date_time=date_time,
+                                  checkin=checkin,
+                                  created_by=self.created_by))
+            self.last_punches[user_id] = (date_time, checkin)
+        return tickets
+
+    def recorded_tickets(self, punches):
+        """
+        :return: Sorted (date_time, checkin) tuples of the tickets already recorded at the days
+        of the punches, by user
+        """
+        days = [naive.date() for _, naive in punches]
+        recorded = {}
+        for user_id, date_time, checkin in Timing.objects.filter(
+                user__in={user_id for user_id, _ in punches},
+                date_time__gte=self.midnight(min(days)),
+                date_time__lt=self.midnight(max(days) + datetime.timedelta(days=1))
+        ).order_by('date_time').values_list('user', 'date_time', 'checkin'):
+            recorded.setdefault(user_id, []).append((date_time, checkin))
+        return recorded
+
+    def utc(self, naive):
+        """
+        Localizing with pytz is slow, and the punches are many, so the UTC offsets are cached by
+        hour (daylight saving time always begins and ends at a whole hour)
+        :return: The UTC datetime of a naive local datetime
+        """
+        hour = naive.replace(minute=0)
+        offset = self.offsets.get(hour)
+        if offset is None:
+            offset = timezone.make_aware(hour, current_tz, is_dst=False).utcoffset()
+            self.offsets[hour] = offset
+        return (naive - offset).replace(tzinfo=timezone.utc)
+
+    def midnight(self, date_):
+        """
+        :return: The UTC datetime at which the local date begins
+        """
+        if date_ not in self.midnights:
+            self.midnights[date_] = local_midnight(date_).astimezone(timezone.utc)
+        return self.midnights[date_]
@@ -6,3 +6,9 @@ class CoreConfig(AppConfig):
 
     def ready(self):
         import gerencex.core.signals
+        from django.conf import settings
+        from gerencex.core.network import get_network_policy
+
+        # The company site starts being resolved before the first check in
+        if settings.CHECK_CLIENT_NETWORK:
+            get_network_policy().networks()
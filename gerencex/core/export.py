@@ -0,0 +1,65 @@
+import csv
+
+from gerencex.core.models import HoursBalance, Office, signed_time
+
+HEADER = ('lotação', 'usuário', 'nome', 'sobrenome', 'data', 'crédito', 'débito', 'saldo')
+
+# Rows fetched from the database at a time
+CHUNK_SIZE = 2000
+
+
+class Echo:
+    """
+    A file-like object that returns what is written to it, so that csv.writer produces the lines
+    of a streaming response instead of filling a buffer
+    """
+    def write(self, value):
+        return value
+
+
+def linked_offices(office):
+    """
+    :return: The pks of the office and of the offices linked to it, directly or not
+    """
+    pks = {office.pk}
+    level = {office.pk}
+    while level:
+        level = set(Office.objects.filter(linked_to__in=level).values_list('pk', flat=True)) - pks
+        pks |= level
+    return pks
+
+
+def balance_rows(begin, end, offices=None):
+    """
+    Reads the hours balances with a database cursor, a chunk at a time, so that memory stays
+    constant however long the period is
+    :param offices: the pks of the offices whose users are exported; all of them if None
+    :return: An iterator over the rows, header included, ordered by office, user and date
+    """
+    lines = HoursBalance.objects.filter(date__gte=begin, date__lte=end)
+    if offices is not None:
+        lines = lines.filter(user__userdetail__office__in=offices)
+    lines = lines.order_by(
+        'user__userdetail__office__initials', 'user__username', 'date'
+    ).values_list(
+        'user__userdetail__office__initials', 'user__username', 'user__first_name',
+        'user__last_name', 'date', 'credit', 'debit', 'balance'
+    )
+
+    yield HEADER
+    for initials, username, first_name, last_name, date_, credit, debit, balance in \
+            lines.iterator(chunk_size=CHUNK_SIZE):
+        yield (initials, username, first_name, last_name, date_.strftime('%d/%m/%Y'),
+               signed_time(credit), signed_time(debit), signed_time(balance))
+
+
+def csv_lines(rows):
+    """
+    The lines are separated by semicolons, as spreadsheets expect in Brazilian locales, and begin
+    with a byte order mark, so that the accents are read as UTF-8
+    :return: An iterator over the CSV lines of the rows
+    """
+    writer = csv.writer(Echo(), delimiter=';')
+    yield '\ufeff'
+    for row in rows:
+        yield writer.writerow(row)
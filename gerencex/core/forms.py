@@ -1,7 +1,7 @@
 from django import forms
 from django.contrib.auth.models import User
 from django.utils import timezone
-from gerencex.core.models import Restday, Absences
+from gerencex.core.models import Restday, Absences, Office
 
 
 class MyModelChoiceField(forms.ModelChoiceField):
@@ -64,6 +64,33 @@ class GenerateBalanceForm(forms.Form):
             self.add_error('end', forms.ValidationError('Data inválida', code='inicio'))
 
 
+class PeriodForm(forms.Form):
+    begin = forms.DateField(label='Data inicial',
+                            required=False,
+                            widget=forms.TextInput(attrs={'class': 'datepicker'}))
+    end = forms.DateField(label='Data final',
+                          required=False,
+                          widget=forms.TextInput(attrs={'class': 'datepicker'}))
+
+    def clean(self):
+        super(PeriodForm, self).clean()
+        begin = self.cleaned_data.get("begin")
+        end = self.cleaned_data.get("end")
+
+        if begin and end and end < begin:
+            self.add_error('end', forms.ValidationError(
+                'Data final menor que a inicial', code='termino'))
+
+
+class BalanceExportForm(PeriodForm):
+    office = forms.ModelChoiceField(label='Lotação',
+                                    queryset=Office.objects.order_by('initials'),
+                                    required=False,
+                                    empty_label='Todas')
+    linked = forms.BooleanField(label='Incluir lotações vinculadas',
+                                required=False)
+
+
 class CheckForm(forms.Form):
     CHOICES = (('1', 'Entrada',), ('2', 'Saída',))
     user = MyModelChoiceField(label='Colaborador',
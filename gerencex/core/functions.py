@@ -1,9 +1,19 @@
 import calendar
+import json
 from datetime import timedelta, date
 
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Max, Min
 from django.utils import timezone
-from gerencex.core.models import Restday, Absences, HoursBalance
-from gerencex.core.time_calculations import DateData
+from gerencex.core.ledger import write_lines
+from gerencex.core.metrics import CHECKINS, CHECKIN_SECONDS
+from gerencex.core.models import Absences, HoursBalance, Timing, UserDetail
+from gerencex.core.restday_calendar import get_restday_calendar
+from gerencex.core.time_calculations import DateData, PeriodData, current_tz, local_midnight
+
+# Maximum number of tickets of a day summarized at UserDetail
+MAX_DAY_TICKETS = 50
 
 
 def dates(date1, date2):
@@ -19,9 +29,15 @@ def dates(date1, date2):
 
 
 def comments(user, date_):
-    restday = Restday.objects.filter(date=date_).last()
+    restday = get_restday_calendar().get(date_)
     absence = Absences.objects.filter(date=date_, user=user).last()
-    office = user.userdetail.office
+    return day_comments(date_, user.userdetail.office, restday, absence)
+
+
+def day_comments(date_, office, restday, absence):
+    """
+    The same as comments, with the restday and the absence of the date already loaded
+    """
     start_balance = bool(date_ == office.hours_control_start_date)
     weekend = bool(date_.weekday() in (5, 6))
 
@@ -55,34 +71,60 @@ class UserBalance:
         self.start_date = user.userdetail.office.hours_control_start_date
 
         self.first_day = max(first_month_day, self.start_date)
-        balance = [l for l in HoursBalance.objects.filter(date__year=self.year,
-                                                          date__month=self.month,
-                                                          user=self.user)]
-        self.balance_dates = [d.date for d in balance]
+        self.balance = self.month_lines()
+
+    def month_lines(self):
+        """
+        :return: The month's HoursBalance lines of the user, indexed by date
+        """
+        return {line.date: line for line in HoursBalance.objects.filter(date__year=self.year,
+                                                                          date__month=self.month,
+                                                                          user=self.user)}
 
     def get_monthly_lines(self):
+        """
+        The balance lines, restdays and absences of the month are read at once. The missing lines
+        are calculated and written in bulk (see ledger.py).
+        :return: The date, credit, debit, balance and comment of each day of the month
+        """
+        month_dates = list(dates(self.first_day, self.last_day))
+        missing = [d for d in month_dates if d not in self.balance]
+        if missing:
+            period = PeriodData([self.user], missing[0], self.last_day)
+            cells = []
+            for date_ in dates(missing[0], self.last_day):
+                line = self.balance.get(date_)
+                if line is None:
+                    date_data = period.date_data(period.users[0], date_)
+                    cells.append((date_,
+                                  int(date_data.credit().total_seconds()),
+                                  int(date_data.debit().total_seconds())))
+                else:
+                    cells.append((date_, line.credit, line.debit))
+            write_lines(self.user.pk, cells)
+            self.balance = self.month_lines()
+
+        restdays = get_restday_calendar()
+        absences = {a.date: a for a in Absences.objects.filter(user=self.user,
+                                                                date__gte=self.first_day,
+                                                                date__lt=self.last_day)}
         lines = []
-        for date_ in dates(self.first_day, self.last_day):
-            if date_ not in self.balance_dates:
-                HoursBalance.objects.create(
-                    date=date_,
-                    user=self.user,
-                    credit=DateData(self.user, date_).credit().total_seconds(),
-                    debit=DateData(self.user, date_).debit().total_seconds()
-                )
-
-            line = HoursBalance.objects.get(user=self.user, date=date_)
-
+        for date_ in month_dates:
+            line = self.balance[date_]
             lines.append({'date': date_,
                           'credit': line.time_credit(),
                           'debit': line.time_debit(),
                           'balance': line.time_balance(),
-                          'comment': comments(self.user, date_)})
+                          'comment': day_comments(date_,
+                                                  self.office,
+                                                  restdays.get(date_),
+                                                  absences.get(date_))})
         return lines
 
     def create_or_update_line(self, date_):
-        credit = DateData(self.user, date_).credit().total_seconds()
-        debit = DateData(self.user, date_).debit().total_seconds()
+        date_data = DateData(self.user, date_)
+        credit = date_data.credit().total_seconds()
+        debit = date_data.debit().total_seconds()
         updated_values = {'credit': credit, 'debit': debit}
         HoursBalance.objects.update_or_create(
             date=date_,
@@ -91,6 +133,56 @@ class UserBalance:
         )
 
 
+def refresh_ticket_summary(user_id):
+    """
+    Summarizes the user's last tickets at UserDetail, through the (user, date_time) index: the open
+    session, which is the last ticket if it is a check in, the last ticket time and the tickets of
+    its day
+    """
+    last_tickets = list(Timing.objects.filter(user=user_id).order_by(
+                        '-date_time')[:MAX_DAY_TICKETS])
+    last = last_tickets[0] if last_tickets else None
+    day_tickets = []
+    if last is not None:
+        last_date = last.date_time.astimezone(current_tz).date()
+        day_tickets = [t for t in reversed(last_tickets)
+                       if t.date_time.astimezone(current_tz).date() == last_date]
+    open_ticket = last if last is not None and last.checkin else None
+    UserDetail.objects.filter(user=user_id).update(
+        atwork=open_ticket is not None,
+        open_ticket=open_ticket,
+        open_since=open_ticket.date_time if open_ticket else None,
+        last_ticket_at=last.date_time if last else None,
+        last_day_tickets=json.dumps([[t.date_time.isoformat(), t.checkin] for t in day_tickets])
+    )
+
+
+def toggle_ticket(user, client_ip='', client_local_ip=''):
+    """
+    Records a check in, or a checkout if the user is at work, in one transaction. The user's
+    UserDetail is locked, so that concurrent requests of the same user wait for each other. The
+    open session is refreshed by signal (see signals.py).
+    :return: The new ticket, or None if the checkout is invalid. Checkout time is recorded only if
+    the open check in happened in the same day. Otherwise, the user is no longer at work.
+    """
+    with CHECKIN_SECONDS.time(), transaction.atomic():
+        detail = UserDetail.objects.select_for_update().get(user=user)
+        ticket = Timing(user=user,
+                        checkin=not detail.atwork,
+                        created_by=user,
+                        client_ip=client_ip,
+                        client_local_ip=client_local_ip)
+        if not ticket.checkin:
+            date_ = ticket.date_time.astimezone(current_tz).date()
+            if not (detail.open_since and detail.open_since >= local_midnight(date_)):
+                detail.atwork = False
+                detail.save(update_fields=['atwork'])
+                return None
+        ticket.save()
+    CHECKINS.inc(kind='checkin' if ticket.checkin else 'checkout')
+    return ticket
+
+
 def get_client_ip(request):
     x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
     ips = []
@@ -128,49 +220,88 @@ def previous_next(date_, model, user):
     return previous, next_
 
 
-def updates_hours_balance(office, date_):
+def seconds_cells(period, user, begin=None):
+    """
+    :return: The (date, credit, debit) cells of a user in a PeriodData, in seconds, as expected
+    by ledger.write_lines
+    """
+    return [(d, int(credit.total_seconds()), int(debit.total_seconds()))
+            for d, credit, debit in period.user_cells(user, begin)]
+
+
+def recalculates_hours_balance(users, begin, end=None, progress=None):
+    """
+    Recalculates the existent hour balance lines of some workers, from a given date on. No lines
+    are created before the first line or after the last line of each worker.
+    :param users: the workers
+    :param begin: the first dirty date
+    :param end: the last dirty date. If not informed, up until the last line of each worker
+    :param progress: an optional function, called with the number of workers already calculated
+    and the total number of workers
+    :return: Nothing. It just updates the database
+    """
+    ranges = {}
+    for user_id, first, last in HoursBalance.objects.filter(user__in=users).order_by().values_list(
+            'user').annotate(Min('date'), Max('date')):
+        first = max(first, begin)
+        last = min(last, end) if end else last
+        if first <= last:
+            ranges[user_id] = (first, last)
+
+    if ranges:
+        period = PeriodData([User(pk=pk) for pk in ranges],
+                            min(first for first, last in ranges.values()),
+                            max(last for first, last in ranges.values()) + timedelta(days=1))
+        for idx, user in enumerate(period.users):
+            first, last = ranges[user.pk]
+            write_lines(user.pk, [cell for cell in seconds_cells(period, user, first)
+                                  if cell[0] <= last])
+            if progress:
+                progress(idx + 1, len(period.users))
+
+
+def updates_hours_balance(office, date_, progress=None):
     """
-    Calculates the hour balances of all workers in an office, from a given date up until yesterday
+    Calculates the hour balances of all workers in an office, from a given date up until yesterday.
+    The lines of each worker are written in bulk, in one transaction (see ledger.py).
     :param date_: the begin date for updating
     :param office: the workers' office
+    :param progress: an optional function, called with the number of workers already calculated
+    and the total number of workers
     :return: Nothing. It just updates the database
     """
-    users = [x.user for x in office.users.all()]
+    users = User.objects.filter(userdetail__office=office)
     today = timezone.localtime(timezone.now()).date()
 
     # date_ is present if calculate_hours_bank view was triggered. In this case, we must update
     # or create the balances for all office workers, and for all dates between date_ and today
     if date_:
-        for d in dates(date_, today):
-            for user in users:
-                updated_values = {
-                    'credit': DateData(user, d).credit().total_seconds(),
-                    'debit': DateData(user, d).debit().total_seconds()
-                }
-                HoursBalance.objects.update_or_create(
-                    date=d,
-                    user=user,
-                    defaults=updated_values
-                )
+        period = PeriodData(users, date_, today)
+        for idx, user in enumerate(period.users):
+            write_lines(user.pk, seconds_cells(period, user))
+            if progress:
+                progress(idx + 1, len(period.users))
 
     # date_ is not present when we just want to see hours_bank. In this case, we must check if
     # all office users have balances for yesterday, filling the blanks.
     else:
+        last_dates = dict(HoursBalance.objects.filter(user__in=users).order_by().values_list(
+                          'user').annotate(Max('date')))
+        next_dates = {}
         for user in users:
-            existent_balance = bool(HoursBalance.objects.filter(user=user))
-            if not existent_balance:
-                last_user_balance_date = office.hours_control_start_date - timedelta(days=1)
-            else:
-                last_user_balance_date = HoursBalance.objects.filter(user=user).last().date
-            next_user_balance_date = last_user_balance_date + timedelta(days=1)
-            if next_user_balance_date < today:
-                for d in dates(next_user_balance_date, today):
-                    HoursBalance.objects.create(
-                        date=d,
-                        user=user,
-                        credit=DateData(user, d).credit().total_seconds(),
-                        debit=DateData(user, d).debit().total_seconds()
-                    )
+            if user.pk in last_dates:
+                next_dates[user.pk] = last_dates[user.pk] + timedelta(days=1)
+            elif office.hours_control_start_date:
+                next_dates[user.pk] = office.hours_control_start_date
+        late_users = [user for user in users
+                      if user.pk in next_dates and next_dates[user.pk] < today]
+
+        if late_users:
+            period = PeriodData(late_users, min(next_dates[u.pk] for u in late_users), today)
+            for idx, user in enumerate(period.users):
+                write_lines(user.pk, seconds_cells(period, user, next_dates[user.pk]))
+                if progress:
+                    progress(idx + 1, len(period.users))
 
     office.last_balance_date = today
     office.save()
@@ -0,0 +1,159 @@
+import ipaddress
+from collections import namedtuple
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from gerencex.core.functions import refresh_ticket_summary
+from gerencex.core.jobs import mark_dirty
+from gerencex.core.ledger import CHUNK_SIZE
+from gerencex.core.metrics import TICKETS_INGESTED
+from gerencex.core.models import Timing
+from gerencex.core.time_calculations import current_tz
+
+# Terminal clocks may be slightly ahead of the server's
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+
+CHECKIN_VALUES = {'1', 'true', 'e', 'entrada', 'in'}
+CHECKOUT_VALUES = {'0', 'false', 's', 'saida', 'saída', 'out'}
+
+IngestionResult = namedtuple('IngestionResult', ['created', 'duplicates', 'errors'])
+
+
+def parse_checkin(value):
+    """
+    :return: True for a check in, False for a checkout
+    :raise ValueError: if the value is neither
+    """
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in CHECKIN_VALUES:
+        return True
+    if text in CHECKOUT_VALUES:
+        return False
+    raise ValueError('Tipo de registro inválido: {}'.format(value))
+
+
+def parse_record(record, users, now):
+    """
+    :param record: a dict with the keys 'user' (username), 'date_time' (ISO 8601, local time if it
+    has no offset), 'checkin' and, optionally, 'client_ip' (IPv4 or IPv6)
+    :param users: the pks of the known users, by username
+    :return: An unsaved Timing
+    :raise ValueError: if the record is invalid
+    """
+    try:
+        username = record['user']
+        date_time = parse_datetime(str(record['date_time']).strip())
+        checkin = parse_checkin(record['checkin'])
+    except (KeyError, TypeError) as e:
+        raise ValueError('Registro incompleto: {}'.format(e))
+
+    if not isinstance(username, str):
+        raise ValueError('Usuário inválido: {}'.format(username))
+    if username not in users:
+        raise ValueError('Usuário inexistente: {}'.format(username))
+    if date_time is None:
+        raise ValueError('Data e hora inválidas: {}'.format(record['date_time']))
+    if timezone.is_naive(date_time):
+        # As the punch clocks' files (see 'afd.py'): the hour repeated when daylight saving time
+        # ends is taken as standard time, and the hour skipped when it begins is shifted
+        date_time = timezone.make_aware(date_time, current_tz, is_dst=False)
+    if date_time > now + MAX_CLOCK_SKEW:
+        raise ValueError('Registro no futuro: {}'.format(record['date_time']))
+
+    client_ip = record.get('client_ip') or ''
+    if not isinstance(client_ip, str):
+        raise ValueError('Endereço IP inválido: {}'.format(client_ip))
+    client_ip = client_ip.strip()
+    if client_ip:
+        try:
+            # IPv6 addresses are stored compressed
+            client_ip = str(ipaddress.ip_address(client_ip))
+        except ValueError:
+            raise ValueError('Endereço IP inválido: {}'.format(client_ip))
+
+    return Timing(user_id=users[username],
+                  date_time=date_time,
+                  checkin=checkin,
+                  client_ip=client_ip)
+
+
+def ingest(records, created_by=None):
+    """
+    Validates, deduplicates and inserts a batch of tickets, in bulk and in one transaction. A
+    ticket is a duplicate if the user already has one at the same time, in the database or in the
+    batch. Since bulk inserts send no signals, the users' open sessions are refreshed here, and
+    the dates of the new tickets are marked as dirty once per user (see jobs.py).
+    :param records: the tickets, as described at parse_record
+    :param created_by: the user who sent the batch
+    :return: An IngestionResult: the number of tickets created, the number of duplicates and
+    (index, message) tuples for the invalid records
+    """
+    records = list(records)
+    users = dict(User.objects.filter(
+        username__in={r.get('user') for r in records
+                      if isinstance(r, dict) and isinstance(r.get('user'), str)}
+    ).values_list('username', 'pk'))
+    now = timezone.now()
+
+    tickets = []
+    errors = []
+    for idx, record in enumerate(records):
+        try:
+            if not isinstance(record, dict):
+                raise ValueError('Registro inválido')
+            tickets.append(parse_record(record, users, now))
+        except ValueError as e:
+            errors.append((idx, str(e)))
+
+    if not tickets:
+        return IngestionResult(0, 0, errors)
+
+    existent = set(Timing.objects.filter(
+        user__in={t.user_id for t in tickets},
+        date_time__gte=min(t.date_time for t in tickets),
+        date_time__lte=max(t.date_time for t in tickets)
+    ).order_by().values_list('user', 'date_time'))
+
+    new_tickets = []
+    for ticket in tickets:
+        key = (ticket.user_id, ticket.date_time)
+        if key not in existent:
+            existent.add(key)
+            ticket.created_by = created_by
+            new_tickets.append(ticket)
+
+    with transaction.atomic():
+        Timing.objects.bulk_create(new_tickets, batch_size=CHUNK_SIZE)
+        mark_ingested(dirty_ranges(new_tickets))
+    TICKETS_INGESTED.inc(len(new_tickets), source='batch')
+
+    return IngestionResult(len(new_tickets), len(tickets) - len(new_tickets), errors)
+
+
+def dirty_ranges(tickets, ranges=None):
+    """
+    :param ranges: the ranges to be extended, if any
+    :return: The (begin, end) local dates of the tickets, by user
+    """
+    ranges = {} if ranges is None else ranges
+    for ticket in tickets:
+        date_ = ticket.date_time.astimezone(current_tz).date()
+        begin, end = ranges.get(ticket.user_id, (date_, date_))
+        ranges[ticket.user_id] = (min(begin, date_), max(end, date_))
+    return ranges
+
+
+def mark_ingested(ranges):
+    """
+    Does what the Timing signals would do for tickets inserted in bulk: refreshes the users' open
+    sessions and marks the ranges as dirty, once per user, when the transaction is committed.
+    :param ranges: as returned by dirty_ranges
+    """
+    for user_id, (begin, end) in sorted(ranges.items()):
+        refresh_ticket_summary(user_id)
+        transaction.on_commit(lambda u=user_id, b=begin, e=end: mark_dirty(u, b, e))
@@ -0,0 +1,266 @@
+"""
+Per-request performance instrumentation: where the time of a request goes.
+
+While a request is handled by ServerTimingMiddleware, the queries are timed by a database execute
+wrapper, and the sections marked by timed() add up their elapsed time:
+
+- 'calc': the credit and debit calculations of DateData (see time_calculations.py);
+- 'signals': the handlers of signals.py, such as the balance cascade;
+- 'render': the rendering of the templates (see TimedDjangoTemplates).
+
+The sections overlap: 'calc' and 'signals' include the queries they run. The metrics are sent
+in the Server-Timing header, shown by the browsers' developer tools, and logged as one JSON line
+per request, by the 'gerencex.performance' logger. Outside a request, or when SERVER_TIMING is
+off, a function decorated by timed() costs an extra call and an attribute lookup.
+
+ProfilerMiddleware profiles single requests of staff users, on demand.
+"""
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse
+from django.template.backends.django import DjangoTemplates, Template
+from django.utils.html import escape
+
+logger = logging.getLogger('gerencex.performance')
+
+SECTIONS = ('calc', 'signals', 'render')
+
+# Functions shown in the profiler hotspots report
+PROFILE_ROWS = 60
+
+PROFILE_OVERLAY = '<pre id="profile" style="position: fixed; z-index: 10000; top: 0; right: 0; ' \
+                  'bottom: 0; width: 60%; margin: 0; overflow: auto; background: #fff; ' \
+                  'font-size: 11px; border-left: 2px solid #c00;">{}</pre>'
+
+
+class _Local(threading.local):
+    # The metrics of the request being handled by each thread: None, outside a request
+    metrics = None
+
+
+_local = _Local()
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.sections = {section: 0.0 for section in SECTIONS}
+        # Nested sections of the same name are timed only at the outermost one
+        self.depth = {section: 0 for section in SECTIONS}
+
+    def execute(self, execute, sql, params, many, context):
+        """
+        Database execute wrapper: counts and times each query
+        """
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - start
+            self.queries += 1
+
+    def as_dict(self):
+        """
+        :return: The elapsed times, in milliseconds, and the number of queries
+        """
+        metrics = {'total': round(1000 * (time.perf_counter() - self.start), 1),
+                   'db': round(1000 * self.db, 1),
+                   'queries': self.queries}
+        metrics.update((section, round(1000 * seconds, 1))
+                       for section, seconds in self.sections.items())
+        return metrics
+
+
+def current_metrics():
+    """
+    :return: The metrics of the request being handled by the current thread, or None
+    """
+    return _local.metrics
+
+
+class Timed:
+    """
+    A section of the current request's metrics, as returned by timed()
+    """
+    def __init__(self, section):
+        self.section = section
+        self.metrics = None
+        self.start = None
+
+    def __enter__(self):
+        metrics = _local.metrics
+        if metrics is None or metrics.depth[self.section]:
+            return
+        metrics.depth[self.section] += 1
+        self.metrics = metrics
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        if self.metrics is not None:
+            self.metrics.sections[self.section] += time.perf_counter() - self.start
+            self.metrics.depth[self.section] -= 1
+            self.metrics = None
+
+    def __call__(self, func):
+        section = self.section
+
+        # The decorated functions are called often, as the DateData calculations: the wrapper
+        # calls them directly when nothing is measured, instead of entering a context manager
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            metrics = _local.metrics
+            if metrics is None or metrics.depth[section]:
+                return func(*args, **kwargs)
+            metrics.depth[section] += 1
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metrics.sections[section] += time.perf_counter() - start
+                metrics.depth[section] -= 1
+        return wrapper
+
+
+def timed(section):
+    """
+    Adds the elapsed time of the block, or of the decorated function, to a section of the current
+    request's metrics
+    """
+    return Timed(section)
+
+
+def server_timing(metrics):
+    """
+    :param metrics: as returned by RequestMetrics.as_dict
+    :return: The value of the Server-Timing header
+    """
+    entries = ['total;dur={:.1f}'.format(metrics['total']),
+               'db;dur={:.1f};desc="{} queries"'.format(metrics['db'], metrics['queries'])]
+    entries.extend('{};dur={:.1f}'.format(section, metrics[section]) for section in SECTIONS)
+    return ', '.join(entries)
+
+
+class ServerTimingMiddleware:
+    """
+    Measures each request, when SERVER_TIMING is set. It must be the first middleware, so that
+    the time of the others is included.
+    """
+    def __init__(self, get_response):
+        if not settings.SERVER_TIMING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = _local.metrics = RequestMetrics()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics.execute))
+                response = self.get_response(request)
+        finally:
+            _local.metrics = None
+
+        values = metrics.as_dict()
+        response['Server-Timing'] = server_timing(values)
+        values.update({'method': request.method,
+                       'path': request.path,
+                       'view': getattr(request.resolver_match, 'url_name', None),
+                       'status': response.status_code})
+        logger.info(json.dumps(values, sort_keys=True, default=str))
+        return response
+
+
+class TimedTemplate(Template):
+    """
+    A template of the Django backend, whose rendering is timed in the 'render' section. The
+    templates it extends and includes are rendered inside the same section.
+    """
+    def render(self, context=None, request=None):
+        with timed('render'):
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    The Django template backend, timing the rendering of the templates
+    """
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+class ProfilerMiddleware:
+    """
+    Runs a single view of gerencex.core.views under cProfile, when a staff user adds 'profile' to
+    the query string, or sends the X-Profile header. The hotspots, ranked by cumulative time, are
+    shown over the page ('?profile'), or the stats are saved at PROFILE_DIR, to be read by pstats
+    or snakeviz ('?profile=file'). It must be the last middleware, since it calls the view itself.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        mode = request.GET.get('profile', request.META.get('HTTP_X_PROFILE'))
+        if mode is None or view_func.__module__ != 'gerencex.core.views' or \
+                not request.user.is_staff:
+            return None
+
+        profile = cProfile.Profile()
+        response = profile.runcall(view_func, request, *view_args, **view_kwargs)
+        if hasattr(response, 'render') and callable(response.render):
+            response = profile.runcall(response.render)
+
+        if mode == 'file':
+            os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+            path = os.path.join(settings.PROFILE_DIR, '{}_{}.prof'.format(
+                request.resolver_match.url_name, time.strftime('%Y%m%d_%H%M%S')))
+            profile.dump_stats(path)
+            response['X-Profile-File'] = path
+            return response
+        return profile_overlay(response, hotspots(profile))
+
+
+def hotspots(profile, limit=PROFILE_ROWS):
+    """
+    :return: The pstats report of the functions with the largest cumulative times
+    """
+    stream = io.StringIO()
+    pstats.Stats(profile, stream=stream).sort_stats('cumulative').print_stats(limit)
+    return stream.getvalue()
+
+
+def profile_overlay(response, report):
+    """
+    :return: The HTML response with the report over the page, or, for other responses, an HTML
+    page with the report alone
+    """
+    overlay = PROFILE_OVERLAY.format(escape(report))
+    if response.streaming or not response.get('Content-Type', '').startswith('text/html'):
+        return HttpResponse('<html><body>{}</body></html>'.format(overlay))
+
+    content = response.content.decode(response.charset)
+    if '</body>' in content:
+        content = content.replace('</body>', overlay + '</body>', 1)
+    else:
+        content += overlay
+    response.content = content
+    return response
@@ -0,0 +1,247 @@
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timedelta
+
+import django
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.db import transaction, connections
+from django.db.models import Q, Count
+from django.utils import timezone
+from gerencex.core.functions import updates_hours_balance, recalculates_hours_balance
+from gerencex.core.metrics import RECALCULATION_SECONDS
+from gerencex.core.models import RecalculationJob, UserDetail, Office
+from gerencex.core.restday_calendar import recheck_restday_calendar
+
+# A running job not updated for this long is considered abandoned (its worker was killed, for
+# example), so that another worker may resume it
+STALE_AFTER = timedelta(minutes=10)
+
+
+def enqueue_recalculation(office, begin_date, end_date=None, user_id=None):
+    """
+    Creates a recalculation job for the office, or for one of its workers. If there is already a
+    pending job of the same kind, both are merged: the pending job covers the dates of both.
+    A worker's job is not created if a pending job of the whole office already covers it.
+    :param end_date: the last dirty date. If not informed, the lines are created or updated up
+    until yesterday
+    :param user_id: the worker's pk. If not informed, all the office workers are recalculated
+    :return: The pending job
+    """
+    with transaction.atomic():
+        pending = RecalculationJob.objects.select_for_update().filter(
+            office=office, status=RecalculationJob.PENDING)
+
+        if user_id is not None:
+            covering = pending.filter(user=None, begin_date__lte=begin_date)
+            if end_date is None:
+                covering = covering.filter(end_date=None)
+            else:
+                covering = covering.filter(Q(end_date=None) | Q(end_date__gte=end_date))
+            job = covering.first()
+            if job is not None:
+                return job
+
+        job = pending.filter(user=user_id, end_date__isnull=end_date is None).first()
+        if job is None:
+            return RecalculationJob.objects.create(office=office,
+                                                   user_id=user_id,
+                                                   begin_date=begin_date,
+                                                   end_date=end_date)
+        if begin_date < job.begin_date or (end_date and end_date > job.end_date):
+            job.begin_date = min(begin_date, job.begin_date)
+            job.end_date = max(end_date, job.end_date) if end_date else None
+            job.save(update_fields=['begin_date', 'end_date'])
+        return job
+
+
+def mark_dirty(user_id, begin_date, end_date):
+    """
+    Records that the balances of a worker must be recalculated between two dates, after a change
+    in tickets or absences. Lines exist only up until yesterday, so later dates are ignored.
+    :return: The pending job, or None if there is nothing to recalculate
+    """
+    yesterday = timezone.localtime(timezone.now()).date() - timedelta(days=1)
+    if begin_date > yesterday:
+        return None
+    detail = UserDetail.objects.filter(user=user_id).select_related('office').first()
+    if detail is None:
+        return None
+    return enqueue_recalculation(detail.office, begin_date, min(end_date, yesterday), user_id)
+
+
+def mark_offices_dirty(begin_date, end_date):
+    """
+    Records that the balances of all workers must be recalculated between two dates, after a
+    change in restdays
+    :return: The pending jobs
+    """
+    yesterday = timezone.localtime(timezone.now()).date() - timedelta(days=1)
+    if begin_date > yesterday:
+        return []
+    return [enqueue_recalculation(office, begin_date, min(end_date, yesterday))
+            for office in Office.objects.filter(hours_control_start_date__lte=yesterday)]
+
+
+def active_jobs():
+    """
+    :return: The pending jobs and the running jobs which are not stale
+    """
+    limit = timezone.now() - STALE_AFTER
+    return RecalculationJob.objects.filter(
+        Q(status=RecalculationJob.PENDING) |
+        Q(status=RecalculationJob.RUNNING, updated__gte=limit)
+    )
+
+
+def active_job(office):
+    """
+    :return: The office's pending or running job, if any. Jobs of a single worker are ignored.
+    """
+    return active_jobs().filter(office=office, user=None).first()
+
+
+def claim_next_job():
+    """
+    Marks the oldest pending (or stale) job as running. The conditional UPDATE guarantees that
+    two workers never claim the same job.
+    :return: The claimed job, or None if there is nothing to do
+    """
+    limit = timezone.now() - STALE_AFTER
+    candidates = RecalculationJob.objects.filter(
+        Q(status=RecalculationJob.PENDING) |
+        Q(status=RecalculationJob.RUNNING, updated__lt=limit)
+    ).order_by('created')
+
+    for job in candidates:
+        claimed = RecalculationJob.objects.filter(pk=job.pk, status=job.status,
+                                                  updated=job.updated).update(
+            status=RecalculationJob.RUNNING, done=0, updated=timezone.now())
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def run_job(job):
+    """
+    Recalculates the balances of the office or of the job's worker, reporting the progress in the
+    job after each worker
+    """
+    def progress(done, total):
+        RecalculationJob.objects.filter(pk=job.pk).update(done=done,
+                                                          total=total,
+                                                          updated=timezone.now())
+
+    # The job may have been enqueued by a restday saved in another process moments ago: the
+    # calendar version is checked now, instead of at the end of the check interval
+    recheck_restday_calendar()
+    start = time.perf_counter()
+    try:
+        if job.user_id is not None:
+            recalculates_hours_balance(User.objects.filter(pk=job.user_id),
+                                       job.begin_date, job.end_date, progress=progress)
+        elif job.end_date is not None:
+            recalculates_hours_balance(User.objects.filter(userdetail__office=job.office),
+                                       job.begin_date, job.end_date, progress=progress)
+        else:
+            updates_hours_balance(job.office, job.begin_date, progress=progress)
+    except Exception:
+        RecalculationJob.objects.filter(pk=job.pk).update(status=RecalculationJob.FAILED,
+                                                          error=traceback.format_exc(),
+                                                          updated=timezone.now(),
+                                                          finished=timezone.now())
+        RECALCULATION_SECONDS.observe(time.perf_counter() - start, status='failed')
+        return False
+    RecalculationJob.objects.filter(pk=job.pk).update(status=RecalculationJob.DONE,
+                                                      updated=timezone.now(),
+                                                      finished=timezone.now())
+    RECALCULATION_SECONDS.observe(time.perf_counter() - start, status='done')
+    return True
+
+
+def process_jobs():
+    """
+    Runs all the pending jobs
+    :return: The list of jobs run
+    """
+    jobs = []
+    job = claim_next_job()
+    while job is not None:
+        run_job(job)
+        job.refresh_from_db()
+        jobs.append(job)
+        job = claim_next_job()
+    return jobs
+
+
+def close_idle_connections():
+    """
+    Must be called before forking worker processes, so that they open their own database
+    connections instead of sharing the parent's. Connections in a transaction are kept, so the
+    workers must not use the database while the parent is in a transaction.
+    """
+    for connection in connections.all():
+        if not connection.in_atomic_block:
+            connection.close()
+
+
+def setup_worker():
+    """
+    Must be called first by the functions run at worker processes. Workers started by 'spawn',
+    instead of 'fork', don't inherit the configured Django.
+    """
+    if not apps.ready:
+        django.setup()
+
+
+def offices_to_close(force=False):
+    """
+    :param force: whether the offices already closed today are included
+    :return: The active offices whose balances must be brought up until yesterday, the largest
+    first, and the offices skipped because a recalculation of theirs is running
+    """
+    today = timezone.localtime(timezone.now()).date()
+    offices = Office.objects.filter(active=True, hours_control_start_date__lt=today)
+    if not force:
+        offices = offices.exclude(last_balance_date=today)
+    busy = set(active_jobs().filter(user=None).values_list('office', flat=True))
+    offices = offices.annotate(size=Count('users')).order_by('-size', 'pk')
+    return [o for o in offices if o.pk not in busy], [o for o in offices if o.pk in busy]
+
+
+def close_office(office_pk):
+    """
+    Brings the balances of an office's workers up until yesterday, and records the date at
+    Office.last_balance_date. It may run at a worker process of close_balances, which keeps its
+    own database connection. Each worker's lines are committed at once (see ledger.py), so an
+    interrupted close is resumed by running it again.
+    :return: The office pk and, if the close failed, the traceback
+    """
+    setup_worker()
+    try:
+        updates_hours_balance(Office.objects.get(pk=office_pk), None)
+    except Exception:
+        return office_pk, traceback.format_exc()
+    return office_pk, None
+
+
+def close_balances(offices, workers=None):
+    """
+    Closes the offices concurrently, one office at a time in each worker process
+    :param offices: the offices, as returned by offices_to_close
+    :param workers: the number of processes. The offices are closed in the current process if it
+    is 1, or if the caller is in a transaction.
+    :return: An iterator over the (office pk, traceback) results, as the offices are closed
+    """
+    if workers == 1 or len(offices) < 2 or transaction.get_connection().in_atomic_block:
+        for office in offices:
+            yield close_office(office.pk)
+        return
+
+    close_idle_connections()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(close_office, office.pk) for office in offices]
+        for future in as_completed(futures):
+            yield future.result()
@@ -0,0 +1,149 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, When, Value, IntegerField, F
+from gerencex.core.metrics import BALANCE_ROWS_WRITTEN, CASCADE_LENGTH
+from gerencex.core.models import HoursBalance, UserDetail
+
+# Older SQLite versions accept at most 999 parameters per statement
+MAX_PARAMETERS = 999
+
+# Maximum number of rows written by a single INSERT or UPDATE statement
+CHUNK_SIZE = 250
+
+
+def update_lines(lines, fields=('balance',)):
+    """
+    Writes the given fields of the HoursBalance lines, in as few statements as the database
+    allows, without triggering signals
+    """
+    # Each line takes two parameters per field, plus its pk in the WHERE clause
+    chunk_size = min(CHUNK_SIZE, MAX_PARAMETERS // (2 * len(fields) + 1))
+    for idx in range(0, len(lines), chunk_size):
+        chunk = lines[idx:idx + chunk_size]
+        values = {field: Case(*[When(pk=line.pk, then=Value(getattr(line, field)))
+                                for line in chunk],
+                              output_field=IntegerField())
+                  for field in fields}
+        HoursBalance.objects.filter(pk__in=[line.pk for line in chunk]).update(**values)
+    if lines:
+        BALANCE_ROWS_WRITTEN.inc(len(lines))
+
+
+def update_balances(lines):
+    """
+    Writes the 'balance' field of the given HoursBalance lines
+    """
+    update_lines(lines, ('balance',))
+
+
+def refresh_last_balance(user_id, line=None):
+    """
+    Copies the date and the balance of the user's last line to UserDetail, for the home page
+    :param line: the last line, if already known
+    """
+    if line is None:
+        line = HoursBalance.objects.filter(user=user_id).order_by('date').only(
+            'date', 'balance').last()
+    UserDetail.objects.filter(user=user_id).update(balance=line.balance if line else None,
+                                                   balance_date=line.date if line else None)
+
+
+def recompute_balances(user_id, date_, previous_balance=None):
+    """
+    Recalculates, in a single pass, the running balances of a user from a given date onwards
+    :param user_id: the user's pk
+    :param date_: the first date to recalculate
+    :param previous_balance: the balance of the line before date_. It is read from the database
+    if not informed
+    :return: The number of lines whose balance changed
+    """
+    with transaction.atomic():
+        if previous_balance is None:
+            previous = HoursBalance.objects.filter(user=user_id,
+                                                   date__lt=date_).order_by('date').last()
+            previous_balance = previous.balance if previous else 0
+
+        balance = previous_balance
+        changed = []
+        line = None
+        for line in HoursBalance.objects.filter(user=user_id, date__gte=date_).order_by(
+                'date').only('pk', 'date', 'credit', 'debit', 'balance'):
+            balance += line.credit - line.debit
+            if line.balance != balance:
+                line.balance = balance
+                changed.append(line)
+        update_balances(changed)
+        refresh_last_balance(user_id, line)
+    CASCADE_LENGTH.observe(len(changed))
+    return len(changed)
+
+
+def shift_balances(user_id, date_, delta):
+    """
+    Adds delta seconds to all the balances of a user after a given date, in one statement, and
+    refreshes the user's last balance. When a day's balance changes by delta, and the following
+    lines were consistent with it, this is all they need: the cost does not depend on how many
+    days follow it.
+    :return: The number of lines changed
+    """
+    shifted = HoursBalance.objects.filter(user=user_id, date__gt=date_).update(
+        balance=F('balance') + delta)
+    refresh_last_balance(user_id)
+    BALANCE_ROWS_WRITTEN.inc(shifted)
+    CASCADE_LENGTH.observe(shifted)
+    return shifted
+
+
+def write_lines(user_id, cells):
+    """
+    Creates or updates the HoursBalance lines of a user, in a single transaction. The running
+    balances are calculated in Python, the new lines are inserted in bulk and the changed ones
+    are updated in bulk. The lines after the last cell are shifted by the change in its balance,
+    in one statement, so recalculating a single day costs the same however many days follow it.
+    If the last cell had no line, they are recomputed instead.
+    :param cells: (date, credit, debit) tuples, ordered by date, credit and debit in seconds
+    :return: The number of lines created
+    """
+    if not cells:
+        return 0
+
+    first_date = cells[0][0]
+    last_date = cells[-1][0]
+    with transaction.atomic():
+        previous = HoursBalance.objects.filter(user=user_id,
+                                               date__lt=first_date).order_by('date').last()
+        balance = previous.balance if previous else 0
+        existent = {line.date: line for line in HoursBalance.objects.filter(
+                    user=user_id, date__gte=first_date, date__lte=last_date)}
+
+        last = existent.get(last_date)
+        stored_balance = last.balance if last else None
+
+        new_lines = []
+        changed = []
+        for date_, credit, debit in cells:
+            balance += credit - debit
+            line = existent.get(date_)
+            if line is None:
+                new_lines.append(HoursBalance(date=date_,
+                                              user_id=user_id,
+                                              credit=credit,
+                                              debit=debit,
+                                              balance=balance))
+            elif (line.credit, line.debit, line.balance) != (credit, debit, balance):
+                line.credit = credit
+                line.debit = debit
+                line.balance = balance
+                changed.append(line)
+
+        update_lines(changed, ('credit', 'debit', 'balance'))
+        HoursBalance.objects.bulk_create(new_lines, batch_size=CHUNK_SIZE)
+        BALANCE_ROWS_WRITTEN.inc(len(new_lines))
+        if stored_balance is None:
+            recompute_balances(user_id, last_date + timedelta(days=1), previous_balance=balance)
+        elif balance != stored_balance:
+            shift_balances(user_id, last_date, balance - stored_balance)
+        else:
+            refresh_last_balance(user_id)
+    return len(new_lines)
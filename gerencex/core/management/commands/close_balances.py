@@ -0,0 +1,46 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from gerencex.core.jobs import offices_to_close, close_balances
+
+
+class Command(BaseCommand):
+    help = 'Brings the hours balances of all active offices up until yesterday, so that the ' \
+           'pages only read them. Meant to run nightly, by cron. The offices are closed ' \
+           'concurrently, by a pool of processes. An interrupted close is resumed by running ' \
+           'the command again.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers',
+                            type=int,
+                            help='Number of processes (default: the number of CPUs, or 1 with '
+                                 'SQLite, which allows a single writer)')
+        parser.add_argument('--force',
+                            action='store_true',
+                            help='Also closes the offices already closed today')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        if workers is None:
+            workers = 1 if connection.vendor == 'sqlite' else os.cpu_count()
+
+        start = time.perf_counter()
+        offices, busy = offices_to_close(options['force'])
+        for office in busy:
+            self.stderr.write('{}: recálculo em andamento, ignorada'.format(office.initials))
+
+        names = {office.pk: office.initials for office in offices}
+        failed = 0
+        for office_pk, error in close_balances(offices, workers):
+            if error:
+                failed += 1
+                self.stderr.write('{}: falhou\n{}'.format(names[office_pk], error))
+            else:
+                self.stdout.write('{}: saldos atualizados'.format(names[office_pk]))
+
+        self.stdout.write('{} lotações fechadas em {:.1f} s'.format(
+            len(offices) - failed, time.perf_counter() - start))
+        if failed:
+            raise CommandError('{} lotações falharam'.format(failed))
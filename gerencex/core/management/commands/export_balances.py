@@ -0,0 +1,47 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from gerencex.core.export import balance_rows, csv_lines, linked_offices
+from gerencex.core.models import Office
+
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError('Data inválida: {}'.format(value))
+
+
+class Command(BaseCommand):
+    help = 'Exports the daily hours balances, for the payroll, as CSV. The balances are read a ' \
+           'chunk at a time, so a whole year of the organisation is exported in constant memory.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('begin', type=parse_date, help='Initial date (YYYY-MM-DD)')
+        parser.add_argument('end', type=parse_date, help='Final date (YYYY-MM-DD)')
+        parser.add_argument('--office',
+                            help='Initials of the office (default: all offices)')
+        parser.add_argument('--linked',
+                            action='store_true',
+                            help='Includes the offices linked to the office')
+        parser.add_argument('--output',
+                            help='File to write (default: the standard output)')
+
+    def handle(self, *args, **options):
+        offices = None
+        if options['office']:
+            try:
+                office = Office.objects.get(initials=options['office'])
+            except Office.DoesNotExist:
+                raise CommandError('Lotação inexistente: {}'.format(options['office']))
+            offices = linked_offices(office) if options['linked'] else {office.pk}
+
+        lines = csv_lines(balance_rows(options['begin'], options['end'], offices))
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as file:
+                file.writelines(lines)
+        else:
+            # The byte order mark is only useful in files
+            next(lines)
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,55 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from gerencex.core.afd import AfdImport, AfdError, BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Imports the punches of the AFD files exported by the electronic punch clocks (REP). ' \
+           'The users are identified by their PIS. The records already imported from each clock ' \
+           'are skipped, and the balances of the imported days are recalculated by the worker.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+')
+        parser.add_argument('--batch-size',
+                            type=int,
+                            default=BATCH_SIZE,
+                            help='Punches inserted at a time (default: {})'.format(BATCH_SIZE))
+        parser.add_argument('--created-by',
+                            help='Username recorded as the creator of the tickets')
+        parser.add_argument('--reimport',
+                            action='store_true',
+                            help='Reads the records already imported from the clock again, for '
+                                 'instance after registering missing PIS. Punches already '
+                                 'recorded are skipped anyway.')
+
+    def handle(self, *args, **options):
+        created_by = None
+        if options['created_by']:
+            try:
+                created_by = User.objects.get(username=options['created_by'])
+            except User.DoesNotExist:
+                raise CommandError('Usuário inexistente: {}'.format(options['created_by']))
+
+        for path in options['files']:
+            start = time.perf_counter()
+            afd = AfdImport(created_by=created_by,
+                            batch_size=options['batch_size'],
+                            reimport=options['reimport'])
+            # AFD files are ASCII text, but some clocks write the company name in Latin-1
+            with open(path, encoding='latin-1') as file:
+                try:
+                    afd.run(file)
+                except AfdError as e:
+                    raise CommandError('{}: {}'.format(path, e))
+            if afd.clock is None:
+                raise CommandError('{}: arquivo sem cabeçalho'.format(path))
+
+            self.stdout.write('{} (relógio {}): {} registros criados, {} duplicados, {} já '
+                              'importados, em {:.1f} s'.format(
+                                  path, afd.clock, afd.created, afd.duplicates, afd.skipped,
+                                  time.perf_counter() - start))
+            if afd.unknown:
+                self.stderr.write('PIS sem usuário: {}'.format(
+                    ', '.join('{:011d}'.format(pis) for pis in sorted(afd.unknown))))
@@ -0,0 +1,68 @@
+import csv
+import json
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from gerencex.core.ingestion import ingest
+
+
+def read_records(file, file_format):
+    """
+    :param file_format: 'csv' (with the header user,date_time,checkin,client_ip) or 'jsonl' (one
+    JSON object per line)
+    :return: An iterator over the records of the file, as dicts
+    """
+    if file_format == 'csv':
+        return csv.DictReader(file)
+    return (json.loads(line) for line in file if line.strip())
+
+
+class Command(BaseCommand):
+    help = 'Imports the tickets of kiosks and badge readers, from a CSV file (with the header ' \
+           'user,date_time,checkin,client_ip) or a JSON lines file. The file is read in ' \
+           'chunks, each one inserted in bulk. Tickets already recorded are skipped.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file')
+        parser.add_argument('--format',
+                            choices=('csv', 'jsonl'),
+                            help='Format of the file (default: by the extension)')
+        parser.add_argument('--chunk-size',
+                            type=int,
+                            default=5000,
+                            help='Tickets inserted at a time (default: 5000)')
+        parser.add_argument('--created-by',
+                            help='Username recorded as the creator of the tickets')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or ('jsonl' if options['file'].endswith(
+            ('.jsonl', '.json')) else 'csv')
+        created_by = None
+        if options['created_by']:
+            try:
+                created_by = User.objects.get(username=options['created_by'])
+            except User.DoesNotExist:
+                raise CommandError('Usuário inexistente: {}'.format(options['created_by']))
+
+        created = duplicates = errors = offset = 0
+        with open(options['file'], newline='', encoding='utf-8') as file:
+            records = read_records(file, file_format)
+            while True:
+                try:
+                    chunk = list(islice(records, options['chunk_size']))
+                except ValueError as e:
+                    raise CommandError('Linha inválida após o registro {}: {}'.format(
+                        offset + 1, e))
+                if not chunk:
+                    break
+                result = ingest(chunk, created_by=created_by)
+                created += result.created
+                duplicates += result.duplicates
+                errors += len(result.errors)
+                for idx, error in result.errors:
+                    self.stderr.write('Registro {}: {}'.format(offset + idx + 1, error))
+                offset += len(chunk)
+
+        self.stdout.write('{} registros criados, {} duplicados, {} inválidos'.format(
+            created, duplicates, errors))
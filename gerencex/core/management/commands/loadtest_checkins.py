@@ -0,0 +1,139 @@
+import math
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.middleware.csrf import get_token
+from django.shortcuts import resolve_url as r
+from django.test import Client, RequestFactory
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    """
+    Returns the redirects as they are, as HTTPErrors, instead of following them
+    """
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def percentile(values, fraction):
+    """
+    :return: The nearest-rank percentile of the values
+    """
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def session_headers(user):
+    """
+    :return: The headers of the requests of a logged in user: the session and the CSRF cookies,
+    and the CSRF token
+    """
+    client = Client()
+    client.force_login(user)
+    request = RequestFactory().get('/')
+    token = get_token(request)
+    cookies = {settings.SESSION_COOKIE_NAME: client.cookies[settings.SESSION_COOKIE_NAME].value,
+               settings.CSRF_COOKIE_NAME: request.META['CSRF_COOKIE']}
+    return {'Cookie': '; '.join('{}={}'.format(name, value) for name, value in cookies.items()),
+            'X-CSRFToken': token}
+
+
+def check_in_and_out(url, headers, rounds, follow):
+    """
+    The requests of a single client, one after the other
+    :return: The latency of each request, in seconds, and the number of failed requests
+    """
+    opener = urllib.request.build_opener() if follow else urllib.request.build_opener(NoRedirect)
+    latencies = []
+    errors = 0
+    for _ in range(rounds):
+        request = urllib.request.Request(url, data=b'', headers=headers, method='POST')
+        start = time.perf_counter()
+        try:
+            with opener.open(request) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as error:
+            status = error.code
+        except OSError:
+            status = None
+        latencies.append(time.perf_counter() - start)
+        if status not in (200, 201, 302):
+            errors += 1
+    return latencies, errors
+
+
+def load_test(url, users, rounds, follow=False):
+    """
+    All the users check in and out at the url at the same time, each one 'rounds' times, by
+    its own client thread
+    :param follow: whether the redirects are followed, as a browser does
+    :return: The number of requests, the number of failed requests, the elapsed seconds and the
+    latencies of all requests
+    """
+    headers = [session_headers(user) for user in users]
+    with ThreadPoolExecutor(max_workers=len(users)) as executor:
+        start = time.perf_counter()
+        results = list(executor.map(lambda h: check_in_and_out(url, h, rounds, follow), headers))
+        elapsed = time.perf_counter() - start
+    latencies = [latency for user_latencies, errors in results for latency in user_latencies]
+    return len(latencies), sum(errors for user_latencies, errors in results), elapsed, latencies
+
+
+class Command(BaseCommand):
+    help = 'Compares the throughput and the latencies of the check in view and of the JSON ' \
+           'check in API, under concurrent users, against a running server which shares the ' \
+           'configured database. The throwaway users, and their tickets, are deleted at the end.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server',
+                            default='http://127.0.0.1:8000',
+                            help='Address of the running server (default: '
+                                 'http://127.0.0.1:8000)')
+        parser.add_argument('--users',
+                            type=int,
+                            default=20,
+                            help='Number of users checking in and out at the same time '
+                                 '(default: 20)')
+        parser.add_argument('--rounds',
+                            type=int,
+                            default=10,
+                            help='Check ins and checkouts of each user (default: 10)')
+
+    def handle(self, *args, **options):
+        users = []
+        try:
+            results = self.run(options['server'].rstrip('/'), options['users'], options['rounds'],
+                               users)
+        finally:
+            # The users' tickets and balances are deleted with them
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+        self.stdout.write('{:<24}{:>10}{:>8}{:>10}{:>10}{:>10}{:>10}{:>10}'.format(
+            'endpoint', 'requests', 'errors', 'seconds', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+        row = '{:<24}{:>10}{:>8}{:>10.2f}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}'
+        for name, (requests, errors, elapsed, latencies) in results:
+            self.stdout.write(row.format(
+                name, requests, errors, elapsed, requests / elapsed,
+                *(1000 * percentile(latencies, fraction) for fraction in (0.5, 0.95, 0.99))))
+
+    def run(self, server, n_users, rounds, users):
+        """
+        :param users: the list the throwaway users are added to, as they are created
+        """
+        results = []
+        for idx, (name, url, follow) in enumerate((
+                ('timing_new', r('timing_new'), False),
+                ('timing_new + redirect', r('timing_new'), True),
+                ('api_timing_new', r('api_timing_new'), False))):
+            endpoint_users = [User.objects.create_user('loadtest_{}_{}'.format(idx, n),
+                                                       password=None)
+                              for n in range(n_users)]
+            users.extend(endpoint_users)
+            results.append((name, load_test(server + url, endpoint_users, rounds, follow)))
+        return results
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+from gerencex.core.jobs import process_jobs
+from gerencex.core.models import RecalculationJob
+
+
+class Command(BaseCommand):
+    help = 'Processes the pending recalculations of hours balances. Runs forever, unless ' \
+           '--once is informed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once',
+                            action='store_true',
+                            help='Processes the pending jobs and exits')
+        parser.add_argument('--interval',
+                            type=float,
+                            default=5,
+                            help='Seconds to wait before looking for new jobs (default: 5)')
+
+    def handle(self, *args, **options):
+        while True:
+            for job in process_jobs():
+                if job.status == RecalculationJob.DONE:
+                    self.stdout.write('{}: {} servidores recalculados'.format(job, job.done))
+                else:
+                    self.stderr.write('{}\n{}'.format(job, job.error))
+            if options['once']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from gerencex.core.models import Office
+from gerencex.core.timesheet import office_timesheets, write_timesheets, FORMATS
+
+
+class Command(BaseCommand):
+    help = 'Writes the monthly timesheets ("espelhos de ponto") of all workers of an office, as ' \
+           'HTML and CSV files, to a directory or to a zip file. The month is loaded at once and ' \
+           'the files are rendered by a pool of processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('office', help='Initials of the office')
+        parser.add_argument('year', type=int)
+        parser.add_argument('month', type=int, choices=range(1, 13))
+        parser.add_argument('output',
+                            help='Directory to write, or a file name ending with .zip')
+        parser.add_argument('--format',
+                            choices=FORMATS,
+                            action='append',
+                            help='Format of the files; may be repeated (default: all formats)')
+        parser.add_argument('--workers',
+                            type=int,
+                            help='Number of processes (default: the number of CPUs)')
+
+    def handle(self, *args, **options):
+        try:
+            office = Office.objects.get(initials=options['office'])
+        except Office.DoesNotExist:
+            raise CommandError('Lotação inexistente: {}'.format(options['office']))
+        if office.hours_control_start_date is None:
+            raise CommandError('A lotação não tem data de início do controle de horas')
+
+        start = time.perf_counter()
+        sheets = office_timesheets(office, options['year'], options['month'])
+        loaded = time.perf_counter()
+        written = write_timesheets(sheets,
+                                   options['output'],
+                                   formats=options['format'] or FORMATS,
+                                   workers=options['workers'])
+        self.stdout.write('{} espelhos de ponto, {} arquivos em {} ({:.1f} s de leitura, {:.1f} s '
+                          'de geração)'.format(len(sheets), written, options['output'],
+                                               loaded - start, time.perf_counter() - loaded))
@@ -0,0 +1,297 @@
+"""
+Counters and latency histograms of the check ins, the ingestion of tickets and the balance
+calculations, exposed at /metrics in the Prometheus text format.
+
+Each process (each gunicorn worker, the process_recalculations worker, the management commands)
+keeps its values in memory, and writes them to its own file at METRICS_DIR, at most every
+FLUSH_INTERVAL seconds. The endpoint sums the files of all processes, so the values of all the
+workers of a host are aggregated without any locking between them. Recording a value costs a
+dictionary update.
+
+The files are named after the process' pid and a random token, so a process reusing the pid of a
+dead one starts a file of its own. When the endpoint is read, the files of the dead processes are
+added to MERGED_FILE and removed, so the counters never go down and the files don't pile up.
+"""
+import atexit
+import bisect
+import fcntl
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# Seconds between the writes of a process' values to its file
+FLUSH_INTERVAL = 5
+
+# File of the values of the dead processes, and the lock of its updates
+MERGED_FILE = 'merged.json'
+LOCK_FILE = 'merge.lock'
+
+# Files of the live processes: <pid>_<token>.json
+PROCESS_FILE = re.compile(r'^(\d+)_[0-9a-f]+\.json$')
+
+# Upper bounds of the histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+JOB_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+CASCADE_BUCKETS = (0, 1, 10, 30, 100, 365, 1000, 3650)
+
+
+class Registry:
+    """
+    The metrics, and the values recorded by the current process
+    """
+    def __init__(self):
+        self.metrics = []
+        self.values = {}
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.token = uuid.uuid4().hex
+        self.flush_pending = False
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def add(self, key, function):
+        """
+        Updates a value, and schedules the write of the process' values
+        :param key: (metric name, labels) tuple
+        :param function: receives the current value, or None, and returns the new one
+        """
+        with self.lock:
+            if os.getpid() != self.pid:
+                # A forked process must not report its parent's values again
+                self.values = {}
+                self.pid = os.getpid()
+                self.token = uuid.uuid4().hex
+                self.flush_pending = False
+            self.values[key] = function(self.values.get(key))
+            if not self.flush_pending:
+                self.flush_pending = True
+                timer = threading.Timer(FLUSH_INTERVAL, self.flush)
+                timer.daemon = True
+                timer.start()
+
+    def clear(self):
+        """
+        Forgets the values recorded by the process, without writing them
+        """
+        with self.lock:
+            self.values = {}
+
+    def path(self):
+        return os.path.join(settings.METRICS_DIR, '{}_{}.json'.format(self.pid, self.token))
+
+    def flush(self):
+        """
+        Writes the process' values to its file, atomically, so that it is never read half written
+        """
+        with self.lock:
+            self.flush_pending = False
+            if not self.values or os.getpid() != self.pid:
+                return
+            # The histograms may be changed by other threads while they are written
+            values = {key: list(value) if isinstance(value, list) else value
+                      for key, value in self.values.items()}
+            path = self.path()
+        write_values(path, values)
+
+    def merge_dead_processes(self):
+        """
+        Adds the values of the dead processes to MERGED_FILE, and removes their files. Two
+        processes reading the endpoint at once merge one after the other.
+        """
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        with open(os.path.join(settings.METRICS_DIR, LOCK_FILE), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            dead = [name for name in os.listdir(settings.METRICS_DIR)
+                    if PROCESS_FILE.match(name) and
+                    not process_exists(int(PROCESS_FILE.match(name).group(1)))]
+            if not dead:
+                return
+            merged_path = os.path.join(settings.METRICS_DIR, MERGED_FILE)
+            totals = read_values(merged_path)
+            for name in dead:
+                add_values(totals, read_values(os.path.join(settings.METRICS_DIR, name)))
+            write_values(merged_path, totals)
+            for name in dead:
+                os.remove(os.path.join(settings.METRICS_DIR, name))
+
+    def collect(self):
+        """
+        :return: The values of all processes, summed, by (metric name, labels)
+        """
+        self.flush()
+        self.merge_dead_processes()
+        totals = {}
+        for name in os.listdir(settings.METRICS_DIR):
+            if name == MERGED_FILE or PROCESS_FILE.match(name):
+                add_values(totals, read_values(os.path.join(settings.METRICS_DIR, name)))
+        return totals
+
+    def exposition(self):
+        """
+        :return: The values of all processes, in the Prometheus text format
+        """
+        totals = self.collect()
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.documentation))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            series = sorted((labels, value) for (name, labels), value in totals.items()
+                            if name == metric.name)
+            for labels, value in series:
+                lines.extend(metric.samples(labels, value))
+        return '\n'.join(lines) + '\n'
+
+
+def process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # It exists, but belongs to another user
+        return True
+    return True
+
+
+def read_values(path):
+    """
+    :return: The values of a file, by (metric name, labels). A missing or unreadable file has none.
+    """
+    try:
+        with open(path) as file:
+            entries = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    return {(name, tuple(tuple(label) for label in labels)): value
+            for name, labels, value in entries}
+
+
+def write_values(path, values):
+    """
+    Writes the values to a file, atomically
+    """
+    entries = [[name, list(labels), value] for (name, labels), value in values.items()]
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(handle, 'w') as file:
+        json.dump(entries, file)
+    os.replace(temp_path, path)
+
+
+def add_values(totals, values):
+    """
+    Adds the values to the totals: the counters are summed, and the histograms bucket by bucket
+    """
+    for key, value in values.items():
+        current = totals.get(key)
+        if current is None:
+            totals[key] = value
+        elif isinstance(value, list):
+            totals[key] = [a + b for a, b in zip(current, value)]
+        else:
+            totals[key] = current + value
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, value) for name, value in labels) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, registry):
+        self.name = name
+        self.documentation = documentation
+        self.registry = registry
+        registry.register(self)
+
+    def inc(self, amount=1, **labels):
+        self.registry.add((self.name, tuple(sorted(labels.items()))),
+                          lambda value: (value or 0) + amount)
+
+    def samples(self, labels, value):
+        return ['{}{} {}'.format(self.name, format_labels(labels), value)]
+
+
+class Histogram:
+    """
+    The values are kept as the count of each bucket, plus the sum and the count of all values
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, registry, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.registry = registry
+        registry.register(self)
+        self.buckets = buckets
+
+    def observe(self, amount, **labels):
+        idx = bisect.bisect_left(self.buckets, amount)
+
+        def add(value):
+            value = value or [0] * (len(self.buckets) + 3)
+            value[idx] += 1
+            value[-2] += amount
+            value[-1] += 1
+            return value
+
+        self.registry.add((self.name, tuple(sorted(labels.items()))), add)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self, labels, value):
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), value):
+            cumulative += count
+            samples.append('{}_bucket{} {}'.format(
+                self.name, format_labels(labels + (('le', bound),)), cumulative))
+        samples.append('{}_sum{} {}'.format(self.name, format_labels(labels), value[-2]))
+        samples.append('{}_count{} {}'.format(self.name, format_labels(labels), value[-1]))
+        return samples
+
+
+registry = Registry()
+atexit.register(registry.flush)
+
+CHECKINS = Counter('gerencex_checkins_total',
+                   'Check ins and checkouts recorded by the users',
+                   registry)
+CHECKIN_SECONDS = Histogram('gerencex_checkin_seconds',
+                            'Time to record a check in or a checkout',
+                            registry)
+TICKETS_INGESTED = Counter('gerencex_tickets_ingested_total',
+                           'Tickets imported in batches, by source',
+                           registry)
+DATEDATA_EVALUATIONS = Counter('gerencex_datedata_evaluations_total',
+                               'Daily credits calculated from the tickets',
+                               registry)
+BALANCE_ROWS_WRITTEN = Counter('gerencex_balance_rows_written_total',
+                               'HoursBalance lines inserted or updated',
+                               registry)
+CASCADE_LENGTH = Histogram('gerencex_balance_cascade_length',
+                           'Following balances changed by a change in a line',
+                           registry,
+                           buckets=CASCADE_BUCKETS)
+RECALCULATION_SECONDS = Histogram('gerencex_recalculation_seconds',
+                                  'Duration of the recalculation jobs, by status',
+                                  registry,
+                                  buckets=JOB_BUCKETS)
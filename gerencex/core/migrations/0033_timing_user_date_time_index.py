@@ -0,0 +1,19 @@
+# Generated by Django 2.1.2 on 2026-10-18 07:47
+
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0032_auto_20161214_1539'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='timing',
+            index_together={('user', 'date_time')},
+        ),
+    ]
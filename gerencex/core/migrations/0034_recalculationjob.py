@@ -0,0 +1,39 @@
+# Generated by Django 2.1.2 on 2026-10-18 07:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0033_timing_user_date_time_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecalculationJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('begin_date', models.DateField(verbose_name='data inicial')),
+                ('status', models.CharField(choices=[('P', 'Aguardando'), ('R', 'Em andamento'), ('D', 'Concluído'), ('F', 'Falhou')], default='P', max_length=1, verbose_name='situação')),
+                ('total', models.IntegerField(default=0, verbose_name='servidores a calcular')),
+                ('done', models.IntegerField(default=0, verbose_name='servidores calculados')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, verbose_name='criado em')),
+                ('updated', models.DateTimeField(default=django.utils.timezone.now, verbose_name='atualizado em')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='concluído em')),
+                ('error', models.TextField(blank=True, default='', verbose_name='erro')),
+                ('office', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recalculations', to='core.Office')),
+            ],
+            options={
+                'verbose_name': 'recálculo do banco de horas',
+                'verbose_name_plural': 'recálculos do banco de horas',
+                'ordering': ['created'],
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='recalculationjob',
+            index_together={('status', 'office')},
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 2.1.2 on 2026-10-18 07:57
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0034_recalculationjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recalculationjob',
+            name='end_date',
+            field=models.DateField(blank=True, null=True, verbose_name='data final'),
+        ),
+        migrations.AddField(
+            model_name='recalculationjob',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='recalculations', to=settings.AUTH_USER_MODEL, verbose_name='servidor'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 2.1.2 on 2026-10-18 08:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_open_sessions(apps, schema_editor):
+    UserDetail = apps.get_model('core', 'UserDetail')
+    Timing = apps.get_model('core', 'Timing')
+    for detail in UserDetail.objects.all():
+        last = Timing.objects.filter(user=detail.user_id).order_by('date_time').last()
+        if last is not None and last.checkin:
+            UserDetail.objects.filter(pk=detail.pk).update(open_ticket=last,
+                                                           open_since=last.date_time)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0035_recalculationjob_user_end_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userdetail',
+            name='open_since',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='em aberto desde'),
+        ),
+        migrations.AddField(
+            model_name='userdetail',
+            name='open_ticket',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.Timing', verbose_name='entrada em aberto'),
+        ),
+        migrations.AlterIndexTogether(
+            name='userdetail',
+            index_together={('office', 'open_since')},
+        ),
+        migrations.RunPython(fill_open_sessions, migrations.RunPython.noop),
+    ]
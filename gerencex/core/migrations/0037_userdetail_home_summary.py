@@ -0,0 +1,62 @@
+# Generated by Django 2.1.2 on 2026-10-18 08:04
+
+import json
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fill_home_summary(apps, schema_editor):
+    UserDetail = apps.get_model('core', 'UserDetail')
+    Timing = apps.get_model('core', 'Timing')
+    HoursBalance = apps.get_model('core', 'HoursBalance')
+    current_tz = timezone.get_current_timezone()
+    for detail in UserDetail.objects.all():
+        values = {}
+        last = Timing.objects.filter(user=detail.user_id).order_by('date_time').last()
+        if last is not None:
+            last_date = last.date_time.astimezone(current_tz).date()
+            day_tickets = [t for t in Timing.objects.filter(
+                           user=detail.user_id,
+                           date_time__gt=last.date_time - timedelta(days=2)).order_by('date_time')
+                           if t.date_time.astimezone(current_tz).date() == last_date]
+            values['last_ticket_at'] = last.date_time
+            values['last_day_tickets'] = json.dumps([[t.date_time.isoformat(), t.checkin]
+                                                     for t in day_tickets])
+        line = HoursBalance.objects.filter(user=detail.user_id).order_by('date').last()
+        if line is not None:
+            values['balance'] = line.balance
+            values['balance_date'] = line.date
+        UserDetail.objects.filter(pk=detail.pk).update(**values)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0036_userdetail_open_session'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userdetail',
+            name='balance',
+            field=models.IntegerField(blank=True, null=True, verbose_name='último saldo'),
+        ),
+        migrations.AddField(
+            model_name='userdetail',
+            name='balance_date',
+            field=models.DateField(blank=True, null=True, verbose_name='data do último saldo'),
+        ),
+        migrations.AddField(
+            model_name='userdetail',
+            name='last_day_tickets',
+            field=models.TextField(blank=True, default='[]', verbose_name='registros do último dia'),
+        ),
+        migrations.AddField(
+            model_name='userdetail',
+            name='last_ticket_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='último registro'),
+        ),
+        migrations.RunPython(fill_home_summary, migrations.RunPython.noop),
+    ]
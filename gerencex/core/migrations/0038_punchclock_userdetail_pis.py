@@ -0,0 +1,32 @@
+# Generated by Django 2.1.2 on 2026-10-18 08:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0037_userdetail_home_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PunchClock',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('serial', models.CharField(max_length=17, unique=True, verbose_name='número de fabricação')),
+                ('last_nsr', models.PositiveIntegerField(default=0, verbose_name='último NSR importado')),
+                ('last_import', models.DateTimeField(blank=True, null=True, verbose_name='última importação')),
+            ],
+            options={
+                'verbose_name': 'relógio de ponto',
+                'verbose_name_plural': 'relógios de ponto',
+                'ordering': ['serial'],
+            },
+        ),
+        migrations.AddField(
+            model_name='userdetail',
+            name='pis',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=14, verbose_name='PIS'),
+        ),
+    ]
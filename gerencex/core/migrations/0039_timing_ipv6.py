@@ -0,0 +1,23 @@
+# Generated by Django 2.1.2 on 2026-10-18 09:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0038_punchclock_userdetail_pis'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='timing',
+            name='client_ip',
+            field=models.CharField(blank=True, default='', max_length=45, verbose_name='ip do cliente'),
+        ),
+        migrations.AlterField(
+            model_name='timing',
+            name='client_local_ip',
+            field=models.CharField(blank=True, default='', max_length=45, verbose_name='ip local do cliente'),
+        ),
+    ]
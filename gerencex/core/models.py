@@ -1,13 +1,24 @@
+import json
 from datetime import timedelta, time
 
 from django.contrib.auth.models import User
 from django.db import models
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from gerencex.core.validators import validate_date
 
 
 # Create your models here.
 
+def signed_time(seconds):
+    """
+    :return: A number of seconds in the format H:MM:SS or -H:MM:SS
+    """
+    if seconds < 0:
+        return '-{}'.format(timedelta(seconds=abs(seconds)))
+    return str(timedelta(seconds=seconds))
+
+
 class UserDetail(models.Model):
     """
     The default values are set at User's creation or saving (via signals). See 'signals.py'
@@ -26,10 +37,47 @@ class UserDetail(models.Model):
                                )
     opening_hours_balance = models.IntegerField('saldo inicial',
                                                 default=0)
+    # Identifies the user at the files exported by the punch clocks. See 'afd.py'
+    pis = models.CharField('PIS',
+                           max_length=14,
+                           blank=True,
+                           default='',
+                           db_index=True)
+    # The open session: the user's last ticket, if it is a check in. It is refreshed whenever a
+    # ticket is saved or deleted (see 'signals.py'), so that nobody needs to scan Timing to know
+    # who is at work or who forgot to check out.
+    open_ticket = models.ForeignKey('Timing',
+                                    models.SET_NULL,
+                                    null=True,
+                                    blank=True,
+                                    related_name='+',
+                                    verbose_name='entrada em aberto')
+    open_since = models.DateTimeField('em aberto desde', null=True, blank=True)
+    # The home page summary, refreshed whenever tickets and balances are written (see
+    # 'signals.py' and 'ledger.py'): the last ticket time, the tickets of its day, in JSON, and the
+    # user's last balance
+    last_ticket_at = models.DateTimeField('último registro', null=True, blank=True)
+    last_day_tickets = models.TextField('registros do último dia', blank=True, default='[]')
+    balance = models.IntegerField('último saldo', null=True, blank=True)
+    balance_date = models.DateField('data do último saldo', null=True, blank=True)
+
+    # Fields written only by the Timing and HoursBalance updates
+    derived_fields = ('atwork', 'open_ticket', 'open_since', 'last_ticket_at', 'last_day_tickets',
+                      'balance', 'balance_date')
+
+    class Meta:
+        index_together = ['office', 'open_since']
 
     def __str__(self):
         return self.user.username
 
+    def tickets_of_last_day(self):
+        """
+        :return: (date_time, checkin) tuples for the tickets of the day of the last ticket
+        """
+        return [(parse_datetime(date_time), checkin)
+                for date_time, checkin in json.loads(self.last_day_tickets)]
+
 
 class Timing(models.Model):
     user = models.ForeignKey(User,
@@ -41,12 +89,13 @@ class Timing(models.Model):
                                    models.SET_NULL,
                                    null=True,
                                    blank=True)
+    # Long enough for IPv6 addresses
     client_ip = models.CharField('ip do cliente',
-                                 max_length=15,
+                                 max_length=45,
                                  blank=True,
                                  default='')
     client_local_ip = models.CharField('ip local do cliente',
-                                       max_length=15,
+                                       max_length=45,
                                        blank=True,
                                        default='')
 
@@ -54,6 +103,7 @@ class Timing(models.Model):
         verbose_name_plural = 'registros de entrada e saída'
         verbose_name = 'registro de entrada e saída'
         ordering = ['date_time']
+        index_together = ['user', 'date_time']
 
     def __str__(self):
         if self.checkin:
@@ -80,6 +130,14 @@ class Restday(models.Model):
         return '{}: {} ({}) horas'.format(self.date, self.note, self.work_hours)
 
 
+class CalendarVersion(models.Model):
+    """
+    The version of the restday calendar, incremented by each change in restdays. It is kept in
+    the database, so that the processes of all hosts see it (see restday_calendar.py).
+    """
+    version = models.PositiveIntegerField(default=0)
+
+
 class HoursBalance(models.Model):
     """
     The user balance is always calculated via signals. See 'signals.py'
@@ -108,9 +166,7 @@ class HoursBalance(models.Model):
         return str(timedelta(seconds=self.debit))
 
     def time_balance(self):
-        if self.balance < 0:
-            return '-{}'.format(timedelta(seconds=abs(self.balance)))
-        return str(timedelta(seconds=self.balance))
+        return signed_time(self.balance)
 
     time_credit.short_description = 'crédito'
     time_debit.short_description = 'débito'
@@ -231,4 +287,80 @@ class Office(models.Model):
         ordering = ['initials']
 
     def __str__(self):
-        return '{}'.format(self.initials)
\ No newline at end of file
+        return '{}'.format(self.initials)
+
+
+class RecalculationJob(models.Model):
+    """
+    A recalculation of the hours balances of an office, from a given date up until yesterday.
+    The jobs are processed out of the request path by the 'process_recalculations' management
+    command. See 'jobs.py'.
+
+    Jobs with an end date mark a range of existent lines as dirty, after changes in tickets,
+    absences or restdays. They are restricted to a single worker if 'user' is informed.
+    """
+    PENDING = 'P'
+    RUNNING = 'R'
+    DONE = 'D'
+    FAILED = 'F'
+
+    STATUS_CHOICES = (
+        (PENDING, 'Aguardando'),
+        (RUNNING, 'Em andamento'),
+        (DONE, 'Concluído'),
+        (FAILED, 'Falhou'),
+    )
+
+    office = models.ForeignKey(Office,
+                               models.CASCADE,
+                               related_name='recalculations')
+    user = models.ForeignKey(User,
+                             models.CASCADE,
+                             null=True,
+                             blank=True,
+                             verbose_name='servidor',
+                             related_name='recalculations')
+    begin_date = models.DateField('data inicial')
+    end_date = models.DateField('data final', null=True, blank=True)
+    status = models.CharField('situação', max_length=1, choices=STATUS_CHOICES, default=PENDING)
+    total = models.IntegerField('servidores a calcular', default=0)
+    done = models.IntegerField('servidores calculados', default=0)
+    created = models.DateTimeField('criado em', default=timezone.now)
+    updated = models.DateTimeField('atualizado em', default=timezone.now)
+    finished = models.DateTimeField('concluído em', null=True, blank=True)
+    error = models.TextField('erro', blank=True, default='')
+
+    class Meta:
+        verbose_name = 'recálculo do banco de horas'
+        verbose_name_plural = 'recálculos do banco de horas'
+        ordering = ['created']
+        index_together = ['status', 'office']
+
+    def progress(self):
+        """
+        :return: The percentage of office workers already calculated
+        """
+        return int(100 * self.done / self.total) if self.total else 0
+
+    def __str__(self):
+        target = self.user if self.user_id else self.office
+        return '{} -- {} : {}'.format(target, self.begin_date, self.get_status_display())
+
+
+class PunchClock(models.Model):
+    """
+    An electronic punch clock (REP), whose AFD files are imported by the 'import_afd' management
+    command. The NSR (the record sequential number) of the last imported record is kept, so that
+    the records of a file are imported only once, even if the clock's files overlap.
+    """
+    serial = models.CharField('número de fabricação', max_length=17, unique=True)
+    last_nsr = models.PositiveIntegerField('último NSR importado', default=0)
+    last_import = models.DateTimeField('última importação', null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'relógio de ponto'
+        verbose_name_plural = 'relógios de ponto'
+        ordering = ['serial']
+
+    def __str__(self):
+        return self.serial
@@ -0,0 +1,94 @@
+import ipaddress
+import socket
+import threading
+import time
+
+from django.conf import settings
+
+
+class NetworkPolicy:
+    """
+    The networks from which check ins and checkouts are allowed.
+
+    They are the CIDR ranges informed in settings, plus the networks of the addresses of the
+    company site. The site is resolved by a background thread, at most every 'ttl' seconds, so
+    that no request ever waits for the DNS. While the site was never resolved, only the CIDR
+    ranges are allowed. If a resolution fails, the last resolved networks are kept.
+    """
+    def __init__(self, networks=(), site='', prefix_length=24, ttl=300, enforce=False,
+                 developer_hostname='', resolver=socket.gethostbyname_ex):
+        self.static_networks = [ipaddress.ip_network(n.strip(), strict=False)
+                                for n in networks if n.strip()]
+        self.site = site
+        self.prefix_length = prefix_length
+        self.ttl = ttl
+        self.resolver = resolver
+        self.site_networks = []
+        self.resolved_at = None
+        self.refreshing = False
+        self.lock = threading.Lock()
+
+        # Check ins are also allowed from the developer workstation, to avoid breaking the tests
+        self.enforce = enforce and not (developer_hostname and
+                                        developer_hostname == socket.gethostname())
+
+    def networks(self):
+        """
+        :return: The allowed networks. Starts a background refresh if the site networks expired.
+        """
+        if self.site and (self.resolved_at is None or
+                          time.monotonic() - self.resolved_at >= self.ttl):
+            self.refresh_in_background()
+        return self.static_networks + self.site_networks
+
+    def refresh_in_background(self):
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+        threading.Thread(target=self.refresh, daemon=True).start()
+
+    def refresh(self):
+        """
+        Resolves the company site. It blocks, so it must not be called at the request path.
+        """
+        try:
+            addresses = self.resolver(self.site)[2]
+            self.site_networks = [
+                ipaddress.ip_network('{}/{}'.format(address, self.prefix_length), strict=False)
+                for address in addresses]
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.resolved_at = time.monotonic()
+            self.refreshing = False
+
+    def allows(self, ip):
+        """
+        :param ip: the client IP, as returned by functions.get_client_ip
+        """
+        if not self.enforce:
+            return True
+        try:
+            address = ipaddress.ip_address(ip.strip())
+        except (AttributeError, ValueError):
+            return False
+        return any(address in network for network in self.networks())
+
+
+network_policy = None
+
+
+def get_network_policy():
+    """
+    :return: The policy of the worker, configured by the COMPANY_* settings
+    """
+    global network_policy
+    if network_policy is None:
+        network_policy = NetworkPolicy(networks=settings.COMPANY_NETWORKS,
+                                       site=settings.COMPANY_SITE,
+                                       prefix_length=settings.COMPANY_SITE_PREFIX_LENGTH,
+                                       ttl=settings.COMPANY_SITE_TTL,
+                                       enforce=settings.CHECK_CLIENT_NETWORK,
+                                       developer_hostname=settings.DEVELOPER_HOSTNAME)
+    return network_policy
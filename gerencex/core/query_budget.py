@@ -0,0 +1,92 @@
+"""
+Query budgets: the maximum number of queries a code path may run. A budget exceeded raises
+QueryBudgetExceeded, reporting the queries run more than once, which is how N+1 patterns (a query
+per user, or per day) show up.
+
+    with QueryBudget(5):
+        client.get(url)
+
+    @QueryBudget(5)
+    def my_function():
+        ...
+"""
+import re
+from collections import Counter
+from contextlib import ContextDecorator
+
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.test.utils import CaptureQueriesContext
+
+# Literals in the SQL, replaced by '?' so that the queries differing only in their parameters
+# are grouped
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+IN_LISTS = re.compile(r'IN \(\?(?:, \?)*\)')
+
+# Repeated queries shown in the report
+MAX_REPORTED = 10
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def normalized(sql):
+    """
+    :return: The SQL with its literals replaced by '?', and its IN lists by 'IN (...)'
+    """
+    return IN_LISTS.sub('IN (...)', LITERALS.sub('?', sql))
+
+
+def repeated_queries(queries):
+    """
+    :param queries: the queries captured by CaptureQueriesContext
+    :return: (count, normalized SQL) tuples of the queries run more than once, the most repeated
+    first
+    """
+    counter = Counter(normalized(query['sql']) for query in queries)
+    return [(count, sql) for sql, count in counter.most_common() if count > 1]
+
+
+class QueryBudget(ContextDecorator):
+    """
+    Fails when the code run inside it, as a context manager or as a decorator, runs more than
+    max_queries queries. Savepoints count as queries, as at TestCase.assertNumQueries.
+    """
+    def __init__(self, max_queries, using=DEFAULT_DB_ALIAS, label=None):
+        """
+        :param using: the database alias
+        :param label: the name of the code path, shown in the report
+        """
+        self.max_queries = max_queries
+        self.using = using
+        self.label = label
+        self.captured = None
+
+    def __enter__(self):
+        self.captured = CaptureQueriesContext(connections[self.using])
+        self.captured.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.captured.__exit__(exc_type, exc_value, traceback)
+        if exc_type is None and len(self.captured) > self.max_queries:
+            raise QueryBudgetExceeded(self.report())
+
+    def __len__(self):
+        return len(self.captured)
+
+    @property
+    def queries(self):
+        return self.captured.captured_queries
+
+    def report(self):
+        """
+        :return: The number of queries run, the budget and the most repeated queries
+        """
+        lines = ['{}{} queries run, over the budget of {}'.format(
+            '{}: '.format(self.label) if self.label else '', len(self), self.max_queries)]
+        repeated = repeated_queries(self.queries)
+        if repeated:
+            lines.append('Repeated queries:')
+            lines.extend('{:>5} x {}'.format(count, sql) for count, sql in repeated[:MAX_REPORTED])
+        return '\n'.join(lines)
@@ -0,0 +1,140 @@
+import bisect
+import datetime
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from gerencex.core.models import Restday, CalendarVersion
+
+CalendarDay = namedtuple('CalendarDay', ['date', 'note', 'work_hours'])
+
+
+class RestdayCalendar:
+    """
+    All the restdays, indexed by date
+    """
+    def __init__(self, days):
+        self.days = {d.date: d for d in days}
+        self.dates = sorted(self.days)
+
+    def get(self, date):
+        """
+        :return: The CalendarDay of the date, or None if it is not a restday
+        """
+        return self.days.get(date)
+
+    def __contains__(self, date):
+        return date in self.days
+
+    def between(self, begin, end):
+        """
+        :return: The CalendarDays between begin and (end - 1), ordered by date
+        """
+        first = bisect.bisect_left(self.dates, begin)
+        last = bisect.bisect_left(self.dates, end)
+        return [self.days[d] for d in self.dates[first:last]]
+
+    def in_year(self, year):
+        return self.between(datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1))
+
+
+def current_version():
+    """
+    :return: The version of the calendar shared by all processes, or None if it never changed
+    """
+    return CalendarVersion.objects.order_by('pk').values_list('version', flat=True).first()
+
+
+def increment_version():
+    if not CalendarVersion.objects.update(version=F('version') + 1):
+        CalendarVersion.objects.create(version=1)
+
+
+class CalendarCache:
+    """
+    Keeps the restday calendar in memory, loading it once per process.
+
+    Saving or deleting a Restday invalidates the calendar of the current process and increments
+    the calendar version, kept in the database, in the same transaction. The other processes, on
+    this host or on others, compare their version with the database's every
+    RESTDAY_CALENDAR_CHECK_INTERVAL seconds, or at once after recheck(), and reload the calendar
+    when they differ. While a change is not committed, the calendar is read from the database at
+    each call, so that a rollback never leaves a stale calendar behind. A rolled back transaction
+    discards its on_commit callbacks, which is how the cache knows the change is gone.
+    """
+    def __init__(self, check_interval=None):
+        """
+        :param check_interval: the seconds between the version checks. If not informed,
+        RESTDAY_CALENDAR_CHECK_INTERVAL.
+        """
+        self.check_interval = check_interval
+        self.calendar = None
+        self.version = None
+        self.checked_at = 0
+        self.pending = False
+
+    def is_pending(self):
+        """
+        :return: Whether a Restday change of the current transaction is not committed yet
+        """
+        if self.pending and not any(func == self.committed
+                                    for sids, func in connection.run_on_commit):
+            # The transaction, or the savepoint, of the change was rolled back
+            self.pending = False
+        return self.pending
+
+    def get(self):
+        if self.is_pending():
+            return self.load()
+
+        now = time.monotonic()
+        interval = settings.RESTDAY_CALENDAR_CHECK_INTERVAL if self.check_interval is None \
+            else self.check_interval
+        if self.calendar is not None and self.checked_at is not None and \
+                now - self.checked_at < interval:
+            return self.calendar
+
+        version = current_version()
+        self.checked_at = now
+        if self.calendar is None or version != self.version:
+            self.calendar = self.load()
+            self.version = version
+        return self.calendar
+
+    def load(self):
+        return RestdayCalendar(CalendarDay(r.date, r.note, r.work_hours)
+                               for r in Restday.objects.all())
+
+    def recheck(self):
+        """
+        Makes the next call compare the version with the database's, however recent the last
+        check, so that a change committed by another process is seen
+        """
+        self.checked_at = None
+
+    def invalidate(self):
+        self.calendar = None
+        self.pending = True
+        increment_version()
+        transaction.on_commit(self.committed)
+
+    def committed(self):
+        self.calendar = None
+        self.pending = False
+
+
+calendar_cache = CalendarCache()
+
+
+def get_restday_calendar():
+    return calendar_cache.get()
+
+
+def invalidate_restday_calendar():
+    calendar_cache.invalidate()
+
+
+def recheck_restday_calendar():
+    calendar_cache.recheck()
@@ -1,39 +1,66 @@
 from datetime import timedelta
 
 from django.contrib.auth.models import User
-from django.db.models.signals import pre_save, post_save
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.utils import timezone
 from django.dispatch import receiver
+from gerencex.core.functions import refresh_ticket_summary
+from gerencex.core.instrumentation import timed
+from gerencex.core.jobs import mark_dirty, mark_offices_dirty
+from gerencex.core.ledger import recompute_balances, refresh_last_balance, shift_balances
 from gerencex.core.models import HoursBalance, UserDetail, Timing, Restday, Absences, Office
-from gerencex.core.time_calculations import DateData
+from gerencex.core.restday_calendar import invalidate_restday_calendar
+from gerencex.core.time_calculations import current_tz
 
 
 @receiver(pre_save, sender=HoursBalance)
+@timed('signals')
 def total_balance_handler(sender, instance, **kwargs):
     """
     Before saving, the daily balance must be calculated, taking into account the previous balance
-    and the daily credit and debit.
+    and the daily credit and debit. The stored date and balance of a changed line are kept in
+    the instance, for next_balance_handler.
     """
-    previous = sender.objects.filter(user=instance.user, date__lt=instance.date).last()
+    previous = sender.objects.filter(user=instance.user_id, date__lt=instance.date).last()
 
     if previous is not None:
         instance.balance = previous.balance + instance.credit - instance.debit
     else:
         instance.balance = instance.credit - instance.debit
 
+    instance.stored = None
+    if instance.pk is not None:
+        instance.stored = sender.objects.filter(pk=instance.pk).values_list(
+            'date', 'balance').first()
+
 
 @receiver(post_save, sender=HoursBalance)
+@timed('signals')
 def next_balance_handler(sender, instance, created, **kwargs):
     """
-    After saving, the next balance must be recalculated, if it exists.
+    After saving, the next balances must be recalculated, if they exist. Since they were
+    consistent with the line, they are all shifted by the change in its balance, in a single
+    statement (see ledger.py). A line moved to another date has them recalculated in a single
+    pass instead.
     """
-    if not created:
-        next_bal = sender.objects.filter(user=instance.user, date__gt=instance.date).first()
-        if next_bal and next_bal.pk != instance.pk:
-            next_bal.save()
+    stored = getattr(instance, 'stored', None)
+    if stored is None:
+        delta = instance.credit - instance.debit
+    elif stored[0] == instance.date:
+        delta = instance.balance - stored[1]
+    else:
+        recompute_balances(instance.user_id, min(stored[0], instance.date))
+        return
+
+    if delta:
+        shift_balances(instance.user_id, instance.date, delta)
+    else:
+        refresh_last_balance(instance.user_id)
 
 
 @receiver(pre_save, sender=User)
+@timed('signals')
 def create_default_office(sender, instance, **kwargs):
     if not Office.objects.filter(pk=1):
         Office.objects.create(
@@ -43,79 +70,131 @@ def create_default_office(sender, instance, **kwargs):
 
 
 @receiver(post_save, sender=User)
+@timed('signals')
 def create_user_userdetail(sender, instance, created, **kwargs):
     if created:
         UserDetail.objects.create(user=instance)
 
 
 @receiver(post_save, sender=User)
+@timed('signals')
 def save_user_userdetail(sender, instance, **kwargs):
 
     # The following condition avoids error when trying to save a User which does not have
     # UserDetail (for example, the admin user, created at project's beginning).
 
     if UserDetail.objects.filter(user=instance):
-        instance.userdetail.save()
+        # The derived fields may have been changed by a ticket since the UserDetail was read
+        detail = instance.userdetail
+        detail.save(update_fields=[f.name for f in detail._meta.concrete_fields
+                                   if not f.primary_key and f.name not in detail.derived_fields])
     else:
         UserDetail.objects.create(user=instance)
 
 
+def registry_date(instance):
+    """
+    :return: The local date of a Timing, Absences or Restday registry
+    """
+    if isinstance(instance, Timing):
+        return instance.date_time.astimezone(current_tz).date()
+    return instance.date
+
+
+@receiver(pre_save, sender=Timing)
+@receiver(pre_save, sender=Absences)
+@receiver(pre_save, sender=Restday)
+@timed('signals')
+def previous_date_handler(sender, instance, **kwargs):
+    """
+    A changed registry may have been moved to another date. Both dates are dirty, so the previous
+    one is kept in the instance.
+    """
+    instance.previous_date = None
+    if instance.pk is not None:
+        previous = sender.objects.filter(pk=instance.pk).first()
+        if previous is not None:
+            instance.previous_date = registry_date(previous)
+
+
+def dirty_range(instance):
+    """
+    :return: The first and the last dates whose balances are affected by a registry change
+    """
+    dates = [registry_date(instance), getattr(instance, 'previous_date', None)]
+    dates = [d for d in dates if d is not None]
+    return min(dates), max(dates)
+
+
 @receiver(post_save, sender=Timing)
-def credit_calculation(sender, instance, created, **kwargs):
-    """
-    Changes in check ins and checkouts registries must trigger an HoursBalance
-    recalculation, if there is an existent balance for the same date and user.
-    """
-    date = instance.date_time.date()
-    balance_line = HoursBalance.objects.filter(date=date, user=instance.user)
-
-    if balance_line:
-        # if instance.checkin:
-        #     next_ticket_is_checkout = sender.objects.filter(user=instance.user,
-        #                                                     date_time__date=date,
-        #                                                     date_time__gt=instance.date_time,
-        #                                                     checkin=False).first()
-        #     if next_ticket_is_checkout:
-        #         credit = DateData(instance.user, date).credit().seconds
-        #         debit = DateData(instance.user, date).debit().seconds
-        #         change_balance(date, instance.user, credit, debit)
-        # else:
-        credit = DateData(instance.user, date).credit().seconds
-        debit = DateData(instance.user, date).debit().seconds
-        # change_balance(date, instance.user, credit, debit)
-        balance_line[0].credit = credit
-        balance_line[0].debit = debit
-        balance_line[0].save()
+@receiver(post_delete, sender=Timing)
+@timed('signals')
+def credit_calculation(sender, instance, **kwargs):
+    """
+    Changes in check ins and checkouts registries must trigger an HoursBalance recalculation.
+    The dates are just marked as dirty, after the transaction is committed: the lines are
+    recalculated by the 'process_recalculations' command, once per user, however many changes
+    were made.
+    """
+    user_id, (begin, end) = instance.user_id, dirty_range(instance)
+    transaction.on_commit(lambda: mark_dirty(user_id, begin, end))
+
+
+@receiver(post_save, sender=Timing)
+@receiver(post_delete, sender=Timing)
+@timed('signals')
+def last_tickets_handler(sender, instance, **kwargs):
+    """
+    Whenever a ticket is saved or deleted, the user's last tickets are summarized at UserDetail
+    """
+    refresh_ticket_summary(instance.user_id)
+
+
+@receiver(post_delete, sender=HoursBalance)
+@timed('signals')
+def last_balance_handler(sender, instance, **kwargs):
+    """
+    The daily balance of a deleted line is taken out of the following balances
+    """
+    delta = instance.debit - instance.credit
+    if delta:
+        shift_balances(instance.user_id, instance.date, delta)
+    else:
+        refresh_last_balance(instance.user_id)
+
+
+@receiver(post_save, sender=Restday)
+@receiver(post_delete, sender=Restday)
+@timed('signals')
+def restday_calendar_handler(sender, instance, **kwargs):
+    """
+    The in-memory restday calendar must be reloaded when a Restday changes.
+    """
+    invalidate_restday_calendar()
 
 
 @receiver(post_save, sender=Restday)
-def debit_calculation_restday(sender, instance, created, **kwargs):
+@receiver(post_delete, sender=Restday)
+@timed('signals')
+def debit_calculation_restday(sender, instance, **kwargs):
     """
     When we record a Restday whose date is already in lines at HoursBalance, we must
-    recalculate the balance at these lines.
+    recalculate the balance at these lines, for all offices.
     """
-    balance_lines = [x for x in HoursBalance.objects.filter(date=instance.date,
-                                                            user__is_superuser=False)]
-    if len(balance_lines) != 0:
-        for line in balance_lines:
-            line.debit = DateData(line.user, instance.date).debit().seconds
-            line.save()
+    begin, end = dirty_range(instance)
+    transaction.on_commit(lambda: mark_offices_dirty(begin, end))
 
 
 @receiver(post_save, sender=Absences)
-def debit_calculation_absence(sender, instance, created, **kwargs):
+@receiver(post_delete, sender=Absences)
+@timed('signals')
+def debit_calculation_absence(sender, instance, **kwargs):
     """
     When an Absence debit registry is changed, the daily balance for the
     date of that registry must be recalculated, if it exists.
     """
-
-    if instance.debit != 0:
-        balance_line = HoursBalance.objects.filter(date=instance.date,
-                                                   user=instance.user)
-
-        if balance_line:
-            balance_line.first().debit = DateData(instance.user, instance.date).debit().seconds
-            balance_line.first().save()
+    user_id, (begin, end) = instance.user_id, dirty_range(instance)
+    transaction.on_commit(lambda: mark_dirty(user_id, begin, end))
 
 
 def change_balance(date, user, credit, debit):
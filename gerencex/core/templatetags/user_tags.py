@@ -9,10 +9,13 @@ register = template.Library()
 @register.filter('has_group')
 def has_group(user, group_name):
     """
-    Checks if 'user' belongs to 'group_name' group
+    Checks if 'user' belongs to 'group_name' group. The user's groups are read once per request,
+    however many times the filter is used (at each line of a table, for example).
     """
-    groups = user.groups.all().values_list('name', flat=True)
-    return True if group_name in groups else False
+    groups = getattr(user, '_group_names', None)
+    if groups is None:
+        groups = user._group_names = set(user.groups.all().values_list('name', flat=True))
+    return group_name in groups
 
 
 @register.filter('timedelta')
@@ -0,0 +1,135 @@
+import datetime
+import os
+import tempfile
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils import timezone
+from gerencex.core.afd import AfdImport, AfdError
+from gerencex.core.models import Office, Timing, PunchClock, UserDetail
+
+SERIAL = '00004000070012345'
+
+
+def header(serial=SERIAL):
+    return '0000000001' + '1' + '12345678000190' + ' ' * 12 + 'EMPRESA'.ljust(150) + serial + \
+           '01102016' + '31102016' + '01112016' + '1200'
+
+
+def punch(nsr, date_time, pis):
+    return '{:09d}3{:%d%m%Y%H%M}{:012d}'.format(nsr, date_time, pis)
+
+
+class AfdImportTest(TestCase):
+
+    def setUp(self):
+        Office.objects.create(name='Nenhuma lotação', initials='NL')
+        self.user = User.objects.create_user('testuser', 'test@user.com', 'senha123')
+        UserDetail.objects.filter(user=self.user).update(pis='123.45678.90-1')
+        self.day = timezone.localtime(timezone.now()).date() - datetime.timedelta(days=1)
+
+    def at(self, hour, minute=0, days=0):
+        return datetime.datetime.combine(self.day - datetime.timedelta(days=days),
+                                         datetime.time(hour, minute))
+
+    def lines(self, *punches):
+        lines = [header()]
+        lines += [punch(nsr, date_time, 12345678901) for nsr, date_time in punches]
+        lines.append('999999999' + '000000000' + '{:09d}'.format(len(punches)) + '0' * 18 + '9')
+        return lines
+
+    def test_import(self):
+        afd = AfdImport().run(self.lines(
+            (1, self.at(8, days=1)), (2, self.at(12, days=1)),
+            (3, self.at(8)), (4, self.at(12)), (5, self.at(13))))
+
+        self.assertEqual(5, afd.created)
+        tickets = Timing.objects.all()
+        self.assertEqual([True, False, True, False, True], [t.checkin for t in tickets])
+        self.assertEqual(self.at(8, days=1),
+                         timezone.localtime(tickets[0].date_time).replace(tzinfo=None))
+        self.assertEqual(5, PunchClock.objects.get(serial=SERIAL).last_nsr)
+
+        # The open session is refreshed
+        self.assertTrue(UserDetail.objects.get(user=self.user).atwork)
+
+    def test_watermark(self):
+        AfdImport().run(self.lines((1, self.at(8)), (2, self.at(12))))
+        afd = AfdImport().run(self.lines((1, self.at(8)), (2, self.at(12)), (3, self.at(13))))
+        self.assertEqual((1, 2), (afd.created, afd.skipped))
+        self.assertEqual(3, Timing.objects.count())
+        self.assertTrue(Timing.objects.last().checkin)
+
+    def test_recorded_tickets(self):
+        """
+        Punches alternate with the tickets recorded by other means, and are not duplicated
+        """
+        Timing.objects.create(user=self.user,
+                              date_time=timezone.make_aware(self.at(8)),
+                              checkin=True)
+        afd = AfdImport().run(self.lines((1, self.at(8)), (2, self.at(12))))
+        self.assertEqual((1, 1), (afd.created, afd.duplicates))
+        self.assertFalse(Timing.objects.last().checkin)
+
+    def test_batches(self):
+        punches = [(n, self.at(8 + n)) for n in range(1, 6)]
+        afd = AfdImport(batch_size=2).run(self.lines(*punches))
+        self.assertEqual(5, afd.created)
+        self.assertEqual([True, False, True, False, True],
+                         [t.checkin for t in Timing.objects.all()])
+
+    def test_unknown_pis(self):
+        afd = AfdImport().run([header(), punch(1, self.at(8), 99999999999)])
+        self.assertEqual({99999999999}, afd.unknown)
+        self.assertFalse(Timing.objects.exists())
+
+    def test_invalid_file(self):
+        with self.assertRaises(AfdError):
+            AfdImport().run([punch(1, self.at(8), 12345678901)])
+        with self.assertRaises(AfdError):
+            AfdImport().run([header(), '0000000013xxxxxxxxxxxxxxxxxxxxxxxx'])
+
+    def test_queries(self):
+        """
+        The PIS, the clock, the recorded tickets, the insert, the watermark and the savepoints,
+        plus the refresh of the user's open session at the end
+        """
+        punches = [(n, self.at(8 + n)) for n in range(1, 6)]
+        with self.assertNumQueries(14):
+            AfdImport().run(self.lines(*punches))
+
+
+class ImportAfdCommandTest(TestCase):
+
+    def setUp(self):
+        Office.objects.create(name='Nenhuma lotação', initials='NL')
+        user = User.objects.create_user('testuser', 'test@user.com', 'senha123')
+        UserDetail.objects.filter(user=user).update(pis='12345678901')
+        day = timezone.localtime(timezone.now()).date() - datetime.timedelta(days=1)
+        self.date_time = datetime.datetime.combine(day, datetime.time(8))
+
+    def import_file(self, *lines):
+        fd, path = tempfile.mkstemp(suffix='.txt')
+        with os.fdopen(fd, 'w', encoding='latin-1') as file:
+            file.write('\r\n'.join(lines) + '\r\n')
+        out, err = StringIO(), StringIO()
+        try:
+            call_command('import_afd', path, stdout=out, stderr=err)
+        finally:
+            os.remove(path)
+        return out.getvalue(), err.getvalue()
+
+    def test_command(self):
+        out, err = self.import_file(header(),
+                                    punch(1, self.date_time, 12345678901),
+                                    punch(2, self.date_time, 55555555555))
+        self.assertIn('(relógio {}): 1 registros criados'.format(SERIAL), out)
+        self.assertIn('PIS sem usuário: 55555555555', err)
+        self.assertEqual(1, Timing.objects.count())
+
+    def test_without_header(self):
+        with self.assertRaises(CommandError):
+            self.import_file(punch(1, self.date_time, 12345678901))
@@ -0,0 +1,28 @@
+from benchmarks.cases import run_benchmarks
+from benchmarks.generator import generate
+from django.test import TestCase
+from gerencex.core.models import Timing, Absences, HoursBalance
+
+
+class BenchmarksTest(TestCase):
+    """
+    The benchmarks run at a tiny scale. See the benchmarks package, at the project root.
+    """
+
+    def test_generate(self):
+        dataset = generate(offices=2, users=3, days=60)
+        self.assertEqual(6, len(dataset.users))
+        self.assertEqual(59, (dataset.end - dataset.begin).days)
+        self.assertEqual(3, dataset.offices[1].users.count())
+        self.assertTrue(Timing.objects.exists())
+        self.assertTrue(Absences.objects.exists())
+
+    def test_run(self):
+        dataset = generate(offices=1, users=2, days=20)
+        results = run_benchmarks(dataset, repeat=1)
+        names = [result['name'] for result in results]
+        self.assertIn('updates_hours_balance (fill)', names)
+        self.assertIn('signals: ticket', names)
+        self.assertIn('view: hours_bank', names)
+        self.assertTrue(all(result['queries'] > 0 for result in results))
+        self.assertEqual(2 * 20, HoursBalance.objects.count())
@@ -1,7 +1,9 @@
 import datetime
+from io import StringIO
 
 import pytz
 from django.contrib.auth.models import User, Group, Permission
+from django.core.management import call_command
 from django.shortcuts import resolve_url as r
 from django.test import TestCase
 from django.utils import timezone
@@ -98,11 +100,18 @@ class CalculateHoursBankViewTest(TestCase):
                 checkin=ticket['checkin']
             )
 
-        # Now, let's call the calculate_hours_bank view
+        # Now, let's call the calculate_hours_bank view. The recalculation is queued, and the
+        # page shows its progress
         self.resp2 = self.client.post(r('calculate_hours_bank'), follow=True)
         self.assertEqual(200, self.resp2.status_code)
         self.assertRedirects(self.resp2, r('hours_bank'))
         self.assertTemplateUsed(self.resp2, 'hours_bank.html')
+        self.assertContains(self.resp2, 'progress-bar')
+
+        # The worker processes the recalculation
+        call_command('process_recalculations', once=True, stdout=StringIO())
+        self.resp2 = self.client.get(r('hours_bank'))
+        self.assertNotContains(self.resp2, 'progress-bar')
 
         contents = [
             'Ze Mane',
@@ -122,7 +131,9 @@ class CalculateHoursBankViewTest(TestCase):
 
         # Now, let's recalculate the hours:
         self.client.session['begin_date'] = str(self.days[3])
-        self.resp3 = self.client.post(r('calculate_hours_bank'), follow=True)
+        self.client.post(r('calculate_hours_bank'))
+        call_command('process_recalculations', once=True, stdout=StringIO())
+        self.resp3 = self.client.get(r('hours_bank'))
         for expected in contents:
             with self.subTest():
                 self.assertContains(self.resp3, expected)
@@ -0,0 +1,102 @@
+import datetime
+import os
+import tempfile
+from io import StringIO
+
+from django.contrib.auth.models import User, Permission
+from django.core.management import call_command
+from django.shortcuts import resolve_url as r
+from django.test import TestCase
+from gerencex.core.export import linked_offices
+from gerencex.core.models import Office, HoursBalance
+
+
+class ExportTest(TestCase):
+
+    def setUp(self):
+        self.office = Office.objects.create(name='Secretaria', initials='SEC', linked_to=None)
+        self.child = Office.objects.create(name='Diretoria', initials='DIR', linked_to=self.office)
+        self.grandchild = Office.objects.create(name='Serviço', initials='SERV',
+                                                linked_to=self.child)
+        self.other = Office.objects.create(name='Outra', initials='OUT', linked_to=None)
+
+        self.begin = datetime.date(2016, 10, 3)
+        for office, username in ((self.office, 'chefe'), (self.grandchild, 'servidor'),
+                                 (self.other, 'outro')):
+            user = User.objects.create_user(username, first_name=username.title())
+            user.userdetail.office = office
+            user.save()
+            for day in range(3):
+                HoursBalance.objects.create(user=user,
+                                            date=self.begin + datetime.timedelta(days=day),
+                                            credit=3600,
+                                            debit=7200,
+                                            balance=-3600 * (day + 1))
+
+        self.manager = User.objects.create_user('gestor', password='senha123')
+        self.manager.userdetail.office = self.office
+        self.manager.save()
+        self.manager.user_permissions.add(Permission.objects.get(codename='view_hoursbalance'))
+        self.client.login(username='gestor', password='senha123')
+
+    def export(self, **params):
+        resp = self.client.get(r('export_balances'), params)
+        self.assertEqual(200, resp.status_code)
+        return b''.join(resp.streaming_content).decode('utf-8-sig').splitlines()
+
+    def test_linked_offices(self):
+        self.assertEqual({self.office.pk, self.child.pk, self.grandchild.pk},
+                         linked_offices(self.office))
+        self.assertEqual({self.other.pk}, linked_offices(self.other))
+
+    def test_csv(self):
+        lines = self.export(office=self.office.pk, begin='03/10/2016', end='04/10/2016')
+        self.assertEqual(['lotação;usuário;nome;sobrenome;data;crédito;débito;saldo',
+                          'SEC;chefe;Chefe;;03/10/2016;1:00:00;2:00:00;-1:00:00',
+                          'SEC;chefe;Chefe;;04/10/2016;1:00:00;2:00:00;-2:00:00'], lines)
+
+    def test_linked(self):
+        lines = self.export(office=self.office.pk, linked='on', begin='03/10/2016',
+                            end='05/10/2016')
+        self.assertEqual(7, len(lines))
+        self.assertEqual(['SEC', 'SERV'], sorted({line.split(';')[0] for line in lines[1:]}))
+
+    def test_all_offices(self):
+        lines = self.export(begin='03/10/2016', end='05/10/2016')
+        self.assertEqual(['OUT', 'SEC', 'SERV'], [line.split(';')[0] for line in lines[1::3]])
+
+    def test_streaming(self):
+        """
+        The rows are read by a single query, after the response is returned
+        """
+        resp = self.client.get(r('export_balances'), {'begin': '03/10/2016'})
+        with self.assertNumQueries(1):
+            # The byte order mark, the header and the lines
+            self.assertEqual(11, len(list(resp.streaming_content)))
+
+    def test_invalid_period(self):
+        resp = self.client.get(r('export_balances'), {'begin': '05/10/2016', 'end': '03/10/2016'})
+        self.assertEqual(400, resp.status_code)
+
+    def test_permission(self):
+        User.objects.create_user('testuser', password='senha123')
+        self.client.login(username='testuser', password='senha123')
+        resp = self.client.get(r('export_balances'))
+        self.assertEqual(302, resp.status_code)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('export_balances', '2016-10-03', '2016-10-05', office='SEC', linked=True,
+                     stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(7, len(lines))
+        self.assertTrue(lines[0].startswith('lotação;'))
+
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        os.close(fd)
+        try:
+            call_command('export_balances', '2016-10-03', '2016-10-05', output=path)
+            with open(path, encoding='utf-8-sig') as file:
+                self.assertEqual(10, len(file.readlines()))
+        finally:
+            os.remove(path)
@@ -53,6 +53,54 @@ class ForgottenCheckoutsViewTest(TestCase):
 
         self.assertContains(self.resp, expected)
 
+    def test_office_and_period(self):
+        activate_timezone()
+        other_office = Office.objects.create(name='Outra', initials='OU')
+        other = User.objects.create_user('other', 'other@user.com', 'senha123')
+        other.userdetail.office = other_office
+        other.save()
+
+        now = timezone.now()
+        for user in (self.user, other):
+            for days in (100, 3, 2):
+                Timing.objects.create(user=user, date_time=now - datetime.timedelta(days=days),
+                                      checkin=True, created_by=self.user)
+        mine = Timing.objects.filter(user=self.user).order_by('date_time')
+
+        # Only the office check ins of the last days are listed by default
+        resp = self.client.get(r('forgotten_checkouts'))
+        self.assertEqual([mine[1].pk], [reg.pk for reg in resp.context['regs']])
+
+        # The next ticket is found even if it is out of the period
+        begin = timezone.localtime(now - datetime.timedelta(days=101)).date()
+        end = timezone.localtime(now - datetime.timedelta(days=99)).date()
+        resp = self.client.get(r('forgotten_checkouts'), {'begin': begin.strftime('%d/%m/%Y'),
+                                                          'end': end.strftime('%d/%m/%Y')})
+        self.assertEqual([mine[0].pk], [reg.pk for reg in resp.context['regs']])
+
+    def test_open_sessions(self):
+        """Check ins still open since before today are listed apart"""
+        ticket = Timing.objects.create(user=self.user,
+                                       date_time=timezone.now() - datetime.timedelta(days=2),
+                                       checkin=True,
+                                       created_by=self.user)
+        resp = self.client.get(r('forgotten_checkouts'))
+        self.assertEqual([ticket.pk],
+                         [session.open_ticket_id for session in resp.context['open_sessions']])
+        self.assertContains(resp, 'Entradas ainda em aberto')
+
+    def test_pagination(self):
+        now = timezone.now()
+        for minutes in range(60):
+            Timing.objects.create(user=self.user,
+                                  date_time=now - datetime.timedelta(minutes=minutes),
+                                  checkin=True,
+                                  created_by=self.user)
+        with self.assertNumQueries(8):
+            resp = self.client.get(r('forgotten_checkouts'), {'page': 2})
+        self.assertEqual(9, len(resp.context['regs']))
+        self.assertContains(resp, 'Página 2 de 2')
+
 
 def activate_timezone():
     return timezone.activate(pytz.timezone('America/Sao_Paulo'))
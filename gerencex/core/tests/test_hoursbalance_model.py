@@ -1,9 +1,11 @@
 import datetime
+from io import StringIO
 
 import pytz
 from django.utils import timezone
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase
 from gerencex.core.models import HoursBalance, Timing, Office
 from gerencex.core.time_calculations import DateData
 
@@ -48,18 +50,20 @@ class HoursBalanceModelTest(TestCase):
         self.assertEqual(r2.balance, int(datetime.timedelta(hours=-1).total_seconds()))
 
 
-class CreditTriggerTest(TestCase):
+class CreditTriggerTest(TransactionTestCase):
     """
     The user credit is always registered at HourBalance via signal, when a checkout occurs.
-    See the 'credit_calculation' function, at signals.py
+    See the 'credit_calculation' function, at signals.py. The signal marks the date as dirty after
+    the transaction is committed, and the line is recalculated by the 'process_recalculations'
+    command.
     """
-    @classmethod
-    def setUpTestData(cls):
-        Office.objects.create(name='Nenhuma lotação',
+    def setUp(self):
+        Office.objects.create(pk=1,
+                              name='Nenhuma lotação',
                               initials='NL',
                               regular_work_hours=datetime.timedelta(hours=6))
         User.objects.create_user('testuser', 'test@user.com', 'senha123')
-        cls.user = User.objects.get(username='testuser')
+        self.user = User.objects.get(username='testuser')
 
     def test_credit_triggers(self):
 
@@ -91,6 +95,7 @@ class CreditTriggerTest(TestCase):
         # Let's change t2 (checkout record)
         t2.date_time += datetime.timedelta(hours=1)
         t2.save()
+        call_command('process_recalculations', once=True, stdout=StringIO())
 
         # The balance must have been recalculated via django signal (signals.py)
         checkout_tolerance = self.user.userdetail.office.checkout_tolerance
@@ -105,6 +110,7 @@ class CreditTriggerTest(TestCase):
         # Let's change t1 (checkin record)
         t1.date_time += datetime.timedelta(hours=1)
         t1.save()
+        call_command('process_recalculations', once=True, stdout=StringIO())
 
         # The balance must have been recalculated via signal
         modified_reference = datetime.timedelta(hours=1).seconds + tolerance.seconds
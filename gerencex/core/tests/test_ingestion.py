@@ -0,0 +1,221 @@
+import base64
+import datetime
+import ipaddress
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User, Permission
+from django.core.management import call_command
+from django.shortcuts import resolve_url as r
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from gerencex.core.ingestion import ingest
+from gerencex.core.models import Office, Timing, UserDetail, RecalculationJob
+
+
+class IngestionTest(TestCase):
+
+    def setUp(self):
+        Office.objects.create(name='Nenhuma lotação', initials='NL')
+        self.user = User.objects.create_user('testuser', 'test@user.com', 'senha123')
+        self.yesterday = timezone.localtime(timezone.now()).date() - datetime.timedelta(days=1)
+
+    def record(self, hour, checkin, **kwargs):
+        record = {'user': 'testuser',
+                  'date_time': '{}T{:02d}:00:00'.format(self.yesterday.isoformat(), hour),
+                  'checkin': checkin}
+        record.update(kwargs)
+        return record
+
+    def test_ingest(self):
+        result = ingest([self.record(8, True, client_ip='10.0.0.1'),
+                         self.record(12, 'false')])
+        self.assertEqual((2, 0, []), result)
+        first, last = Timing.objects.all()
+        self.assertEqual(datetime.time(8), timezone.localtime(first.date_time).time())
+        self.assertEqual('10.0.0.1', first.client_ip)
+        self.assertFalse(last.checkin)
+
+        # The open session is refreshed, although bulk inserts send no signals
+        detail = UserDetail.objects.get(user=self.user)
+        self.assertEqual(last.date_time, detail.last_ticket_at)
+        self.assertFalse(detail.atwork)
+
+    def test_duplicates(self):
+        ingest([self.record(8, True)])
+        result = ingest([self.record(8, True), self.record(12, False), self.record(12, False)])
+        self.assertEqual((1, 2, []), result)
+        self.assertEqual(2, Timing.objects.count())
+
+    def test_errors(self):
+        tomorrow = self.yesterday + datetime.timedelta(days=2)
+        result = ingest([self.record(8, True, user='nobody'),
+                         self.record(8, 'talvez'),
+                         self.record(8, True, date_time='ontem'),
+                         self.record(8, True, date_time='{}T08:00:00'.format(tomorrow)),
+                         self.record(8, True, client_ip='10.0.0.300'),
+                         {'user': 'testuser'},
+                         'not a record',
+                         self.record(8, True)])
+        self.assertEqual(1, result.created)
+        self.assertEqual([0, 1, 2, 3, 4, 5, 6], [idx for idx, _ in result.errors])
+
+    def test_invalid_types(self):
+        """
+        Values of the wrong JSON type are reported as errors of their records
+        """
+        result = ingest([self.record(8, True, user=['testuser']),
+                         self.record(8, True, user=1),
+                         self.record(8, True, client_ip=10),
+                         self.record(8, True, client_ip=['10.0.0.1']),
+                         self.record(8, True, client_ip='10.0.0.1' * 6),
+                         self.record(8, True)])
+        self.assertEqual(1, result.created)
+        self.assertEqual([0, 1, 2, 3, 4], [idx for idx, _ in result.errors])
+
+    def test_daylight_saving_time_transitions(self):
+        """
+        Local times which are repeated or skipped by the clocks are stored, instead of raising
+        """
+        result = ingest([self.record(8, True, date_time='2018-02-17T23:30:00'),
+                         self.record(8, False, date_time='2018-11-04T00:30:00')])
+        self.assertEqual((2, 0, []), result)
+        first, last = Timing.objects.all()
+        self.assertEqual(datetime.datetime(2018, 2, 18, 2, 30, tzinfo=timezone.utc),
+                         first.date_time)
+        self.assertEqual(datetime.datetime(2018, 11, 4, 3, 30, tzinfo=timezone.utc),
+                         last.date_time)
+
+    def test_ipv6(self):
+        long_form = '2001:0db8:0000:0000:0000:ff00:0042:8329'
+        ingest([self.record(8, True, client_ip=long_form),
+                self.record(12, False, client_ip='::ffff:192.168.100.200')])
+        first, last = Timing.objects.all()
+        self.assertEqual('2001:db8::ff00:42:8329', first.client_ip)
+        self.assertEqual(str(ipaddress.ip_address('::ffff:192.168.100.200')), last.client_ip)
+
+    def test_queries(self):
+        """
+        The users, the existent tickets, the bulk insert and the refresh of each user's session,
+        plus the savepoint and its release
+        """
+        records = [self.record(hour, hour % 2 == 0) for hour in range(8, 18)]
+        with self.assertNumQueries(7):
+            ingest(records)
+
+
+class IngestionDirtyRangeTest(TransactionTestCase):
+
+    def setUp(self):
+        # Offices are linked to the office 1 by default
+        Office.objects.create(pk=1, name='nenhuma lotação', initials='NL')
+        self.today = timezone.localtime(timezone.now()).date()
+        office = Office.objects.create(name='Terceira Diacomp',
+                                       initials='DIACOMP3',
+                                       hours_control_start_date=self.today.replace(day=1) -
+                                       datetime.timedelta(days=60))
+        user = User.objects.create_user('testuser', 'test@user.com', 'senha123')
+        user.userdetail.office = office
+        user.save()
+
+    def test_marks_the_dates_once(self):
+        days = [self.today - datetime.timedelta(days=n) for n in (5, 3)]
+        ingest([{'user': 'testuser', 'date_time': '{}T08:00:00'.format(day), 'checkin': True}
+                for day in days])
+        job = RecalculationJob.objects.get()
+        self.assertEqual((days[0], days[1]), (job.begin_date, job.end_date))
+
+
+class ApiTimingBatchTest(TestCase):
+    """
+    See 'api_timing_batch', at views.py
+    """
+    def setUp(self):
+        Office.objects.create(name='Nenhuma lotação', initials='NL')
+        User.objects.create_user('testuser', 'test@user.com', 'senha123')
+        kiosk = User.objects.create_user('kiosk', 'kiosk@user.com', 'senha123')
+        kiosk.user_permissions.add(Permission.objects.get(codename='add_timing'))
+        self.date_time = (timezone.localtime(timezone.now()) -
+                          datetime.timedelta(days=1)).replace(tzinfo=None, microsecond=0)
+
+    def post(self, data, username='kiosk'):
+        credentials = base64.b64encode('{}:senha123'.format(username).encode()).decode()
+        return self.client.post(r('api_timing_batch'),
+                                json.dumps(data),
+                                content_type='application/json',
+                                HTTP_AUTHORIZATION='Basic {}'.format(credentials))
+
+    def test_batch(self):
+        resp = self.post({'tickets': [
+            {'user': 'testuser', 'date_time': self.date_time.isoformat(), 'checkin': True},
+            {'user': 'nobody', 'date_time': self.date_time.isoformat(), 'checkin': True},
+        ]})
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual(1, resp.json()['created'])
+        self.assertEqual(1, resp.json()['errors'][0]['index'])
+        self.assertEqual('kiosk', Timing.objects.get().created_by.username)
+
+    def test_invalid_types(self):
+        resp = self.post({'tickets': [
+            {'user': ['testuser'], 'date_time': self.date_time.isoformat(), 'checkin': True},
+            {'user': 'testuser', 'date_time': self.date_time.isoformat(), 'checkin': True,
+             'client_ip': {'ip': '10.0.0.1'}},
+        ]})
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual(0, resp.json()['created'])
+        self.assertEqual([0, 1], [error['index'] for error in resp.json()['errors']])
+
+    def test_authentication(self):
+        resp = self.client.post(r('api_timing_batch'), '{}', content_type='application/json')
+        self.assertEqual(401, resp.status_code)
+
+    def test_permission(self):
+        resp = self.post({'tickets': []}, username='testuser')
+        self.assertEqual(403, resp.status_code)
+
+    def test_invalid_json(self):
+        self.assertEqual(400, self.post({'records': []}).status_code)
+
+    @mock.patch('gerencex.core.views.MAX_BATCH_SIZE', 1)
+    def test_too_large(self):
+        self.assertEqual(413, self.post({'tickets': [{}, {}]}).status_code)
+
+
+class IngestTicketsCommandTest(TestCase):
+
+    def setUp(self):
+        Office.objects.create(name='Nenhuma lotação', initials='NL')
+        User.objects.create_user('testuser', 'test@user.com', 'senha123')
+        self.day = timezone.localtime(timezone.now()).date() - datetime.timedelta(days=1)
+
+    def ingest_file(self, content, suffix, **options):
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            file.write(content)
+        out, err = StringIO(), StringIO()
+        try:
+            call_command('ingest_tickets', path, stdout=out, stderr=err, **options)
+        finally:
+            os.remove(path)
+        return out.getvalue(), err.getvalue()
+
+    def test_csv(self):
+        content = 'user,date_time,checkin,client_ip\n' \
+                  'testuser,{0}T08:00:00,E,10.0.0.1\n' \
+                  'testuser,{0}T12:00:00,S,\n' \
+                  'testuser,{0}T12:00:00,S,\n' \
+                  'nobody,{0}T12:00:00,S,\n'.format(self.day)
+        out, err = self.ingest_file(content, '.csv', chunk_size=2)
+        self.assertIn('2 registros criados, 1 duplicados, 1 inválidos', out)
+        self.assertIn('Registro 4', err)
+        self.assertEqual(2, Timing.objects.count())
+
+    def test_jsonl(self):
+        content = '{{"user": "testuser", "date_time": "{}T08:00:00", "checkin": true}}\n'.format(
+            self.day)
+        out, _ = self.ingest_file(content, '.jsonl', created_by='testuser')
+        self.assertIn('1 registros criados', out)
+        self.assertEqual('testuser', Timing.objects.get().created_by.username)
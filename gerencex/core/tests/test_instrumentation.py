@@ -0,0 +1,151 @@
+import datetime
+import json
+import os
+import pstats
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.shortcuts import resolve_url as r
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from gerencex.core.instrumentation import timed, current_metrics
+from gerencex.core.models import Office
+from gerencex.core.time_calculations import DateData
+
+
+@override_settings(SERVER_TIMING=True)
+class ServerTimingTest(TestCase):
+
+    def setUp(self):
+        self.yesterday = timezone.localtime(timezone.now()).date() - datetime.timedelta(days=1)
+        office = Office.objects.create(name='Terceira Diacomp',
+                                       initials='DIACOMP3',
+                                       hours_control_start_date=self.yesterday)
+        self.user = User.objects.create_user('testuser', 'test@user.com', 'senha123')
+        self.user.userdetail.office = office
+        self.user.save()
+        self.client.force_login(self.user)
+
+    def get(self, url):
+        with self.assertLogs('gerencex.performance', 'INFO') as logs:
+            response = self.client.get(url)
+        self.assertEqual(1, len(logs.output))
+        return response, json.loads(logs.records[0].getMessage())
+
+    def test_header(self):
+        response, line = self.get(r('hours_bank'))
+        header = response['Server-Timing']
+        self.assertIn('total;dur=', header)
+        self.assertIn('db;dur=', header)
+        self.assertIn('desc="{} queries"'.format(line['queries']), header)
+        self.assertIn('render;dur=', header)
+
+    def test_log_line(self):
+        response, line = self.get(r('hours_bank'))
+        self.assertEqual('GET', line['method'])
+        self.assertEqual('hours_bank', line['view'])
+        self.assertEqual(200, line['status'])
+        self.assertGreater(line['queries'], 0)
+        self.assertGreater(line['render'], 0)
+        self.assertGreaterEqual(line['total'], line['render'])
+
+    def test_calculations(self):
+        """
+        The DateData calculations of the page are timed
+        """
+        def slow_credit(date_data):
+            time.sleep(0.01)
+            return datetime.timedelta(0)
+
+        y = self.yesterday
+        with mock.patch.object(DateData, 'regular_credit', slow_credit):
+            response, line = self.get(r('calculations', 'testuser', y.year, y.month, y.day))
+        self.assertGreaterEqual(line['calc'], 10)
+
+    def test_signals(self):
+        with self.assertLogs('gerencex.performance', 'INFO') as logs:
+            self.client.post(r('timing_new'))
+        self.assertGreater(json.loads(logs.records[0].getMessage())['signals'], 0)
+
+
+class DisabledServerTimingTest(TestCase):
+
+    def test_disabled(self):
+        """
+        By default, nothing is measured
+        """
+        user = User.objects.create_user('testuser', 'test@user.com', 'senha123')
+        self.client.force_login(user)
+        response = self.client.get(r('home'))
+        self.assertNotIn('Server-Timing', response)
+
+    def test_outside_request(self):
+        with timed('calc'):
+            self.assertIsNone(current_metrics())
+
+    def test_decorator_outside_request(self):
+        @timed('calc')
+        def double(value):
+            return 2 * value
+
+        self.assertEqual(4, double(2))
+        self.assertEqual('double', double.__name__)
+
+
+class ProfilerTest(TestCase):
+
+    def setUp(self):
+        self.yesterday = timezone.localtime(timezone.now()).date() - datetime.timedelta(days=1)
+        office = Office.objects.create(name='Terceira Diacomp',
+                                       initials='DIACOMP3',
+                                       hours_control_start_date=self.yesterday)
+        self.user = User.objects.create_user('testuser', 'test@user.com', 'senha123',
+                                             is_staff=True)
+        self.user.userdetail.office = office
+        self.user.save()
+        self.client.force_login(self.user)
+        self.profile_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.profile_dir)
+
+    def calculations(self, **kwargs):
+        y = self.yesterday
+        return self.client.get(r('calculations', 'testuser', y.year, y.month, y.day), **kwargs)
+
+    def test_overlay(self):
+        """
+        The hotspots are shown over the page, including the DateData methods
+        """
+        response = self.calculations(data={'profile': ''})
+        self.assertContains(response, '<pre id="profile"')
+        self.assertContains(response, 'cumulative')
+        self.assertContains(response, 'time_calculations.py')
+        self.assertContains(response, 'Memória de cálculo')
+        self.assertTrue(response.content.decode().rstrip().endswith('</html>'))
+
+    def test_header(self):
+        response = self.calculations(HTTP_X_PROFILE='html')
+        self.assertContains(response, '<pre id="profile"')
+
+    def test_file(self):
+        with self.settings(PROFILE_DIR=self.profile_dir):
+            response = self.calculations(data={'profile': 'file'})
+        self.assertNotContains(response, '<pre id="profile"')
+        path = response['X-Profile-File']
+        self.assertEqual([os.path.basename(path)], os.listdir(self.profile_dir))
+        self.assertTrue(pstats.Stats(path).total_calls)
+
+    def test_not_staff(self):
+        self.user.is_staff = False
+        self.user.save()
+        response = self.calculations(data={'profile': ''})
+        self.assertNotContains(response, '<pre id="profile"')
+
+    def test_not_requested(self):
+        with mock.patch('gerencex.core.instrumentation.cProfile.Profile') as profile:
+            self.calculations()
+        self.assertFalse(profile.called)
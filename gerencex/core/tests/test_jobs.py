@@ -0,0 +1,235 @@
+import datetime
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.shortcuts import resolve_url as r
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from gerencex.core.jobs import enqueue_recalculation, active_job, claim_next_job, STALE_AFTER, \
+    mark_dirty, offices_to_close, close_balances
+from gerencex.core.ledger import write_lines
+from gerencex.core.models import Office, RecalculationJob, HoursBalance, Timing, Restday
+from gerencex.core.restday_calendar import CalendarCache, get_restday_calendar
+
+
+class RecalculationJobTest(TestCase):
+
+    def setUp(self):
+        self.today = timezone.localtime(timezone.now()).date()
+        self.begin = self.today - datetime.timedelta(days=10)
+        self.office = Office.objects.create(name='Terceira Diacomp',
+                                            initials='DIACOMP3',
+                                            hours_control_start_date=self.begin)
+        for n in range(2):
+            user = User.objects.create_user('testuser{}'.format(n), 'test@user.com', 'senha123')
+            user.userdetail.office = self.office
+            user.save()
+
+    def test_duplicates_are_merged(self):
+        job1 = enqueue_recalculation(self.office, self.begin + datetime.timedelta(days=5))
+        job2 = enqueue_recalculation(self.office, self.begin)
+        job3 = enqueue_recalculation(self.office, self.begin + datetime.timedelta(days=2))
+        self.assertEqual(1, RecalculationJob.objects.count())
+        self.assertEqual(job1.pk, job2.pk)
+        self.assertEqual(job1.pk, job3.pk)
+        self.assertEqual(self.begin, RecalculationJob.objects.get().begin_date)
+
+    def test_process(self):
+        enqueue_recalculation(self.office, self.begin)
+        self.assertIsNotNone(active_job(self.office))
+
+        call_command('process_recalculations', once=True, stdout=StringIO())
+
+        job = RecalculationJob.objects.get()
+        self.assertEqual(RecalculationJob.DONE, job.status)
+        self.assertEqual(100, job.progress())
+        self.assertIsNone(active_job(self.office))
+        self.assertEqual(20, HoursBalance.objects.count())
+
+    def test_a_running_job_is_not_claimed_twice(self):
+        enqueue_recalculation(self.office, self.begin)
+        self.assertIsNotNone(claim_next_job())
+        self.assertIsNone(claim_next_job())
+
+    def test_stale_job_is_resumed(self):
+        enqueue_recalculation(self.office, self.begin)
+        claim_next_job()
+        RecalculationJob.objects.update(updated=timezone.now() - STALE_AFTER * 2)
+        self.assertIsNone(active_job(self.office))
+        self.assertIsNotNone(claim_next_job())
+
+    def test_dirty_ranges_are_merged(self):
+        user = User.objects.get(username='testuser0')
+        mark_dirty(user.pk, self.begin + datetime.timedelta(days=3),
+                   self.begin + datetime.timedelta(days=4))
+        mark_dirty(user.pk, self.begin + datetime.timedelta(days=1),
+                   self.begin + datetime.timedelta(days=2))
+        mark_dirty(user.pk, self.today, self.today)
+        job = RecalculationJob.objects.get()
+        self.assertEqual(user.pk, job.user_id)
+        self.assertEqual(self.begin + datetime.timedelta(days=1), job.begin_date)
+        self.assertEqual(self.begin + datetime.timedelta(days=4), job.end_date)
+        # Jobs of a single worker do not block the office's hours bank
+        self.assertIsNone(active_job(self.office))
+
+    def test_office_job_covers_dirty_ranges(self):
+        enqueue_recalculation(self.office, self.begin)
+        user = User.objects.get(username='testuser0')
+        mark_dirty(user.pk, self.begin + datetime.timedelta(days=1),
+                   self.begin + datetime.timedelta(days=2))
+        self.assertEqual(1, RecalculationJob.objects.count())
+
+
+class DirtyRangeTest(TransactionTestCase):
+    """
+    Changes in tickets and restdays only mark dates as dirty. See signals.py
+    """
+    def setUp(self):
+        # Offices are linked to the office 1 by default
+        Office.objects.create(pk=1, name='nenhuma lotação', initials='NL')
+        self.today = timezone.localtime(timezone.now()).date()
+        self.begin = self.today - datetime.timedelta(days=10)
+        self.office = Office.objects.create(name='Terceira Diacomp',
+                                            initials='DIACOMP3',
+                                            hours_control_start_date=self.begin)
+        self.user = User.objects.create_user('testuser', 'test@user.com', 'senha123')
+        self.user.userdetail.office = self.office
+        self.user.save()
+        enqueue_recalculation(self.office, self.begin)
+        call_command('process_recalculations', once=True, stdout=StringIO())
+
+    def test_burst_of_tickets_is_recalculated_once(self):
+        for day in (2, 3, 4):
+            for hour in range(8, 18):
+                Timing.objects.create(
+                    user=self.user,
+                    date_time=timezone.make_aware(datetime.datetime.combine(
+                        self.begin + datetime.timedelta(days=day), datetime.time(hour))),
+                    checkin=hour % 2 == 0
+                )
+        job = RecalculationJob.objects.get(status=RecalculationJob.PENDING)
+        self.assertEqual(self.user.pk, job.user_id)
+        self.assertEqual(self.begin + datetime.timedelta(days=2), job.begin_date)
+        self.assertEqual(self.begin + datetime.timedelta(days=4), job.end_date)
+
+        call_command('process_recalculations', once=True, stdout=StringIO())
+        jobs = RecalculationJob.objects.filter(status=RecalculationJob.DONE)
+        self.assertEqual(2, jobs.count())
+        line = HoursBalance.objects.get(date=self.begin + datetime.timedelta(days=3))
+        self.assertGreater(line.credit, 0)
+        last = HoursBalance.objects.filter(user=self.user).last()
+        self.assertEqual(sum(x.credit - x.debit for x in HoursBalance.objects.all()), last.balance)
+
+    def test_restday_marks_the_offices(self):
+        date_ = self.begin + datetime.timedelta(days=1)
+        Restday.objects.create(date=date_, note='Feriado')
+        job = RecalculationJob.objects.get(status=RecalculationJob.PENDING)
+        self.assertIsNone(job.user_id)
+        self.assertEqual((date_, date_), (job.begin_date, job.end_date))
+
+        call_command('process_recalculations', once=True, stdout=StringIO())
+        self.assertEqual(0, HoursBalance.objects.get(date=date_).debit)
+
+    def test_restday_saved_by_another_process(self):
+        """
+        The worker's calendar was checked just now, but a job is run on the calendar of the
+        moment it is claimed
+        """
+        weekday = next(self.begin + datetime.timedelta(days=n) for n in range(1, 8)
+                       if (self.begin + datetime.timedelta(days=n)).weekday() < 5)
+        get_restday_calendar()
+        web_process = CalendarCache()
+        with mock.patch('gerencex.core.restday_calendar.calendar_cache', web_process):
+            Restday.objects.create(date=weekday, note='Feriado')
+        self.assertNotIn(weekday, get_restday_calendar())
+
+        call_command('process_recalculations', once=True, stdout=StringIO())
+        self.assertEqual(0, HoursBalance.objects.get(date=weekday).debit)
+        self.assertIn(weekday, get_restday_calendar())
+
+
+class CloseBalancesTest(TestCase):
+    """
+    See close_balances, at jobs.py
+    """
+    def setUp(self):
+        self.today = timezone.localtime(timezone.now()).date()
+        self.begin = self.today - datetime.timedelta(days=10)
+        self.offices = []
+        for initials in ('DIACOMP1', 'DIACOMP2'):
+            office = Office.objects.create(name=initials,
+                                           initials=initials,
+                                           hours_control_start_date=self.begin)
+            self.offices.append(office)
+            user = User.objects.create_user(initials.lower())
+            user.userdetail.office = office
+            user.save()
+        Office.objects.create(name='Inativa', initials='INATIVA', active=False,
+                              hours_control_start_date=self.begin)
+
+    def test_close(self):
+        out = StringIO()
+        call_command('close_balances', workers=1, stdout=out)
+        self.assertIn('2 lotações fechadas', out.getvalue())
+        self.assertEqual(20, HoursBalance.objects.count())
+        self.assertEqual(self.today - datetime.timedelta(days=1),
+                         HoursBalance.objects.last().date)
+        for office in Office.objects.filter(active=True):
+            self.assertEqual(self.today, office.last_balance_date)
+
+        # The offices already closed today are skipped
+        self.assertEqual([], offices_to_close()[0])
+
+    def test_resume(self):
+        """
+        An interrupted close fills only the missing lines
+        """
+        user = User.objects.get(username='diacomp1')
+        write_lines(user.pk, [(self.begin + datetime.timedelta(days=n), 3600, 0)
+                              for n in range(4)])
+        call_command('close_balances', workers=1, stdout=StringIO())
+        self.assertEqual(20, HoursBalance.objects.count())
+        self.assertEqual(3600, HoursBalance.objects.get(user=user, date=self.begin).credit)
+
+    def test_busy_office_is_skipped(self):
+        enqueue_recalculation(self.offices[0], self.begin)
+        offices, busy = offices_to_close()
+        self.assertEqual([self.offices[1]], offices)
+        self.assertEqual([self.offices[0]], busy)
+
+    def test_hours_bank_only_reads_closed_offices(self):
+        call_command('close_balances', workers=1, stdout=StringIO())
+        self.client.force_login(User.objects.get(username='diacomp1'))
+        with mock.patch('gerencex.core.views.updates_hours_balance') as updates:
+            self.client.get(r('hours_bank'))
+        self.assertFalse(updates.called)
+
+
+class CloseBalancesProcessPoolTest(TransactionTestCase):
+    """
+    The offices are closed by worker processes, which read the committed offices. The in-memory
+    database of the tests is copied to each forked worker, so only the results are checked.
+    """
+    def setUp(self):
+        Office.objects.create(pk=1, name='Nenhuma lotação', initials='NL')
+        begin = timezone.localtime(timezone.now()).date() - datetime.timedelta(days=10)
+        self.offices = []
+        for initials in ('DIACOMP1', 'DIACOMP2'):
+            office = Office.objects.create(name=initials,
+                                           initials=initials,
+                                           hours_control_start_date=begin)
+            self.offices.append(office)
+            user = User.objects.create_user(initials.lower())
+            user.userdetail.office = office
+            user.save()
+
+    def test_workers(self):
+        results = dict(close_balances(self.offices, workers=2))
+        self.assertEqual({office.pk: None for office in self.offices}, results)
+
+    def test_failures_are_returned(self):
+        results = dict(close_balances(self.offices + [Office(pk=999)], workers=2))
+        self.assertIsNone(results[self.offices[0].pk])
+        self.assertIn('DoesNotExist', results[999])
@@ -0,0 +1,207 @@
+import datetime
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+from gerencex.core.functions import updates_hours_balance
+from gerencex.core.ledger import recompute_balances, write_lines
+from gerencex.core.models import HoursBalance, Office
+from gerencex.core.time_calculations import DateData
+
+
+class RecomputeBalancesTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('testuser', 'test@user.com', 'senha123')
+        cls.first_date = datetime.date(2016, 1, 1)
+        cls.days = 400
+
+        # bulk_create skips the signals, so all the balances are left wrong
+        HoursBalance.objects.bulk_create(
+            HoursBalance(date=cls.first_date + datetime.timedelta(days=n),
+                         user=cls.user,
+                         credit=8 * 3600,
+                         debit=7 * 3600,
+                         balance=0)
+            for n in range(cls.days)
+        )
+
+    def assertBalancesAreConsistent(self):
+        balance = 0
+        for line in HoursBalance.objects.filter(user=self.user).order_by('date'):
+            balance += line.credit - line.debit
+            self.assertEqual(balance, line.balance)
+
+    def test_recompute(self):
+        # Savepoint, previous balance, lines, two UPDATE statements, the user's last balance and
+        # savepoint release
+        with self.assertNumQueries(7):
+            changed = recompute_balances(self.user.pk, self.first_date)
+        self.assertEqual(self.days, changed)
+        self.assertBalancesAreConsistent()
+        last = HoursBalance.objects.filter(user=self.user).last()
+        self.user.userdetail.refresh_from_db()
+        self.assertEqual((last.date, last.balance),
+                         (self.user.userdetail.balance_date, self.user.userdetail.balance))
+
+    def test_recompute_from_a_date(self):
+        recompute_balances(self.user.pk, self.first_date)
+        HoursBalance.objects.filter(user=self.user, date__gte=datetime.date(2016, 6, 1)).update(
+            debit=8 * 3600)
+        recompute_balances(self.user.pk, datetime.date(2016, 6, 1))
+        self.assertBalancesAreConsistent()
+
+    def test_saving_an_old_line_updates_the_following_ones(self):
+        """
+        Changing the first line of a long history must not recurse through signals
+        """
+        recompute_balances(self.user.pk, self.first_date)
+        line = HoursBalance.objects.get(user=self.user, date=self.first_date)
+        line.credit = 0
+        line.save()
+        self.assertBalancesAreConsistent()
+        last = HoursBalance.objects.filter(user=self.user).last()
+        self.assertEqual((self.days - 8) * 3600, last.balance)
+
+
+class SaveLineTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('testuser', 'test@user.com', 'senha123')
+        cls.first_date = datetime.date(2016, 1, 1)
+        cls.days = 300
+        HoursBalance.objects.bulk_create(
+            HoursBalance(date=cls.first_date + datetime.timedelta(days=n),
+                         user=cls.user,
+                         credit=8 * 3600,
+                         debit=7 * 3600,
+                         balance=(n + 1) * 3600)
+            for n in range(cls.days)
+        )
+
+    def assertBalancesAreConsistent(self):
+        balance = 0
+        for line in HoursBalance.objects.filter(user=self.user).order_by('date'):
+            balance += line.credit - line.debit
+            self.assertEqual(balance, line.balance)
+
+    def test_change_line(self):
+        """
+        The following lines are shifted by the change, in a single statement
+        """
+        line = HoursBalance.objects.get(user=self.user, date=datetime.date(2016, 1, 10))
+        line.credit = 10 * 3600
+
+        # Previous line, stored line, line update, following lines update and the user's last
+        # balance (read and update)
+        with self.assertNumQueries(6):
+            line.save()
+
+        self.assertEqual(12 * 3600, line.balance)
+        self.assertEqual((self.days + 2) * 3600,
+                         HoursBalance.objects.filter(user=self.user).last().balance)
+        self.assertBalancesAreConsistent()
+
+    def test_delete_and_create_line(self):
+        HoursBalance.objects.filter(user=self.user, date=datetime.date(2016, 1, 10)).delete()
+        self.assertBalancesAreConsistent()
+        HoursBalance.objects.create(user=self.user, date=datetime.date(2016, 1, 10),
+                                    credit=10 * 3600, debit=7 * 3600)
+        self.assertBalancesAreConsistent()
+
+    def test_move_line(self):
+        line = HoursBalance.objects.get(user=self.user, date=datetime.date(2016, 1, 10))
+        line.date = self.first_date + datetime.timedelta(days=self.days)
+        line.save()
+        self.assertBalancesAreConsistent()
+        self.assertEqual(self.days * 3600,
+                         HoursBalance.objects.filter(user=self.user).last().balance)
+
+
+class WriteLinesTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('testuser', 'test@user.com', 'senha123')
+        cls.first_date = datetime.date(2016, 1, 1)
+
+    def cells(self, first, n, credit):
+        return [(first + datetime.timedelta(days=d), credit, 7 * 3600) for d in range(n)]
+
+    def assertBalancesAreConsistent(self):
+        balance = 0
+        for line in HoursBalance.objects.filter(user=self.user).order_by('date'):
+            balance += line.credit - line.debit
+            self.assertEqual(balance, line.balance)
+
+    def test_create(self):
+        created = write_lines(self.user.pk, self.cells(self.first_date, 200, 8 * 3600))
+        self.assertEqual(200, created)
+        self.assertEqual(200 * 3600, HoursBalance.objects.filter(user=self.user).last().balance)
+        self.assertBalancesAreConsistent()
+
+    def test_update_in_the_middle(self):
+        write_lines(self.user.pk, self.cells(self.first_date, 200, 8 * 3600))
+        created = write_lines(self.user.pk,
+                              self.cells(datetime.date(2016, 3, 1), 10, 6 * 3600))
+        self.assertEqual(0, created)
+        self.assertEqual(180 * 3600, HoursBalance.objects.filter(user=self.user).last().balance)
+        self.assertBalancesAreConsistent()
+
+    def test_update_a_single_day(self):
+        """
+        The following lines are shifted in a single statement, not recomputed one by one
+        """
+        write_lines(self.user.pk, self.cells(self.first_date, 400, 8 * 3600))
+        # Savepoint, previous line, existent line, line update, following lines update, the
+        # user's last balance (read and update) and savepoint release
+        with self.assertNumQueries(8):
+            write_lines(self.user.pk, self.cells(datetime.date(2016, 3, 1), 1, 6 * 3600))
+        self.assertEqual(398 * 3600, HoursBalance.objects.filter(user=self.user).last().balance)
+        self.assertBalancesAreConsistent()
+
+
+class UpdatesHoursBalanceTest(TestCase):
+
+    def setUp(self):
+        today = timezone.localtime(timezone.now()).date()
+        self.begin = today - datetime.timedelta(days=20)
+        self.office = Office.objects.create(name='Terceira Diacomp',
+                                            initials='DIACOMP3',
+                                            hours_control_start_date=self.begin)
+        self.users = []
+        for n in range(3):
+            user = User.objects.create_user('testuser{}'.format(n), 'test@user.com', 'senha123')
+            user.userdetail.office = self.office
+            user.userdetail.opening_hours_balance = 3600 * n
+            user.save()
+            self.users.append(user)
+
+    def assertLinesAreRight(self):
+        for user in self.users:
+            balance = 0
+            lines = HoursBalance.objects.filter(user=user).order_by('date')
+            self.assertEqual(20, len(lines))
+            for line in lines:
+                date_data = DateData(user, line.date)
+                balance += line.credit - line.debit
+                self.assertEqual(date_data.credit().total_seconds(), line.credit)
+                self.assertEqual(date_data.debit().total_seconds(), line.debit)
+                self.assertEqual(balance, line.balance)
+
+    def test_fills_the_blanks(self):
+        date_data = DateData(self.users[0], self.begin)
+        HoursBalance.objects.create(date=self.begin,
+                                    user=self.users[0],
+                                    credit=date_data.credit().total_seconds(),
+                                    debit=date_data.debit().total_seconds())
+        updates_hours_balance(self.office, None)
+        self.assertLinesAreRight()
+
+    def test_recalculates_from_a_date(self):
+        updates_hours_balance(self.office, None)
+        HoursBalance.objects.filter(user=self.users[1]).update(credit=0, debit=0)
+        updates_hours_balance(self.office, self.begin)
+        self.assertLinesAreRight()
@@ -0,0 +1,175 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import uuid
+
+from django.contrib.auth.models import User
+from django.shortcuts import resolve_url as r
+from django.conf import settings
+from django.test import TestCase, SimpleTestCase, override_settings
+from gerencex.core.metrics import Registry, Counter, Histogram, registry, MERGED_FILE
+
+
+class MetricsTest(TestCase):
+
+    def setUp(self):
+        self.metrics_dir = tempfile.mkdtemp()
+        self.override = override_settings(METRICS_DIR=self.metrics_dir)
+        self.override.enable()
+        self.registry = Registry()
+        self.counter = Counter('test_total', 'Test counter', self.registry)
+        self.histogram = Histogram('test_seconds', 'Test histogram', self.registry,
+                                   buckets=(0.1, 1))
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.metrics_dir)
+
+    def write(self, pid, entries):
+        """
+        Writes the file of another process
+        """
+        path = os.path.join(self.metrics_dir, '{}_{}.json'.format(pid, uuid.uuid4().hex))
+        with open(path, 'w') as file:
+            json.dump(entries, file)
+
+    def test_exposition(self):
+        self.counter.inc()
+        self.counter.inc(2, kind='checkout')
+        for amount in (0.05, 0.5, 5):
+            self.histogram.observe(amount)
+        self.assertEqual('\n'.join([
+            '# HELP test_total Test counter',
+            '# TYPE test_total counter',
+            'test_total 1',
+            'test_total{kind="checkout"} 2',
+            '# HELP test_seconds Test histogram',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{le="0.1"} 1',
+            'test_seconds_bucket{le="1"} 2',
+            'test_seconds_bucket{le="+Inf"} 3',
+            'test_seconds_sum 5.55',
+            'test_seconds_count 3',
+        ]) + '\n', self.registry.exposition())
+
+    def test_processes_are_summed(self):
+        """
+        Each process writes its values to its own file
+        """
+        self.counter.inc(3)
+        self.histogram.observe(0.5)
+        self.write(os.getppid(), [['test_total', [], 4], ['test_seconds', [], [0, 0, 2, 10, 2]]])
+        exposition = self.registry.exposition()
+        self.assertIn('test_total 7\n', exposition)
+        self.assertIn('test_seconds_bucket{le="+Inf"} 3\n', exposition)
+        self.assertIn('test_seconds_count 3\n', exposition)
+        self.assertEqual(2, len([name for name in os.listdir(self.metrics_dir)
+                                 if name.endswith('.json')]))
+
+    def test_reused_pid(self):
+        """
+        A process reusing the pid of a dead one writes its own file
+        """
+        self.write(os.getpid(), [['test_total', [], 4]])
+        self.counter.inc(3)
+        self.assertIn('test_total 7\n', self.registry.exposition())
+
+    def test_dead_processes_are_merged(self):
+        """
+        The files of the dead processes are added to a single file, so their values are kept
+        """
+        dead = subprocess.Popen([sys.executable, '-c', '']).pid
+        os.waitpid(dead, 0)
+        self.write(dead, [['test_total', [], 4], ['test_seconds', [], [0, 0, 2, 10, 2]]])
+        self.write(dead, [['test_total', [], 1]])
+        self.counter.inc(3)
+
+        exposition = self.registry.exposition()
+        self.assertIn('test_total 8\n', exposition)
+        self.assertIn('test_seconds_count 2\n', exposition)
+        self.assertEqual({MERGED_FILE, os.path.basename(self.registry.path())},
+                         {name for name in os.listdir(self.metrics_dir)
+                          if name.endswith('.json')})
+        self.assertEqual(exposition, self.registry.exposition())
+
+    def test_forked_process(self):
+        """
+        A forked process starts from zero, instead of reporting its parent's values again
+        """
+        self.counter.inc(3)
+        self.registry.pid = -1
+        self.counter.inc()
+        self.assertIn('test_total 1\n', self.registry.exposition())
+
+
+class MetricsViewTest(TestCase):
+
+    def setUp(self):
+        self.metrics_dir = tempfile.mkdtemp()
+        self.override = override_settings(METRICS_DIR=self.metrics_dir, METRICS_TOKEN='segredo')
+        self.override.enable()
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.metrics_dir)
+
+    def value(self, series):
+        response = self.client.get(r('metrics'), HTTP_AUTHORIZATION='Bearer segredo')
+        self.assertEqual('text/plain; version=0.0.4; charset=utf-8', response['Content-Type'])
+        for line in response.content.decode().splitlines():
+            if line.startswith(series + ' '):
+                return float(line.split()[1])
+        return 0
+
+    def test_checkins(self):
+        user = User.objects.create_user('testuser', 'test@user.com', 'senha123')
+        self.client.force_login(user)
+        checkins = self.value('gerencex_checkins_total{kind="checkin"}')
+        latencies = self.value('gerencex_checkin_seconds_count')
+        self.client.post(r('timing_new'))
+        self.assertEqual(checkins + 1, self.value('gerencex_checkins_total{kind="checkin"}'))
+        self.assertEqual(latencies + 1, self.value('gerencex_checkin_seconds_count'))
+
+    def test_all_metrics_documented(self):
+        response = self.client.get(r('metrics'), HTTP_AUTHORIZATION='Bearer segredo')
+        for metric in registry.metrics:
+            self.assertContains(response, '# TYPE {} {}'.format(metric.name, metric.kind))
+
+    def test_token(self):
+        self.assertEqual(401, self.client.get(r('metrics')).status_code)
+        response = self.client.get(r('metrics'), HTTP_AUTHORIZATION='Bearer errado')
+        self.assertEqual(401, response.status_code)
+        response = self.client.get(r('metrics'), HTTP_AUTHORIZATION='Bearer segredo')
+        self.assertEqual(200, response.status_code)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_without_token(self):
+        """
+        Only the staff users see the metrics
+        """
+        self.assertEqual(401, self.client.get(r('metrics')).status_code)
+        self.assertEqual(401, self.client.get(r('metrics'),
+                                              HTTP_AUTHORIZATION='Bearer ').status_code)
+        user = User.objects.create_user('testuser', 'test@user.com', 'senha123')
+        self.client.force_login(user)
+        self.assertEqual(401, self.client.get(r('metrics')).status_code)
+        user.is_staff = True
+        user.save()
+        self.assertEqual(200, self.client.get(r('metrics')).status_code)
+
+    @override_settings(METRICS_TOKEN='', METRICS_PUBLIC=True)
+    def test_public(self):
+        self.assertEqual(200, self.client.get(r('metrics')).status_code)
+
+
+class TestRunnerTest(SimpleTestCase):
+
+    def test_throwaway_metrics_dir(self):
+        """
+        The tests must not write to the METRICS_DIR of the host (see test_runner.py)
+        """
+        self.assertTrue(os.path.basename(settings.METRICS_DIR).startswith(
+            'gerencex-test-metrics-'))
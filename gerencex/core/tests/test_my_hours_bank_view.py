@@ -5,7 +5,7 @@ from django.contrib.auth.models import User
 from django.shortcuts import resolve_url as r
 from django.test import TestCase
 from django.utils import timezone
-from gerencex.core.models import Timing, Office, Restday, Absences
+from gerencex.core.models import Timing, Office, Restday, Absences, HoursBalance
 
 
 class MyHoursBankViewTest(TestCase):
@@ -110,6 +110,51 @@ class MyHoursBankViewTest(TestCase):
                 self.assertContains(self.resp2, expected)
 
 
+class UserBalanceTest(TestCase):
+    """
+    The month statement is read in a fixed number of queries. See UserBalance, at functions.py
+    """
+    def setUp(self):
+        self.office = Office.objects.create(name='Terceira Diacomp',
+                                            initials='DIACOMP3',
+                                            hours_control_start_date=datetime.date(2016, 1, 1))
+        self.user = User.objects.create_user('testuser', 'test@user.com', 'senha123')
+        self.user.userdetail.office = self.office
+        self.user.save()
+        Restday.objects.create(date=datetime.date(2016, 1, 25), note='Feriado de teste')
+        Absences.objects.create(date=datetime.date(2016, 1, 26), user=self.user, cause='LM')
+        for day in range(4, 30):
+            Timing.objects.create(user=self.user,
+                                  date_time=timezone.make_aware(
+                                      datetime.datetime(2016, 1, day, 9, 0, 0)),
+                                  checkin=True)
+            Timing.objects.create(user=self.user,
+                                  date_time=timezone.make_aware(
+                                      datetime.datetime(2016, 1, day, 16, 0, 0)),
+                                  checkin=False)
+
+    def statement(self):
+        from gerencex.core.views import UserBalance
+        user = User.objects.select_related('userdetail__office').get(pk=self.user.pk)
+        return UserBalance(user, year=2016, month=1).get_monthly_lines()
+
+    def test_statement(self):
+        # The missing lines are calculated and written in bulk
+        with self.assertNumQueries(19):
+            lines = self.statement()
+        self.assertEqual(31, len(lines))
+        self.assertEqual(31, HoursBalance.objects.count())
+        self.assertEqual('Feriado de teste. ', lines[24]['comment'])
+        self.assertEqual('Licença médica. ', lines[25]['comment'])
+        self.assertEqual('Fim de semana. ', lines[30]['comment'])
+        self.assertEqual(lines[-1]['balance'], HoursBalance.objects.last().time_balance())
+
+        # The user, the existent lines, the restdays and the absences are read at once (the
+        # restday calendar is not cached while the test transaction is not committed)
+        with self.assertNumQueries(4):
+            self.assertEqual(lines, self.statement())
+
+
 def activate_timezone():
     return timezone.activate(pytz.timezone('America/Sao_Paulo'))
 
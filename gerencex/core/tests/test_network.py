@@ -0,0 +1,79 @@
+import threading
+import time
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.shortcuts import resolve_url as r
+from django.test import TestCase, SimpleTestCase, override_settings
+from gerencex.core import network
+from gerencex.core.models import Office, Timing
+from gerencex.core.network import NetworkPolicy
+
+
+class NetworkPolicyTest(SimpleTestCase):
+
+    def setUp(self):
+        self.resolved = threading.Event()
+
+    def resolver(self, site):
+        self.resolved.set()
+        return site, [], ['200.181.10.5']
+
+    def test_not_enforced(self):
+        policy = NetworkPolicy(networks=['10.0.0.0/8'])
+        self.assertTrue(policy.allows('192.168.0.1'))
+
+    def test_cidr(self):
+        policy = NetworkPolicy(networks=['10.0.0.0/8', ' 172.16.0.0/12'], enforce=True)
+        self.assertTrue(policy.allows('10.1.2.3'))
+        self.assertTrue(policy.allows('172.20.0.1'))
+        self.assertFalse(policy.allows('192.168.0.1'))
+        self.assertFalse(policy.allows('not an ip'))
+        self.assertFalse(policy.allows(None))
+
+    def test_site_is_resolved_in_background(self):
+        policy = NetworkPolicy(site='example.com', enforce=True, resolver=self.resolver)
+
+        # The request does not wait for the resolution
+        policy.allows('200.181.10.77')
+        self.assertTrue(self.resolved.wait(5))
+        while policy.refreshing:
+            time.sleep(0.01)
+        self.assertTrue(policy.allows('200.181.10.77'))
+        self.assertFalse(policy.allows('200.181.11.1'))
+
+        # The resolution is reused while it is fresh
+        self.resolved.clear()
+        policy.allows('200.181.10.77')
+        self.assertFalse(policy.refreshing)
+        self.assertFalse(self.resolved.is_set())
+
+    def test_failed_resolution_keeps_the_networks(self):
+        policy = NetworkPolicy(site='example.com', enforce=True, resolver=self.resolver)
+        policy.refresh()
+        policy.resolver = mock.Mock(side_effect=OSError)
+        policy.refresh()
+        self.assertTrue(policy.allows('200.181.10.77'))
+
+
+@override_settings(CHECK_CLIENT_NETWORK=True, COMPANY_NETWORKS=['10.0.0.0/8'], COMPANY_SITE='',
+                   DEVELOPER_HOSTNAME='')
+class TimingNetworkTest(TestCase):
+
+    def setUp(self):
+        Office.objects.create(name='Nenhuma lotação', initials='NL')
+        User.objects.create_user('testuser', 'test@user.com', 'senha123')
+        self.client.login(username='testuser', password='senha123')
+        network.network_policy = None
+
+    def tearDown(self):
+        network.network_policy = None
+
+    def test_outside_the_company(self):
+        resp = self.client.post(r('timing_new'), REMOTE_ADDR='192.168.0.1')
+        self.assertTemplateUsed(resp, 'invalid_check.html')
+        self.assertFalse(Timing.objects.exists())
+
+    def test_inside_the_company(self):
+        resp = self.client.post(r('timing_new'), REMOTE_ADDR='10.1.2.3')
+        self.assertRedirects(resp, r('timing', Timing.objects.get().pk))
@@ -0,0 +1,172 @@
+import datetime
+
+from django.contrib.auth.models import User
+from django.shortcuts import resolve_url as r
+from django.test import TestCase
+from django.utils import timezone
+from gerencex.core.models import Office, Timing, Absences
+from gerencex.core.query_budget import QueryBudget, QueryBudgetExceeded, normalized
+from gerencex.core.time_calculations import local_midnight
+from gerencex.urls import urlpatterns
+
+
+class QueryBudgetTest(TestCase):
+
+    def setUp(self):
+        for name in ('ana', 'bruno', 'carla'):
+            User.objects.create_user(name)
+
+    def test_within_budget(self):
+        with QueryBudget(1) as budget:
+            list(User.objects.all())
+        self.assertEqual(1, len(budget))
+
+    def test_exceeded(self):
+        """
+        The report shows the repeated queries, with their parameters replaced
+        """
+        with self.assertRaises(QueryBudgetExceeded) as context:
+            with QueryBudget(2, label='users'):
+                for user in User.objects.all():
+                    user.userdetail.office
+        report = str(context.exception)
+        self.assertIn('users: 7 queries run, over the budget of 2', report)
+        self.assertIn('    3 x SELECT', report)
+
+    def test_decorator(self):
+        @QueryBudget(1)
+        def users():
+            return [user.userdetail for user in User.objects.all()]
+
+        with self.assertRaises(QueryBudgetExceeded):
+            users()
+
+    def test_normalized(self):
+        self.assertEqual('SELECT ? FROM "a" WHERE "b" = ? AND "c" IN (...)',
+                         normalized('SELECT 1 FROM "a" WHERE "b" = \'it\'\'s\' AND "c" IN (1, 2)'))
+
+
+class ViewQueryBudgetTest(TestCase):
+    """
+    The pages of urls.py, requested by a worker of an office. Their numbers of queries must not
+    grow with the number of workers of the office, nor with the number of days of their tickets.
+    """
+    # The maximum number of queries of each page, including the session, the user and its
+    # groups, read by base.html
+    BUDGETS = {
+        'home': 5,
+        'hours_bank': 8,
+        'my_hours_bank': 12,
+        'my_tickets': 10,
+        'calculations': 10,
+        'calculate_hours_bank': 5,
+        'export_balances': 3,
+        'rules': 5,
+        'timing': 5,
+        'timing_fail': 4,
+        'office_tickets': 6,
+        'forgotten_checkouts': 7,
+        'absence_new': 7,
+        'absences': 11,
+        'absences_office': 6,
+        'restdays': 5,
+        'manual_check': 7,
+        'metrics': 2,
+    }
+
+    def setUp(self):
+        self.today = timezone.localtime(timezone.now()).date()
+        self.month = (self.today.replace(day=1) - datetime.timedelta(days=1)).replace(day=1)
+        self.office = Office.objects.create(name='Terceira Diacomp', initials='DIACOMP3')
+        self.user = User.objects.create_superuser('chefe', 'chefe@tcu.gov.br', 'senha123')
+        self.user.userdetail.office = self.office
+        self.user.save()
+        self.client.force_login(self.user)
+        self.users = [self.user]
+
+    def populate(self, users, begin):
+        """
+        Adds workers to the office, all of them checking in and out in the weekdays since begin.
+        The hours control starts at begin.
+        """
+        for n in range(users):
+            user = User.objects.create_user('user{}'.format(len(self.users)),
+                                            first_name='Servidor {}'.format(len(self.users)))
+            user.userdetail.office = self.office
+            user.save()
+            self.users.append(user)
+        tickets = []
+        date_ = begin
+        while date_ < self.today:
+            if date_.weekday() < 5:
+                for user in self.users:
+                    tickets.append(Timing(user=user,
+                                          date_time=local_midnight(date_) +
+                                          datetime.timedelta(hours=9)))
+                    tickets.append(Timing(user=user,
+                                          date_time=local_midnight(date_) +
+                                          datetime.timedelta(hours=17),
+                                          checkin=False))
+            date_ += datetime.timedelta(days=1)
+        Timing.objects.bulk_create(tickets)
+        Absences.objects.bulk_create([Absences(user=user, date=begin)
+                                      for user in self.users[-users:]])
+        self.office.hours_control_start_date = begin
+        self.office.save()
+
+    def urls(self):
+        month = self.month
+        ticket = Timing.objects.filter(user=self.user).last()
+        return {
+            'home': r('home'),
+            'hours_bank': r('hours_bank'),
+            'my_hours_bank': r('my_hours_bank', self.user.username, month.year, month.month),
+            'my_tickets': r('my_tickets', self.user.username, month.year, month.month),
+            'calculations': r('calculations', self.user.username, month.year, month.month, 2),
+            'calculate_hours_bank': r('calculate_hours_bank'),
+            'export_balances': r('export_balances'),
+            'rules': r('rules'),
+            'timing': r('timing', ticket.pk),
+            'timing_fail': r('timing_fail'),
+            'office_tickets': r('office_tickets'),
+            'forgotten_checkouts': r('forgotten_checkouts'),
+            'absence_new': r('absence_new'),
+            'absences': r('absences', self.user.username, month.year),
+            'absences_office': r('absences_office'),
+            'restdays': r('restdays', month.year),
+            'manual_check': r('manual_check'),
+            'metrics': r('metrics'),
+        }
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(200, response.status_code, url)
+        if response.streaming:
+            b''.join(response.streaming_content)
+
+    def query_counts(self):
+        """
+        Each page is requested twice: the first request may write the missing balance lines
+        :return: The number of queries of the second request of each page
+        """
+        counts = {}
+        for name, url in self.urls().items():
+            self.get(url)
+            with QueryBudget(self.BUDGETS[name], label=name) as budget:
+                self.get(url)
+            counts[name] = len(budget)
+        return counts
+
+    def test_budgets_cover_all_pages(self):
+        """
+        The pages which only accept POST are covered by their own tests
+        """
+        not_pages = {'logout', 'timing_new', 'api_timing_new', 'api_timing_batch'}
+        names = {pattern.name for pattern in urlpatterns if getattr(pattern, 'name', None)}
+        self.assertEqual(names - not_pages, set(self.BUDGETS))
+
+    def test_constant_queries(self):
+        self.populate(2, self.month)
+        small = self.query_counts()
+        self.populate(8, self.month - datetime.timedelta(days=90))
+        self.assertEqual(small, self.query_counts())
@@ -0,0 +1,95 @@
+import datetime
+
+from django.db import transaction
+from django.test import TestCase
+from gerencex.core.models import Restday
+from gerencex.core.restday_calendar import CalendarCache, get_restday_calendar, \
+    increment_version
+
+
+class RestdayCalendarTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Restday.objects.create(date=datetime.date(2016, 9, 7),
+                               note='Independência',
+                               work_hours=datetime.timedelta(hours=0))
+        Restday.objects.create(date=datetime.date(2016, 10, 12),
+                               note='N. Sª Aparecida',
+                               work_hours=datetime.timedelta(hours=0))
+        Restday.objects.create(date=datetime.date(2017, 2, 28),
+                               note='Carnaval',
+                               work_hours=datetime.timedelta(hours=4))
+
+    def test_get(self):
+        restday = get_restday_calendar().get(datetime.date(2017, 2, 28))
+        self.assertEqual('Carnaval', restday.note)
+        self.assertEqual(datetime.timedelta(hours=4), restday.work_hours)
+        self.assertIsNone(get_restday_calendar().get(datetime.date(2017, 3, 1)))
+
+    def test_between(self):
+        days = get_restday_calendar().between(datetime.date(2016, 9, 7),
+                                              datetime.date(2017, 2, 28))
+        self.assertEqual(['Independência', 'N. Sª Aparecida'], [d.note for d in days])
+        self.assertEqual(['Carnaval'], [d.note for d in get_restday_calendar().in_year(2017)])
+
+    def test_save_and_delete_change_the_calendar(self):
+        date = datetime.date(2016, 11, 15)
+        self.assertNotIn(date, get_restday_calendar())
+
+        restday = Restday.objects.create(date=date, note='Proclamação da República')
+        self.assertIn(date, get_restday_calendar())
+
+        restday.delete()
+        self.assertNotIn(date, get_restday_calendar())
+
+
+class CalendarCacheTest(TestCase):
+
+    def test_loaded_once(self):
+        """
+        The version and the restdays are read once
+        """
+        calendar_cache = CalendarCache()
+        with self.assertNumQueries(2):
+            calendar_cache.get()
+            calendar_cache.get()
+
+    def test_reloaded_when_another_process_changes_the_version(self):
+        """
+        The version is kept in the database, so that the processes of other hosts see it
+        """
+        calendar_cache = CalendarCache(check_interval=0)
+        calendar_cache.get()
+        with self.assertNumQueries(1):
+            calendar_cache.get()
+
+        other_process = CalendarCache()
+        Restday.objects.create(date=datetime.date(2016, 11, 15), note='Proclamação')
+        other_process.invalidate()
+        with self.assertNumQueries(2):
+            self.assertIn(datetime.date(2016, 11, 15), calendar_cache.get())
+
+    def test_version_checked_at_intervals(self):
+        calendar_cache = CalendarCache(check_interval=3600)
+        calendar_cache.get()
+        increment_version()
+        with self.assertNumQueries(0):
+            calendar_cache.get()
+
+    def test_cached_again_after_a_rollback(self):
+        """
+        A rolled back change must not keep the calendar from being cached
+        """
+        calendar_cache = CalendarCache()
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                Restday.objects.create(date=datetime.date(2016, 11, 15), note='Proclamação')
+                calendar_cache.invalidate()
+                self.assertIn(datetime.date(2016, 11, 15), calendar_cache.get())
+                raise ValueError
+
+        # The version and the restdays
+        with self.assertNumQueries(2):
+            self.assertNotIn(datetime.date(2016, 11, 15), calendar_cache.get())
+            calendar_cache.get()
@@ -5,7 +5,9 @@ from django.contrib.auth.models import User
 from django.test import TestCase
 from django.utils import timezone
 from gerencex.core.models import Timing, Restday, Absences, Office
-from gerencex.core.time_calculations import DateData
+from gerencex.core.restday_calendar import get_restday_calendar
+from gerencex.core.time_calculations import DateData, PeriodData, Tickets, current_tz, \
+    local_midnight
 
 
 class TimeCalculationsTest(TestCase):
@@ -76,6 +78,122 @@ class TimeCalculationsTest(TestCase):
         debit = DateData(self.user, datetime.date(2016, 10, 10)).debit()
         self.assertEqual(datetime.timedelta(hours=0), debit)
 
+    def test_registries_are_loaded_once(self):
+        """
+        Userdetail, office, absence and tickets are queried once, however many components are
+        calculated. The restday calendar is kept in memory (see restday_calendar.py).
+        """
+        get_restday_calendar()
+        Absences.objects.create(date=datetime.date(2016, 10, 10), user=self.user, cause='CR',
+                                credit=3600, debit=0)
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(4):
+            date_data = DateData(user, datetime.date(2016, 10, 10))
+            date_data.credit()
+            date_data.debit()
+            date_data.regular_credit()
+            date_data.absence_credit_delta()
+            date_data.min_work_hours_for_credit_delta()
+            date_data.max_daily_credit_delta()
+            date_data.tickets()
+
+
+class PeriodDataTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        office = Office.objects.create(name='Terceira Diacomp',
+                                       initials='DIACOMP3',
+                                       hours_control_start_date=datetime.date(2016, 10, 3),
+                                       min_checkin_time=True,
+                                       max_daily_credit=True)
+        cls.users = []
+        for n in range(3):
+            user = User.objects.create_user('testuser{}'.format(n), 'test@user.com', 'senha123')
+            user.userdetail.office = office
+            user.userdetail.opening_hours_balance = 3600 * (n - 1)
+            user.save()
+            cls.users.append(user)
+
+        cls.begin = datetime.date(2016, 10, 3)
+        cls.end = datetime.date(2016, 10, 17)
+        d = cls.begin
+        while d < cls.end:
+            for user in cls.users:
+                for hour, checkin in ((7, True), (12, False), (13, True), (22, False)):
+                    Timing.objects.create(
+                        user=user,
+                        date_time=timezone.make_aware(datetime.datetime(d.year, d.month, d.day,
+                                                                        hour, 30)),
+                        checkin=checkin
+                    )
+            d += datetime.timedelta(days=1)
+
+        Restday.objects.create(date=datetime.date(2016, 10, 12),
+                               note='Feriado N. Sª Aparecida',
+                               work_hours=datetime.timedelta(hours=0))
+        Restday.objects.create(date=datetime.date(2016, 10, 14),
+                               note='Ponto facultativo',
+                               work_hours=datetime.timedelta(hours=4))
+        Absences.objects.create(date=datetime.date(2016, 10, 5), user=cls.users[0],
+                                cause='LM', credit=0, debit=25200)
+        Absences.objects.create(date=datetime.date(2016, 10, 6), user=cls.users[1],
+                                cause='CR', credit=7200, debit=0)
+
+    def test_same_results_as_datedata(self):
+        for user, date, credit, debit in PeriodData(self.users, self.begin, self.end).cells():
+            with self.subTest(user=user.username, date=date):
+                self.assertEqual(DateData(user, date).credit(), credit)
+                self.assertEqual(DateData(user, date).debit(), debit)
+
+    def test_constant_number_of_queries(self):
+        with self.assertNumQueries(4):
+            cells = list(PeriodData(self.users, self.begin, self.end).cells())
+        self.assertEqual(len(self.users) * (self.end - self.begin).days, len(cells))
+
+
+class DaylightSavingTimeTest(TestCase):
+    """
+    In America/Sao_Paulo, daylight saving time began at midnight of 2016-10-16: the clocks went
+    from 23:59:59 of the 15th to 01:00 of the 16th, so that day had 23 hours
+    """
+    date = datetime.date(2016, 10, 16)
+
+    @classmethod
+    def setUpTestData(cls):
+        Office.objects.create(name='Nenhuma lotação', initials='NL')
+        cls.user = User.objects.create_user('testuser', 'test@user.com', 'senha123')
+
+    def utc(self, *args):
+        return datetime.datetime(*args, tzinfo=pytz.utc)
+
+    def test_local_midnight(self):
+        begin = local_midnight(self.date)
+        end = local_midnight(self.date + datetime.timedelta(days=1))
+        self.assertEqual(self.utc(2016, 10, 16, 3), begin)
+        self.assertEqual(datetime.time(1), begin.astimezone(current_tz).time())
+        self.assertEqual(self.utc(2016, 10, 17, 2), end)
+        self.assertEqual(datetime.timedelta(hours=23), end - begin)
+        self.assertEqual(begin, local_midnight(self.date - datetime.timedelta(days=1)) +
+                         datetime.timedelta(hours=24))
+
+    def test_tickets_of_the_day(self):
+        """
+        The tickets of the day are those from 01:00 (UTC-2) on, up until the next midnight
+        """
+        for date_time, checkin in ((self.utc(2016, 10, 16, 2, 30), False),  # 23:30 of the 15th
+                                   (self.utc(2016, 10, 16, 3), True),       # 01:00
+                                   (self.utc(2016, 10, 17, 1, 59), False),  # 23:59
+                                   (self.utc(2016, 10, 17, 2), True)):      # 00:00 of the 17th
+            Timing.objects.create(user=self.user, date_time=date_time, checkin=checkin)
+
+        timings = Tickets(self.user, self.date).timings()
+        self.assertEqual([self.utc(2016, 10, 16, 3), self.utc(2016, 10, 17, 1, 59)],
+                         [t.date_time for t in timings])
+        self.assertEqual([datetime.time(1), datetime.time(23, 59)],
+                         [t['date_time'].time() for t in
+                          Tickets(self.user, self.date).tickets()])
+
 
 def activate_timezone():
     return timezone.activate(pytz.timezone('America/Sao_Paulo'))
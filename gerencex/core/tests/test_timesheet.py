@@ -0,0 +1,109 @@
+import calendar
+import datetime
+import os
+import shutil
+import tempfile
+import zipfile
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from gerencex.core.models import Office, Timing, HoursBalance, Absences, Restday
+from gerencex.core.timesheet import office_timesheets, render_timesheet, write_timesheets
+
+
+class TimesheetTest(TestCase):
+
+    def setUp(self):
+        today = timezone.localtime(timezone.now()).date()
+        self.month = (today.replace(day=1) - datetime.timedelta(days=1)).replace(day=1)
+        self.office = Office.objects.create(name='Terceira Diacomp',
+                                            initials='DIACOMP3',
+                                            checkin_tolerance=datetime.timedelta(minutes=0),
+                                            checkout_tolerance=datetime.timedelta(minutes=0),
+                                            hours_control_start_date=self.month)
+        self.users = []
+        for name in ('bruno', 'ana'):
+            user = User.objects.create_user(name, first_name=name.title())
+            user.userdetail.office = self.office
+            user.save()
+            self.users.append(user)
+            for hour, checkin in ((9, True), (12, False)):
+                Timing.objects.create(
+                    user=user,
+                    date_time=timezone.make_aware(datetime.datetime.combine(
+                        self.month + datetime.timedelta(days=2), datetime.time(hour))),
+                    checkin=checkin)
+        Restday.objects.create(date=self.month + datetime.timedelta(days=4), note='Feriado')
+        Absences.objects.create(user=self.users[0],
+                                date=self.month + datetime.timedelta(days=3),
+                                cause='1')
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def sheets(self):
+        return office_timesheets(self.office, self.month.year, self.month.month)
+
+    def test_timesheets(self):
+        sheets = self.sheets()
+        self.assertEqual(['ana', 'bruno'], [s['username'] for s in sheets])
+
+        # The missing lines are written
+        days = calendar.monthrange(self.month.year, self.month.month)[1]
+        self.assertEqual(2 * days, HoursBalance.objects.count())
+
+        day = sheets[1]['days'][2]
+        self.assertEqual([('09:00:00', True), ('12:00:00', False)], day['tickets'])
+        self.assertEqual('3:00:00', day['credit'])
+        self.assertIn('Abertura da conta de horas', sheets[1]['days'][0]['comment'])
+        self.assertTrue(sheets[1]['days'][3]['comment'])
+        self.assertIn('Feriado', sheets[0]['days'][4]['comment'])
+        self.assertEqual(sheets[1]['days'][-1]['balance'], sheets[1]['balance'])
+
+    def test_queries(self):
+        """
+        Once the lines exist, the month of the office is read in a fixed number of queries: the
+        users, absences, tickets and balance lines, and the restday calendar (which is not cached
+        while the test transaction is not committed)
+        """
+        self.sheets()
+        for n in range(5):
+            user = User.objects.create_user('user{}'.format(n))
+            user.userdetail.office = self.office
+            user.save()
+        self.sheets()
+        with self.assertNumQueries(6):
+            self.sheets()
+
+    def test_render(self):
+        sheet = self.sheets()[0]
+        files = dict(render_timesheet(sheet))
+        name = 'ana_{:%Y_%m}'.format(self.month)
+        self.assertIn('Espelho de ponto', files[name + '.html'])
+        self.assertIn('09:00:00 (E)', files[name + '.html'])
+        lines = files[name + '.csv'].splitlines()
+        self.assertEqual('data;registros;crédito;débito;saldo;observação', lines[0])
+        self.assertIn('09:00:00E 12:00:00S;3:00:00', lines[3])
+
+    def test_write_directory(self):
+        written = write_timesheets(self.sheets(), self.tempdir, formats=('csv',), workers=1)
+        self.assertEqual(2, written)
+        self.assertEqual(2, len(os.listdir(self.tempdir)))
+
+    def test_process_pool(self):
+        output = os.path.join(self.tempdir, 'espelhos.zip')
+        sequential = dict(f for s in self.sheets() for f in render_timesheet(s))
+        self.assertEqual(4, write_timesheets(self.sheets(), output, workers=2))
+        with zipfile.ZipFile(output) as archive:
+            self.assertEqual(sequential, {name: archive.read(name).decode('utf-8')
+                                          for name in archive.namelist()})
+
+    def test_command(self):
+        out = StringIO()
+        call_command('timesheets', 'DIACOMP3', str(self.month.year), str(self.month.month),
+                     self.tempdir, format=['html'], workers=1, stdout=out)
+        self.assertIn('2 espelhos de ponto, 2 arquivos', out.getvalue())
@@ -1,9 +1,11 @@
 import datetime
+from io import StringIO
 
 import pytz
 from django.contrib.auth.models import User
+from django.core.management import call_command
 from django.shortcuts import resolve_url as r
-from django.test import TestCase
+from django.test import TestCase, LiveServerTestCase
 from django.utils import timezone
 from gerencex.core.models import UserDetail, Timing, Office
 
@@ -86,6 +88,68 @@ class TimingViewTest(TestCase):
         self.assertFalse(checked_in)
 
 
+class ApiTimingTest(TestCase):
+    """
+    The JSON check in API. See 'api_timing_new', at views.py
+    """
+    def setUp(self):
+        Office.objects.create(name='Nenhuma lotação', initials='NL')
+        self.user = User.objects.create_user('testuser', 'test@user.com', 'senha123')
+        self.client.login(username='testuser', password='senha123')
+
+    def test_checkin_and_checkout(self):
+        resp = self.client.post(r('api_timing_new'))
+        self.assertEqual(201, resp.status_code)
+        ticket = Timing.objects.get()
+        self.assertEqual({'pk': ticket.pk,
+                          'checkin': True,
+                          'date_time': ticket.date_time.isoformat()}, resp.json())
+
+        resp = self.client.post(r('api_timing_new'))
+        self.assertEqual(201, resp.status_code)
+        self.assertFalse(resp.json()['checkin'])
+        self.assertFalse(UserDetail.objects.get(user=self.user).atwork)
+
+    def test_invalid_checkout(self):
+        Timing.objects.create(user=self.user,
+                              date_time=timezone.now() - datetime.timedelta(days=1),
+                              checkin=True)
+        resp = self.client.post(r('api_timing_new'))
+        self.assertEqual(409, resp.status_code)
+        self.assertFalse(UserDetail.objects.get(user=self.user).atwork)
+        self.assertEqual(1, Timing.objects.count())
+
+    def test_not_post(self):
+        self.assertEqual(405, self.client.get(r('api_timing_new')).status_code)
+
+    def test_anonymous(self):
+        self.client.logout()
+        self.assertEqual(401, self.client.post(r('api_timing_new')).status_code)
+
+
+class LoadTestCommandTest(LiveServerTestCase):
+
+    def setUp(self):
+        Office.objects.create(pk=1, name='Nenhuma lotação', initials='NL')
+
+    def test_load_test(self):
+        """
+        A single user: the in-memory SQLite database of the tests does not take concurrent
+        writes
+        """
+        out = StringIO()
+        call_command('loadtest_checkins', server=self.live_server_url, users=1, rounds=4,
+                     stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertIn('p99 ms', lines[0])
+        self.assertEqual(['timing_new', 'timing_new + redirect', 'api_timing_new'],
+                         [line[:24].strip() for line in lines[1:]])
+        # 4 requests per endpoint, none of them failed
+        self.assertEqual([['4', '0']] * 3, [line[24:].split()[:2] for line in lines[1:]])
+        self.assertEqual(0, Timing.objects.count())
+        self.assertFalse(User.objects.filter(username__startswith='loadtest_').exists())
+
+
 class TimingModelTest(TestCase):
 
     @classmethod
@@ -105,6 +169,28 @@ class TimingModelTest(TestCase):
         default_values = (t.checkin, t.created_by)
         self.assertTupleEqual((True, None), default_values)
 
+    def test_open_session(self):
+        """The open session is the user's last ticket, if it is a check in (see signals.py)"""
+        checkin = Timing.objects.create(
+            user=self.user,
+            date_time=timezone.make_aware(datetime.datetime(2016, 10, 19, 7, 0, 0, 0))
+        )
+        detail = UserDetail.objects.get(user=self.user)
+        self.assertEqual((checkin, checkin.date_time, True),
+                         (detail.open_ticket, detail.open_since, detail.atwork))
+
+        checkout = Timing.objects.create(
+            user=self.user,
+            date_time=timezone.make_aware(datetime.datetime(2016, 10, 19, 12, 0, 0, 0)),
+            checkin=False
+        )
+        detail = UserDetail.objects.get(user=self.user)
+        self.assertEqual((None, None, False),
+                         (detail.open_ticket, detail.open_since, detail.atwork))
+
+        checkout.delete()
+        self.assertEqual(checkin, UserDetail.objects.get(user=self.user).open_ticket)
+
 
 def activate_timezone():
     return timezone.activate(pytz.timezone('America/Sao_Paulo'))
@@ -1,6 +1,7 @@
 from django.contrib.auth.models import User
+from django.shortcuts import resolve_url as r
 from django.test import TestCase
-from gerencex.core.models import Office
+from gerencex.core.models import Office, Timing, UserDetail
 
 
 class UserDetailTest(TestCase):
@@ -34,3 +35,37 @@ class UserDetailTest(TestCase):
         self.assertFalse(atwork)
         self.assertEqual('NL', office)
 
+
+    def test_user_save_keeps_the_derived_fields(self):
+        """
+        Saving a user does not write back the open session of a stale UserDetail
+        """
+        user = User.objects.get(username='testuser')
+        user.userdetail
+        Timing.objects.create(user=self.user, checkin=True)
+        user.first_name = 'Test'
+        user.save()
+        detail = UserDetail.objects.get(user=self.user)
+        self.assertTrue(detail.atwork)
+        self.assertIsNotNone(detail.open_ticket)
+
+
+class UserDetailAdminTest(TestCase):
+
+    def setUp(self):
+        Office.objects.create(name='Nenhuma lotação',
+                              initials='NL')
+        self.admin = User.objects.create_superuser('admin', 'admin@user.com', 'senha123')
+        self.user = User.objects.create_user('testuser', 'test@user.com', 'senha123')
+        Timing.objects.create(user=self.user, checkin=True)
+        self.client.force_login(self.admin)
+
+    def test_derived_fields_are_readonly(self):
+        """
+        The admin user page does not list the tickets to choose the open session from
+        """
+        resp = self.client.get(r('admin:auth_user_change', self.user.pk))
+        self.assertEqual(200, resp.status_code)
+        self.assertNotContains(resp, 'name="userdetail-0-open_ticket"')
+        self.assertNotContains(resp, 'name="userdetail-0-atwork"')
+        self.assertContains(resp, 'name="userdetail-0-pis"')
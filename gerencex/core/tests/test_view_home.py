@@ -1,6 +1,10 @@
+import datetime
+
 from django.contrib.auth.models import User
 from django.shortcuts import resolve_url as r
 from django.test import TestCase
+from django.utils import timezone
+from gerencex.core.models import HoursBalance, Office, Timing, UserDetail
 
 
 class HomeTest(TestCase):
@@ -17,3 +21,37 @@ class HomeTest(TestCase):
     def test_template(self):
         """Must use index.html"""
         self.assertTemplateUsed(self.response, 'index.html')
+
+
+class HomeSummaryTest(TestCase):
+    """
+    Home is rendered from the user's UserDetail, plus the presence list
+    """
+    def setUp(self):
+        Office.objects.create(name='Nenhuma lotação', initials='NL')
+        self.user = User.objects.create_user('testuser', 'test@user.com', 'senha123')
+        self.user.first_name = 'Ze'
+        self.user.save()
+        self.client.login(username='testuser', password='senha123')
+
+        now = timezone.now()
+        self.checkin = Timing.objects.create(user=self.user,
+                                             date_time=now - datetime.timedelta(minutes=2),
+                                             checkin=True)
+        yesterday = timezone.localtime(now).date() - datetime.timedelta(days=1)
+        HoursBalance.objects.create(date=yesterday, user=self.user, credit=3600, debit=0)
+
+    def test_summary(self):
+        detail = UserDetail.objects.get(user=self.user)
+        self.assertEqual(self.checkin.date_time, detail.last_ticket_at)
+        self.assertEqual([(self.checkin.date_time, True)], detail.tickets_of_last_day())
+        self.assertEqual(3600, detail.balance)
+
+    def test_html(self):
+        # Session, user, UserDetail, user groups (at base.html) and the presence list
+        with self.assertNumQueries(5):
+            resp = self.client.get(r('home'))
+        self.assertContains(resp, 'Último registro: ENTRADA')
+        self.assertContains(resp, 'Saldo de horas (posição de ontem): 1:00:00')
+        self.assertContains(resp, 'Meus registros de hoje')
+        self.assertContains(resp, '<li>Ze </li>')
@@ -1,10 +1,46 @@
 import datetime
+import functools
+from collections import defaultdict
+
+import pytz
+from django.contrib.auth.models import User
 from django.utils import timezone
-from gerencex.core.models import Restday, Timing, Absences
+from gerencex.core.instrumentation import timed
+from gerencex.core.metrics import DATEDATA_EVALUATIONS
+from gerencex.core.models import Timing, Absences
+from gerencex.core.restday_calendar import get_restday_calendar
 
 current_tz = timezone.get_current_timezone()
 
 
+def local_midnight(date):
+    """
+    :return: The aware datetime at which 'date' begins, in the local timezone. When daylight
+    saving time begins at midnight (as it used to in Brazil), the day begins at 01:00.
+    """
+    midnight = datetime.datetime.combine(date, datetime.time.min)
+    try:
+        return timezone.make_aware(midnight, current_tz, is_dst=None)
+    except pytz.NonExistentTimeError:
+        return timezone.make_aware(midnight, current_tz, is_dst=False)
+    except pytz.AmbiguousTimeError:
+        return timezone.make_aware(midnight, current_tz, is_dst=True)
+
+
+def memoized(method):
+    """
+    Caches the result of a method without arguments in the instance, so that each registry and
+    each credit or debit component is loaded or calculated only once per instance
+    """
+    @functools.wraps(method)
+    def wrapper(self):
+        cache = self.__dict__.setdefault('_memoized', {})
+        if method.__name__ not in cache:
+            cache[method.__name__] = method(self)
+        return cache[method.__name__]
+    return wrapper
+
+
 class UserParameters:
 
     def __init__(self, user):
@@ -38,33 +74,41 @@ class DateParameters:
         """
         self.date = date
         self.zero = datetime.timedelta(seconds=0)
-        self.is_restday = bool(Restday.objects.filter(date=self.date))
+        self.is_restday = self.restday() is not None
         self.is_weekend = self.date.weekday() in (5, 6)
 
+    @memoized
+    def restday(self):
+        """
+        :return: The restday registered for the date (see restday_calendar.py), or None
+        """
+        return get_restday_calendar().get(self.date)
+
 
 class Tickets(UserParameters, DateParameters):
     def __init__(self, user, date):
         UserParameters.__init__(self, user)
         DateParameters.__init__(self, date)
 
+    @memoized
+    def timings(self):
+        """
+        :return: The Timing registries of the user whose local date is the given date
+        """
+        next_day = self.date + datetime.timedelta(days=1)
+        return [t for t in Timing.objects.filter(
+                user=self.user,
+                date_time__gte=local_midnight(self.date),
+                date_time__lt=local_midnight(next_day))
+                ]
+
     def tickets(self):
         """
         :return: The list of check in and checkout tickets for a given user, in a given date
         """
-        day_before = self.date - datetime.timedelta(days=1)
-        day_after = self.date + datetime.timedelta(days=1)
-        tickets1 = [t for t in Timing.objects.filter(
-                    user=self.user,
-                    date_time__date__gte=day_before,
-                    date_time__date__lte=day_after).all()
-                    ]
-
-        tickets2 = [x for x in tickets1
-                    if x.date_time.astimezone(current_tz).date() == self.date
-                    ]
         return [{'checkin': y.checkin,
                  'date_time': y.date_time.astimezone(current_tz)}
-                 for y in tickets2
+                 for y in self.timings()
                 ]
 
     def adjusted_tickets(self):
@@ -116,7 +160,7 @@ class DateData(Tickets):
         """
         Tickets.__init__(self, user, date)
         self.is_opening_balance = self.date == self.start_control_date
-        self.is_absence = bool(Absences.objects.filter(date=self.date, user=self.user))
+        self.is_absence = self.absence() is not None
         self.is_regular = not (
             self.is_restday or
             self.is_weekend or
@@ -124,31 +168,40 @@ class DateData(Tickets):
             self.is_opening_balance
         )
 
+    @memoized
+    def absence(self):
+        """
+        :return: The Absences registry of the user for the date, or None
+        """
+        return Absences.objects.filter(user=self.user, date=self.date).first()
 
     #####################
     #   Debit methods   #
     #####################
 
+    @memoized
     def regular_debit(self):
         if self.is_weekend:
             return self.zero
         if self.is_restday:
-            restday = Restday.objects.get(date=self.date)
-            return restday.work_hours
+            return self.restday().work_hours
         return self.regular_work_hours
 
+    @memoized
     def opening_debit_delta(self):
         if self.is_opening_balance and self.opening_balance < 0:
             return datetime.timedelta(seconds=-self.opening_balance)
         return self.zero
 
+    @memoized
     def absence_debit_delta(self):
         if self.is_absence and not self.is_weekend and not self.is_restday:
-            absence = Absences.objects.get(user=self.user, date=self.date)
-            debit_int = -absence.debit
+            debit_int = -self.absence().debit
             return datetime.timedelta(seconds=debit_int)
         return self.zero
 
+    @memoized
+    @timed('calc')
     def debit(self):
         debit = self.regular_debit() + \
                 self.opening_debit_delta() + \
@@ -159,6 +212,7 @@ class DateData(Tickets):
     #   Credit methods  #
     #####################
 
+    @memoized
     def regular_credit(self):
         credit = self.zero
         tickets = self.tickets()
@@ -187,6 +241,7 @@ class DateData(Tickets):
 
         return credit
 
+    @memoized
     def opening_credit_delta(self):
         """
         :return: The initial credit set up for a user
@@ -195,16 +250,17 @@ class DateData(Tickets):
             return datetime.timedelta(seconds=self.opening_balance)
         return self.zero
 
+    @memoized
     def absence_credit_delta(self):
         """
         :return: The credit due to courses, external work etc.
         """
         if self.is_absence:
-            absence = Absences.objects.get(user=self.user, date=self.date)
-            credit_int = absence.credit
+            credit_int = self.absence().credit
             return datetime.timedelta(seconds=credit_int)
         return self.zero
 
+    @memoized
     def min_work_hours_for_credit_delta(self):
         """
         :return: A negative timedelta if needed, due to min_work_hours_for_credit restriction
@@ -221,6 +277,7 @@ class DateData(Tickets):
                 delta = -(min_work_hours_for_credit['value'] - regular_work_hours)
         return delta
 
+    @memoized
     def max_daily_credit_delta(self):
         """
         :return: A negative timedelta if needed, due to max_daily_credit restriction
@@ -233,10 +290,99 @@ class DateData(Tickets):
             return -(credit - max_daily_credit['value'])
         return self.zero
 
+    @memoized
+    @timed('calc')
     def credit(self):
+        DATEDATA_EVALUATIONS.inc()
         credit = self.regular_credit() + \
                  self.opening_credit_delta() + \
                  self.absence_credit_delta() + \
                  self.min_work_hours_for_credit_delta() + \
                  self.max_daily_credit_delta()
         return credit
+
+
+class PreloadedDateData(DateData):
+    """
+    A DateData whose absence and tickets were loaded beforehand by PeriodData
+    """
+    def __init__(self, user, date, restday, absence, timings):
+        self._restday = restday
+        self._absence = absence
+        self._timings = timings
+        DateData.__init__(self, user, date)
+
+    def restday(self):
+        return self._restday
+
+    def absence(self):
+        return self._absence
+
+    def timings(self):
+        return self._timings
+
+
+class PeriodData:
+    """
+    The credits and debits of a set of users, for all dates between begin and (end - 1).
+
+    Users, offices, absences and tickets are loaded in a fixed number of queries,
+    whatever the number of users and dates. The results are the same as DateData's.
+    """
+    def __init__(self, users, begin, end):
+        self.begin = begin
+        self.end = end
+        self.users = [u for u in User.objects.filter(
+                      pk__in=[u.pk for u in users]).select_related(
+                      'userdetail__office').order_by('pk')]
+
+        self.restdays = get_restday_calendar()
+        self.absences = {(a.user_id, a.date): a for a in Absences.objects.filter(
+                         user__in=self.users, date__gte=begin, date__lt=end)}
+
+        self.timings = defaultdict(list)
+        for t in Timing.objects.filter(user__in=self.users,
+                                       date_time__gte=local_midnight(begin),
+                                       date_time__lt=local_midnight(end)).order_by('date_time'):
+            self.timings[(t.user_id, t.date_time.astimezone(current_tz).date())].append(t)
+
+    def dates(self):
+        d = self.begin
+        while d < self.end:
+            yield d
+            d += datetime.timedelta(days=1)
+
+    def date_data(self, user, date):
+        """
+        :return: The DateData for user and date, built out of the preloaded registries
+        """
+        return PreloadedDateData(user,
+                                 date,
+                                 self.restdays.get(date),
+                                 self.absences.get((user.pk, date)),
+                                 self.timings.get((user.pk, date), []))
+
+    def credit(self, user, date):
+        return self.date_data(user, date).credit()
+
+    def debit(self, user, date):
+        return self.date_data(user, date).debit()
+
+    def user_cells(self, user, begin=None):
+        """
+        :return: A (date, credit, debit) tuple for each date of the period, from 'begin' on, if
+        informed
+        """
+        for date in self.dates():
+            if begin is None or date >= begin:
+                date_data = self.date_data(user, date)
+                yield date, date_data.credit(), date_data.debit()
+
+    def cells(self):
+        """
+        :return: A (user, date, credit, debit) tuple for each user and date of the period, ordered
+        by user and date
+        """
+        for user in self.users:
+            for date, credit, debit in self.user_cells(user):
+                yield user, date, credit, debit
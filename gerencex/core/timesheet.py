@@ -0,0 +1,161 @@
+"""
+The monthly timesheets ("espelhos de ponto") of all workers of an office: the tickets, credit,
+debit, balance and comments of each day.
+
+The month of the whole office is loaded in the main process, in a fixed number of queries (see
+PeriodData). The timesheets are then plain data, rendered to HTML and CSV by a process pool, and
+written to a directory or to a single zip file.
+"""
+import calendar
+import csv
+import io
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+from django.contrib.auth.models import User
+from django.template.loader import render_to_string
+from django.utils import timezone
+from gerencex.core.functions import dates, day_comments
+from gerencex.core.jobs import close_idle_connections, setup_worker
+from gerencex.core.ledger import write_lines
+from gerencex.core.models import HoursBalance, signed_time
+from gerencex.core.time_calculations import PeriodData, current_tz
+
+FORMATS = ('html', 'csv')
+
+CSV_HEADER = ('data', 'registros', 'crédito', 'débito', 'saldo', 'observação')
+
+
+def office_timesheets(office, year, month):
+    """
+    The balance lines missing in the month are calculated and written, as at UserBalance.
+    :return: The timesheets of the office workers, as dicts of picklable values, ordered by name
+    """
+    today = timezone.localtime(timezone.now()).date()
+    first_month_day = date(year, month, 1)
+    next_month_day = first_month_day + timedelta(days=calendar.monthrange(year, month)[1])
+    begin = max(first_month_day, office.hours_control_start_date)
+    end = min(today, next_month_day)
+    month_dates = list(dates(begin, end))
+
+    users = User.objects.filter(userdetail__office=office)
+    period = PeriodData(users, begin, end)
+    lines = balance_lines(period.users, begin, end)
+
+    missing = [user for user in period.users
+               if any((user.pk, d) not in lines for d in month_dates)]
+    for user in missing:
+        first_missing = next(d for d in month_dates if (user.pk, d) not in lines)
+        cells = []
+        for date_ in dates(first_missing, end):
+            line = lines.get((user.pk, date_))
+            if line is None:
+                date_data = period.date_data(user, date_)
+                cells.append((date_,
+                              int(date_data.credit().total_seconds()),
+                              int(date_data.debit().total_seconds())))
+            else:
+                cells.append((date_, line.credit, line.debit))
+        write_lines(user.pk, cells)
+    if missing:
+        lines.update(balance_lines(missing, begin, end))
+
+    sheets = []
+    for user in sorted(period.users, key=lambda u: (u.first_name, u.last_name, u.username)):
+        days = []
+        for date_ in month_dates:
+            line = lines[(user.pk, date_)]
+            days.append({
+                'date': date_,
+                'tickets': [(t.date_time.astimezone(current_tz).strftime('%H:%M:%S'), t.checkin)
+                            for t in period.timings.get((user.pk, date_), [])],
+                'credit': line.time_credit(),
+                'debit': line.time_debit(),
+                'balance': line.time_balance(),
+                'comment': day_comments(date_,
+                                        office,
+                                        period.restdays.get(date_),
+                                        period.absences.get((user.pk, date_)))
+            })
+        sheets.append({'username': user.username,
+                       'first_name': user.first_name,
+                       'last_name': user.last_name,
+                       'office': office.name,
+                       'month': first_month_day,
+                       'days': days,
+                       'balance': days[-1]['balance'] if days else signed_time(0)})
+    return sheets
+
+
+def balance_lines(users, begin, end):
+    """
+    :return: The HoursBalance lines of the users between begin and (end - 1), by (user, date)
+    """
+    return {(line.user_id, line.date): line for line in HoursBalance.objects.filter(
+            user__in=users, date__gte=begin, date__lt=end)}
+
+
+def render_timesheet(sheet, formats=FORMATS):
+    """
+    Runs at the process pool, so it must not touch the database
+    :return: (file name, content) tuples, one for each format
+    """
+    setup_worker()
+
+    name = '{}_{:%Y_%m}'.format(sheet['username'], sheet['month'])
+    files = []
+    if 'html' in formats:
+        files.append((name + '.html', render_to_string('timesheet.html', sheet)))
+    if 'csv' in formats:
+        content = io.StringIO()
+        writer = csv.writer(content, delimiter=';')
+        writer.writerow(CSV_HEADER)
+        for day in sheet['days']:
+            writer.writerow((day['date'].strftime('%d/%m/%Y'),
+                             ' '.join('{}{}'.format(time_, 'E' if checkin else 'S')
+                                      for time_, checkin in day['tickets']),
+                             day['credit'], day['debit'], day['balance'], day['comment']))
+        files.append((name + '.csv', content.getvalue()))
+    return files
+
+
+def rendered_files(sheets, formats=FORMATS, workers=None):
+    """
+    :param workers: the number of processes. The timesheets are rendered in the current process if
+    it is 1.
+    :return: An iterator over the (file name, content) tuples of the timesheets
+    """
+    if workers == 1 or len(sheets) < 2:
+        for sheet in sheets:
+            yield from render_timesheet(sheet, formats)
+        return
+
+    close_idle_connections()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunksize = max(1, len(sheets) // (4 * (workers or os.cpu_count() or 1)))
+        for files in executor.map(render_timesheet, sheets, [formats] * len(sheets),
+                                  chunksize=chunksize):
+            yield from files
+
+
+def write_timesheets(sheets, output, formats=FORMATS, workers=None):
+    """
+    :param output: a directory, created if needed, or a file name ending with '.zip'
+    :return: The number of files written
+    """
+    files = rendered_files(sheets, formats, workers)
+    written = 0
+    if output.endswith('.zip'):
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name, content in files:
+                archive.writestr(name, content)
+                written += 1
+    else:
+        os.makedirs(output, exist_ok=True)
+        for name, content in files:
+            with open(os.path.join(output, name), 'w', encoding='utf-8') as file:
+                file.write(content)
+            written += 1
+    return written
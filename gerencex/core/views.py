@@ -1,50 +1,77 @@
+import base64
+import binascii
 import calendar
-import socket
+import json
 from datetime import timedelta, datetime, date
 
-from decouple import config
+from django.conf import settings
+from django.contrib.auth import authenticate
 from django.contrib.auth.decorators import login_required, permission_required
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
-from django.http import HttpResponseRedirect
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse, \
+    HttpResponseBadRequest
 from django.shortcuts import render, get_object_or_404, resolve_url as r
 from django.utils import timezone
-from gerencex.core.forms import AbsencesForm, GenerateBalanceForm, CheckForm
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from gerencex.core.export import balance_rows, csv_lines, linked_offices
+from gerencex.core.forms import AbsencesForm, GenerateBalanceForm, CheckForm, PeriodForm, \
+    BalanceExportForm
 from gerencex.core.functions import get_client_ip, previous_next, \
-    UserBalance, updates_hours_balance
-from gerencex.core.models import Timing, Absences, Restday, HoursBalance, Office
-from gerencex.core.time_calculations import DateData
+    UserBalance, updates_hours_balance, toggle_ticket
+from gerencex.core.ingestion import ingest
+from gerencex.core.jobs import enqueue_recalculation, active_job
+from gerencex.core.metrics import registry
+from gerencex.core.models import Timing, Absences, HoursBalance, Office, UserDetail, \
+    signed_time
+from gerencex.core.network import get_network_policy
+from gerencex.core.restday_calendar import get_restday_calendar
+from gerencex.core.time_calculations import DateData, local_midnight
 
 current_tz = timezone.get_current_timezone()
 
+# Number of registries in each page of long listings
+PAGE_SIZE = 50
+
+# Days listed by forgotten_checkouts when no initial date is informed
+FORGOTTEN_CHECKOUTS_DAYS = 60
+
+# Tickets accepted by each request to api_timing_batch
+MAX_BATCH_SIZE = 5000
+
 
 @login_required
 def home(request):
-    today = timezone.now().date()
+    """
+    The user's last ticket, today's tickets and last balance are read from UserDetail, where they
+    are kept up to date by signals (see signals.py and ledger.py)
+    """
+    today = timezone.localtime(timezone.now()).date()
     balance_date = today - timedelta(days=1)
-    at_work = request.user.userdetail.atwork
+    detail = request.user.userdetail
 
     def friendly(x):
         return 'entrada' if x else 'saída'
 
-    status = friendly(at_work)
-    tickets = Timing.objects.filter(user=request.user)
-    date_time = tickets.last().date_time if tickets else ''
-    line = HoursBalance.objects.filter(user=request.user, date=balance_date)
-    balance = line.last().time_balance() if line else ''
-
-    today_tickets = Timing.objects.filter(user=request.user, date_time__date=today).all()
-    tickets = []
-    if today_tickets:
-        tickets = [
-            {'status': friendly(x.checkin),
-             'date_time': x.date_time}
-            for x in today_tickets
-        ]
+    status = friendly(detail.atwork)
+    date_time = detail.last_ticket_at or ''
+    balance = signed_time(detail.balance) if detail.balance_date == balance_date else ''
 
-    office = request.user.userdetail.office
-    users = User.objects.filter(userdetail__office=office,
-                                userdetail__atwork=True).order_by('first_name')
+    tickets = [
+        {'status': friendly(checkin),
+         'date_time': date_time_}
+        for date_time_, checkin in detail.tickets_of_last_day()
+        if date_time_.astimezone(current_tz).date() == today
+    ]
+
+    users = User.objects.filter(userdetail__office=detail.office_id,
+                                userdetail__open_since__gte=local_midnight(today)
+                                ).order_by('first_name')
 
     context = {
         'status': status,
@@ -60,60 +87,94 @@ def home(request):
 def timing_new(request):
 
     # The check ins and checkouts are allowed only at office. We try to guarantee this by
-    # assuring that the client IP is close to the company IP. Do you suggest a better test?
+    # assuring that the client IP is in the company networks (see network.py).
 
-    company_site = config('COMPANY_SITE', default='')
-    company_ips = socket.gethostbyname_ex(company_site)[2] if company_site else ''
-    client_ip = get_client_ip(request)[1]
-    client_local_ip = get_client_ip(request)[0]
-    client_partial_ip = ".".join(client_ip.split('.')[0:3])
+    client_local_ip, client_ip = get_client_ip(request)
 
-    # We need to allow check ins and checkouts from developer workstation, to avoid breaking the
-    # tests
-    server_hostname = socket.gethostname()
-    valid_hostname = config('DEVELOPER_HOSTNAME', default='')
-
-#    if not (server_hostname == valid_hostname or client_partial_ip in " ".join(company_ips)):
-#        return render(request, 'invalid_check.html')
+    if not get_network_policy().allows(client_ip):
+        return render(request, 'invalid_check.html')
 
     if request.method == 'POST':
-        if request.user.userdetail.atwork:
-            request.user.userdetail.atwork = False
-            request.user.userdetail.save()
-            ticket = Timing(user=request.user,
-                            checkin=False,
-                            created_by=request.user,
-                            client_ip=client_ip,
-                            client_local_ip=client_local_ip)
-            """
-            Checkout time is recorded only if there is a checkin in the same day.
-            """
-            # utc_offset = datetime.now(pytz.timezone('America/Sao_Paulo')).utcoffset()
-            # date_ = (ticket.date_time + utc_offset).date()
-            date_ = ticket.date_time.astimezone(current_tz).date()
-            required_checkin = timezone.make_aware(
-                datetime(date_.year, date_.month, date_.day, 0, 0, 0),
-            )
-            valid_checkout = bool(Timing.objects.filter(user=request.user,
-                                                        date_time__gte=required_checkin,
-                                                        checkin=True))
-
-            if valid_checkout:
-                ticket.save()
-            else:
-                return HttpResponseRedirect(r('timing_fail'))
-        else:
-            request.user.userdetail.atwork = True
-            request.user.userdetail.save()
-            ticket = Timing.objects.create(user=request.user,
-                                           checkin=True,
-                                           created_by=request.user,
-                                           client_ip=client_ip,
-                                           client_local_ip=client_local_ip)
+        ticket = toggle_ticket(request.user, client_ip, client_local_ip)
+        if ticket is None:
+            return HttpResponseRedirect(r('timing_fail'))
         return HttpResponseRedirect(r('timing', ticket.pk))
     return render(request, 'timing_new_not_post.html')
 
 
+@require_POST
+def api_timing_new(request):
+    """
+    Records a check in, or a checkout, and returns the ticket in JSON, without redirecting.
+    The balances are not touched: today's balance is calculated only tomorrow.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Autenticação necessária.'}, status=401)
+
+    client_local_ip, client_ip = get_client_ip(request)
+    if not get_network_policy().allows(client_ip):
+        return JsonResponse({'error': 'Registro permitido apenas no local de trabalho.'},
+                            status=403)
+
+    ticket = toggle_ticket(request.user, client_ip, client_local_ip)
+    if ticket is None:
+        return JsonResponse({'error': 'Saída sem entrada registrada no mesmo dia.'}, status=409)
+    return JsonResponse({'pk': ticket.pk,
+                         'checkin': ticket.checkin,
+                         'date_time': ticket.date_time.isoformat()},
+                        status=201)
+
+
+def basic_auth_user(request):
+    """
+    :return: The user of the request, authenticated by the session or by HTTP Basic, or None
+    """
+    if request.user.is_authenticated:
+        return request.user
+    method, _, credentials = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    if method.lower() != 'basic':
+        return None
+    try:
+        username, _, password = base64.b64decode(credentials).decode('utf-8').partition(':')
+    except (binascii.Error, UnicodeDecodeError):
+        return None
+    return authenticate(request, username=username, password=password)
+
+
+@csrf_exempt
+@require_POST
+def api_timing_batch(request):
+    """
+    Records a batch of tickets sent by a kiosk or badge reader, as a JSON object like
+    {"tickets": [{"user": "username", "date_time": "2016-10-03T08:00:00", "checkin": true,
+    "client_ip": "10.0.0.1"}, ...]}. See ingestion.py. The terminal authenticates by HTTP Basic,
+    as a user allowed to add tickets. Since it sends no cookie, CSRF does not apply.
+    """
+    user = basic_auth_user(request)
+    if user is None:
+        return JsonResponse({'error': 'Autenticação necessária.'}, status=401)
+    if not user.has_perm('core.add_timing'):
+        return JsonResponse({'error': 'Permissão negada.'}, status=403)
+    if request.content_type != 'application/json':
+        return JsonResponse({'error': 'Envie os registros em JSON.'}, status=415)
+
+    try:
+        tickets = json.loads(request.body.decode('utf-8'))['tickets']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'JSON inválido.'}, status=400)
+    if not isinstance(tickets, list):
+        return JsonResponse({'error': 'JSON inválido.'}, status=400)
+    if len(tickets) > MAX_BATCH_SIZE:
+        return JsonResponse({'error': 'Envie no máximo {} registros.'.format(MAX_BATCH_SIZE)},
+                            status=413)
+
+    result = ingest(tickets, created_by=user)
+    return JsonResponse({'created': result.created,
+                         'duplicates': result.duplicates,
+                         'errors': [{'index': idx, 'error': error}
+                                    for idx, error in result.errors]})
+
+
 @login_required
 def timing(request, pk):
     context = {}
@@ -137,7 +198,7 @@ def timing_fail(request):
 def office_tickets(request):
     user = request.user
     office = user.userdetail.office
-    users = [u.user for u in office.users.all()]
+    users = User.objects.filter(userdetail__office=office)
     context = {
         'office': office,
         'user': user,
@@ -148,25 +209,50 @@ def office_tickets(request):
 
 @login_required
 def forgotten_checkouts(request):
-    """Get the check ins which have no check outs at the same day, via an indirect approach: two
-    consecutive check ins indicate the target."""
-
-    tickets = [x for x in Timing.objects.all().order_by('user', 'date_time')]
-
-    regs = []
-
-    lim = len(tickets) - 1
-    for idx in range(0, lim):
-        t1 = tickets[idx]
-        t2 = tickets[idx + 1]
-        if t1.user == t2.user and t1.checkin and t2.checkin:
-            regs.append({
-                'pk': t1.pk,
-                'name': t1.user.first_name,
-                'date': t1.date_time
-            })
+    """Get the check ins which have no check outs, via an indirect approach: two consecutive check
+    ins indicate the target. The next ticket of each check in is looked up by the database, through
+    the (user, date_time) index, so only the office check ins in the chosen period are read, one
+    page at a time. The check ins still open are read from the users' open sessions."""
+    office = request.user.userdetail.office
+    today = timezone.localtime(timezone.now()).date()
+    form = PeriodForm(request.GET or None)
+    begin = end = None
+    if form.is_valid():
+        begin = form.cleaned_data['begin']
+        end = form.cleaned_data['end']
+    begin = begin or today - timedelta(days=FORGOTTEN_CHECKOUTS_DAYS)
+    end = end or today
+
+    next_ticket = Timing.objects.filter(user=OuterRef('user'),
+                                        date_time__gt=OuterRef('date_time')).order_by('date_time')
+    tickets = Timing.objects.filter(
+        user__userdetail__office=office,
+        checkin=True,
+        date_time__gte=local_midnight(begin),
+        date_time__lt=local_midnight(end + timedelta(days=1))
+    ).annotate(
+        next_checkin=Subquery(next_ticket.values('checkin')[:1])
+    ).filter(next_checkin=True).select_related('user').order_by('user', 'date_time')
+
+    regs = Paginator(tickets, PAGE_SIZE).get_page(request.GET.get('page'))
+    params = request.GET.copy()
+    params.pop('page', None)
+
+    # The check ins still open since before today
+    open_sessions = UserDetail.objects.filter(
+        office=office,
+        open_since__lt=local_midnight(today)
+    ).select_related('user', 'open_ticket').order_by('open_since')
 
-    return render(request, 'forgotten_checkouts.html', {'regs': regs})
+    context = {
+        'open_sessions': open_sessions,
+        'form': form,
+        'begin': begin,
+        'end': end,
+        'regs': regs,
+        'params': params.urlencode()
+    }
+    return render(request, 'forgotten_checkouts.html', context)
 
 
 @login_required
@@ -245,7 +331,7 @@ def absences(request, username, year):
 def absences_office(request):
     user = request.user
     office = user.userdetail.office
-    users = [u.user for u in office.users.all()]
+    users = User.objects.filter(userdetail__office=office)
     context = {
         'office': office,
         'user': user,
@@ -257,7 +343,8 @@ def absences_office(request):
 @login_required
 def hours_bank(request):
     """
-    Shows the balance of hours of office workers. It must show the balances for yesterday.
+    Shows the balance of hours of office workers. It must show the balances for yesterday, or the
+    last ones calculated, while a recalculation is running.
     """
     office = request.user.userdetail.office
     # users = [u.user for u in office.users.all()]
@@ -275,27 +362,65 @@ def hours_bank(request):
         date_ = date(year, month, day)
         request.session.pop('begin_date')
 
-    # Updates HoursBalance, if needed:
-    updates_hours_balance(office, date_)
+    # A requested recalculation runs out of the request path (see jobs.py). Meanwhile, the
+    # balances already calculated are shown.
+    if date_:
+        enqueue_recalculation(office, date_)
+    job = active_job(office)
+
+    # The balances are brought up until yesterday by the nightly close_balances command. If it
+    # didn't run today, they are updated here.
+    if job is None and office.last_balance_date != today:
+        updates_hours_balance(office, None)
 
     # Generates context for template
+    last_balance = HoursBalance.objects.filter(user=OuterRef('pk'),
+                                               date__lte=yesterday).order_by('-date')
+    users = users.annotate(balance=Subquery(last_balance.values('balance')[:1]))
     lines = []
     for user in users:
         lines.append(
             {'username': user.username,
              'first_name': user.first_name,
              'last_name': user.last_name,
-             'balance': HoursBalance.objects.get(
-                 date=yesterday,
-                 user=user).time_balance()
+             'balance': signed_time(user.balance) if user.balance is not None else ''
              }
         )
     return render(request, 'hours_bank.html',
                   {'office': office,
-                   'lines': lines}
+                   'lines': lines,
+                   'job': job,
+                   'export_form': BalanceExportForm(initial={'office': office})}
                   )
 
 
+@login_required
+@permission_required('core.view_hoursbalance')
+def export_balances(request):
+    """
+    Streams the daily balances of the chosen offices, or of all of them, as CSV, for the payroll.
+    The lines are read and written a chunk at a time (see export.py), so a whole year of the
+    organisation is exported in constant memory. The default period is the current month.
+    """
+    form = BalanceExportForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
+
+    yesterday = timezone.localtime(timezone.now()).date() - timedelta(days=1)
+    begin = form.cleaned_data['begin'] or yesterday.replace(day=1)
+    end = form.cleaned_data['end'] or yesterday
+    office = form.cleaned_data['office']
+    offices = None
+    if office is not None:
+        offices = linked_offices(office) if form.cleaned_data['linked'] else {office.pk}
+
+    response = StreamingHttpResponse(csv_lines(balance_rows(begin, end, offices)),
+                                     content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = 'attachment; filename="saldos_{}_{}_{}.csv"'.format(
+        office.initials if office else 'todas', begin, end)
+    return response
+
+
 @login_required
 @permission_required(['core.change_hoursbalance'])
 def calculate_hours_bank(request):
@@ -519,16 +644,16 @@ def my_tickets(request, username, year, month):
 @login_required
 def restdays(request, year):
     year = int(year)
-    rest_days = [x for x in Restday.objects.filter(date__year=year).all()]
+    calendar_ = get_restday_calendar()
     list_ = []
-    for restday in rest_days:
+    for restday in calendar_.in_year(year):
         list_.append(
             {'date': restday.date,
              'note': restday.note,
              'work_hours': restday.work_hours}
         )
-    has_previous_year = bool(Restday.objects.filter(date__year=year-1))
-    has_next_year = bool(Restday.objects.filter(date__year=year+1))
+    has_previous_year = bool(calendar_.in_year(year-1))
+    has_next_year = bool(calendar_.in_year(year+1))
 
     previous = year - 1 if has_previous_year else None
     next_ = year + 1 if has_next_year else None
@@ -570,12 +695,14 @@ def manual_check(request):
             )
             status = True if (check_in == '1') else False
 
-            Timing.objects.create(
-                user=user,
-                date_time=datetime_,
-                checkin=status,
-                created_by=request.user
-            )
+            with transaction.atomic():
+                UserDetail.objects.select_for_update().get(user=user)
+                Timing.objects.create(
+                    user=user,
+                    date_time=datetime_,
+                    checkin=status,
+                    created_by=request.user
+                )
 
             return HttpResponseRedirect(r('my_tickets',
                                           username=user.username,
@@ -588,3 +715,19 @@ def manual_check(request):
 
     form = CheckForm(users=users)
     return render(request, 'manual_check.html', {'form': form})
+
+
+def metrics(request):
+    """
+    The counters and histograms of all the processes of the host, in the Prometheus text format
+    (see metrics.py). They are shown to the scraper which sends METRICS_TOKEN as a bearer token,
+    and to the staff users. METRICS_PUBLIC shows them to anyone.
+    """
+    token = settings.METRICS_TOKEN
+    authorized = settings.METRICS_PUBLIC or (
+        token and constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''),
+                                        'Bearer {}'.format(token)))
+    if not authorized and not request.user.is_staff:
+        return HttpResponse('Token inválido.', status=401, content_type='text/plain')
+    return HttpResponse(registry.exposition(),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
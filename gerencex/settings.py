@@ -11,7 +11,8 @@ https://docs.djangoproject.com/en/1.9/ref/settings/
 """
 
 import os
-from decouple import config
+import tempfile
+from decouple import config, Csv
 from dj_database_url import parse as dburl
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -47,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'gerencex.core.instrumentation.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -55,13 +57,15 @@ MIDDLEWARE = [
     # 'django.contrib.auth.middleware.SessionAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'gerencex.core.instrumentation.ProfilerMiddleware',
 ]
 
 ROOT_URLCONF = 'gerencex.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # The Django backend, timing the rendering for the Server-Timing header
+        'BACKEND': 'gerencex.core.instrumentation.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -88,6 +92,70 @@ DATABASES = {
 }
 
 
+# The processes compare the version of their in-memory restday calendar with the one in the
+# database at most every RESTDAY_CALENDAR_CHECK_INTERVAL seconds (see core/restday_calendar.py)
+
+RESTDAY_CALENDAR_CHECK_INTERVAL = config('RESTDAY_CALENDAR_CHECK_INTERVAL', default=5, cast=int)
+
+
+# Check ins and checkouts network policy (see core/network.py)
+# They are allowed only from the COMPANY_NETWORKS CIDR ranges, or from the networks of the
+# COMPANY_SITE addresses, if CHECK_CLIENT_NETWORK is set. The site is resolved in the
+# background every COMPANY_SITE_TTL seconds.
+
+CHECK_CLIENT_NETWORK = config('CHECK_CLIENT_NETWORK', default=False, cast=bool)
+COMPANY_NETWORKS = config('COMPANY_NETWORKS', default='', cast=Csv())
+COMPANY_SITE = config('COMPANY_SITE', default='')
+COMPANY_SITE_PREFIX_LENGTH = config('COMPANY_SITE_PREFIX_LENGTH', default=24, cast=int)
+COMPANY_SITE_TTL = config('COMPANY_SITE_TTL', default=300, cast=int)
+DEVELOPER_HOSTNAME = config('DEVELOPER_HOSTNAME', default='')
+
+
+# Performance instrumentation (see core/instrumentation.py)
+# If SERVER_TIMING is set, the database, calculation, signals and rendering times of each request
+# are sent in the Server-Timing header and logged, as JSON, by the 'gerencex.performance' logger.
+
+SERVER_TIMING = config('SERVER_TIMING', default=False, cast=bool)
+
+# Staff users may profile a single request by adding '?profile' to its URL. With
+# '?profile=file', the stats are saved at PROFILE_DIR.
+
+PROFILE_DIR = config('PROFILE_DIR',
+                     default=os.path.join(tempfile.gettempdir(), 'gerencex_profiles'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'gerencex.performance': {
+            'handlers': ['console'],
+            'level': config('PERFORMANCE_LOG_LEVEL', default='INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+
+# Metrics, in the Prometheus text format, at /metrics (see core/metrics.py). The values of each
+# process are written to METRICS_DIR, which must be shared by all the workers of the host. The
+# scraper must send METRICS_TOKEN as a bearer token. Without a token, only the staff users see
+# them, unless METRICS_PUBLIC is set.
+
+METRICS_DIR = config('METRICS_DIR',
+                     default=os.path.join(tempfile.gettempdir(), 'gerencex_metrics'))
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+METRICS_PUBLIC = config('METRICS_PUBLIC', default=False, cast=bool)
+
+# The tests write their metrics to a throwaway METRICS_DIR
+
+TEST_RUNNER = 'gerencex.test_runner.TestRunner'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
 
@@ -0,0 +1,39 @@
+import shutil
+import tempfile
+
+from django.db.models.signals import post_migrate
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+from gerencex.core.metrics import registry
+from gerencex.core.restday_calendar import recheck_restday_calendar
+
+
+def recheck_calendar(sender, **kwargs):
+    recheck_restday_calendar()
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Writes the metrics recorded by the tests to a throwaway METRICS_DIR, instead of the one
+    shared by the processes of the host, which /metrics would report.
+
+    The tests run in a single process, whose restday calendar is invalidated by the Restday
+    signals, so the version of the calendar is not checked in the database periodically: the
+    number of queries of a test must not depend on how long it takes. It is checked after the
+    database is flushed by a TransactionTestCase, which deletes the restdays without signals.
+    """
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.metrics_dir = tempfile.mkdtemp(prefix='gerencex-test-metrics-')
+        self.test_settings = override_settings(METRICS_DIR=self.metrics_dir,
+                                               RESTDAY_CALENDAR_CHECK_INTERVAL=24 * 3600)
+        self.test_settings.enable()
+        post_migrate.connect(recheck_calendar)
+
+    def teardown_test_environment(self, **kwargs):
+        # Otherwise, the values left would be written to the host's METRICS_DIR at exit
+        registry.clear()
+        post_migrate.disconnect(recheck_calendar)
+        self.test_settings.disable()
+        shutil.rmtree(self.metrics_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
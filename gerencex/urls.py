@@ -18,7 +18,8 @@ from django.contrib import admin
 from django.contrib.auth.views import LogoutView
 from gerencex.core.views import home, my_hours_bank, hours_bank, timing, timing_new, \
     timing_fail, forgotten_checkouts, absences, absence_new, rules, calculate_hours_bank, my_tickets, \
-    restdays, calculations, absences_office, office_tickets, manual_check
+    restdays, calculations, absences_office, office_tickets, manual_check, api_timing_new, \
+    api_timing_batch, export_balances, metrics
 
 urlpatterns = [
     url('^logout/$', LogoutView.as_view(next_page='home'), name='logout'),
@@ -28,6 +29,7 @@ urlpatterns = [
     url(r'^banco_de_horas/(?P<username>\w+)/(?P<year>\d{4})/(?P<month>\d{1,2})/$', my_hours_bank,
         name='my_hours_bank'),
     url(r'^banco_de_horas/calcular', calculate_hours_bank, name='calculate_hours_bank'),
+    url(r'^banco_de_horas/exportar/$', export_balances, name='export_balances'),
     url(r'^banco_de_horas/regras/$', rules, name='rules'),
     url(r'^banco_de_horas/(?P<username>\w+)/(?P<year>\d{4})/(?P<month>\d{1,2})/(?P<day>\d{1,2})/$',
         calculations, name='calculations'),
@@ -44,6 +46,9 @@ urlpatterns = [
         name='my_tickets'),
     url(r'^dias_inuteis/(?P<year>\d{4})/$', restdays, name='restdays'),
     url(r'^registro_manual/novo/$', manual_check, name='manual_check'),
+    url(r'^api/registros_de_ponto/novo/$', api_timing_new, name='api_timing_new'),
+    url(r'^api/registros_de_ponto/lote/$', api_timing_batch, name='api_timing_batch'),
+    url(r'^metrics$', metrics, name='metrics'),
     url(r'^admin/', admin.site.urls),
 ]
 